@@ -0,0 +1,186 @@
+# VERSION 7 START
+# This file caches AI responses (event descriptions, advertising suggestions) in the database.
+# Requests are keyed by a hash of the normalised messages, model, temperature and max_tokens, so
+# clicking an AI button again with the same event details returns the stored text instantly instead
+# of paying for another model call. Entries expire after AI_CACHE_TTL_SECONDS, and the least recently
+# used ones are evicted once the table goes over AI_CACHE_MAX_ENTRIES or AI_CACHE_MAX_BYTES.
+
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from models import db, AIResponseCache
+from openrouter_client import resolve_model
+from ai_gateway import gateway, request_key
+
+
+def _lookup(key, now):
+    # Returns the stored response if it has not expired, recording the hit for LRU eviction.
+    # Runs on a connection of its own, so the caller's session is never committed or rolled back here.
+    with db.engine.connect() as conn:
+        response = conn.execute(
+            select(AIResponseCache.response).where(AIResponseCache.key == key, AIResponseCache.expires_at > now)
+        ).scalar()
+        if response is None:
+            return None
+        try:
+            conn.execute(
+                update(AIResponseCache)
+                .where(AIResponseCache.key == key)
+                .values(hit_count=AIResponseCache.hit_count + 1, last_used_at=now)
+            )
+            conn.commit()
+        except SQLAlchemyError:
+            # Best effort: only the LRU bookkeeping is lost (e.g. the database is busy), the hit is still served
+            conn.rollback()
+            current_app.logger.warning("Could not record the AI cache hit", exc_info=True)
+    return response
+
+
+def _store(session, key, model, text, now, ttl):
+    # Replaces any previous (expired or force-refreshed) entry for the key
+    session.execute(delete(AIResponseCache).where(AIResponseCache.key == key))
+    session.add(AIResponseCache(
+        key=key,
+        model=model,
+        response=text,
+        size_bytes=len(text.encode("utf-8")),
+        hit_count=0,
+        created_at=now,
+        expires_at=now + timedelta(seconds=ttl),
+        last_used_at=now,
+    ))
+    session.commit()
+
+
+def evict_ai_cache(max_entries=None, max_bytes=None, now=None, session=None):
+    # Deletes expired entries, then the least recently used ones until the table fits both limits.
+    # Returns the number of entries removed.
+    session = session or db.session
+    cfg = current_app.config
+    max_entries = cfg.get("AI_CACHE_MAX_ENTRIES", 5000) if max_entries is None else max_entries
+    max_bytes = cfg.get("AI_CACHE_MAX_BYTES", 20 * 1024 * 1024) if max_bytes is None else max_bytes
+    now = now or datetime.utcnow()
+
+    removed = session.execute(delete(AIResponseCache).where(AIResponseCache.expires_at <= now)).rowcount or 0
+    count, total_bytes = session.execute(
+        select(func.count(AIResponseCache.key), func.coalesce(func.sum(AIResponseCache.size_bytes), 0))
+    ).one()
+
+    if count > max_entries or total_bytes > max_bytes:
+        # Walk entries from least to most recently used until enough have been picked
+        victims = []
+        for key, size in session.execute(
+            select(AIResponseCache.key, AIResponseCache.size_bytes).order_by(AIResponseCache.last_used_at.asc())
+        ):
+            if count <= max_entries and total_bytes <= max_bytes:
+                break
+            victims.append(key)
+            count -= 1
+            total_bytes -= size
+        for start in range(0, len(victims), 500):
+            session.execute(delete(AIResponseCache).where(AIResponseCache.key.in_(victims[start:start + 500])))
+        removed += len(victims)
+
+    session.commit()
+    return removed
+
+
+def _cached_response(key):
+    # Stored text for the key, or None. A cache failure (e.g. the table is missing before
+    # upgrade-schema has run) must not block the AI call, so it counts as a miss.
+    try:
+        return _lookup(key, datetime.utcnow())
+    except SQLAlchemyError:
+        current_app.logger.exception("AI response cache lookup failed")
+        return None
+
+
+def _save_response(key, model, text):
+    # Written with a session of its own, so whatever the caller has pending is not committed with it
+    try:
+        now = datetime.utcnow()
+        with Session(db.engine) as session:
+            _store(session, key, model, text, now, current_app.config.get("AI_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+            evict_ai_cache(now=now, session=session)
+    except SQLAlchemyError:
+        current_app.logger.exception("Storing the AI response failed")
+
+
+def cached_chat(messages, *, model=None, temperature=0.7, max_tokens=500, force_refresh=False, user_key=None):
+    # The AI gateway's chat() with a response cache in front of it. Returns (text, cached).
+    # force_refresh skips the lookup and replaces the stored response with a fresh one.
+    # Errors from the model are raised as usual and never cached; cache hits do not use the user's budget.
+    if not current_app.config.get("AI_CACHE_ENABLED", True):
+        return gateway.chat(messages, model=model, temperature=temperature, max_tokens=max_tokens, user_key=user_key), False
+
+    # Stored under the requested model, or the first model of the chain (model=None keeps the fallback chain)
+    key = request_key(messages, resolve_model(model), temperature, max_tokens)
+    if not force_refresh:
+        text = _cached_response(key)
+        if text is not None:
+            return text, True
+
+    text = gateway.chat(messages, model=model, temperature=temperature, max_tokens=max_tokens, user_key=user_key)
+    if text:
+        _save_response(key, resolve_model(model), text)
+    return text, False
+
+
+def cached_chat_stream(messages, *, model=None, temperature=0.7, max_tokens=500, force_refresh=False, user_key=None):
+    # Streaming counterpart of cached_chat(). Returns (chunks, cached): a stored response comes back
+    # as a single chunk, otherwise chunks are streamed from the model and the full text is stored
+    # once the stream completes (a stream the client abandons is not stored).
+    enabled = current_app.config.get("AI_CACHE_ENABLED", True)
+    key = request_key(messages, resolve_model(model), temperature, max_tokens)
+    if enabled and not force_refresh:
+        text = _cached_response(key)
+        if text is not None:
+            return iter([text]), True
+
+    # Started here rather than inside chunks() so AIRateLimited is raised before any response is sent
+    upstream = gateway.stream(messages, model=model, temperature=temperature, max_tokens=max_tokens, user_key=user_key)
+
+    def chunks():
+        parts = []
+        for chunk in upstream:
+            parts.append(chunk)
+            yield chunk
+        text = "".join(parts).strip()
+        if enabled and text:
+            _save_response(key, resolve_model(model), text)
+
+    return chunks(), False
+
+
+def ai_cache_stats():
+    # Entry count, total size and hits, for the admin system health page
+    count, total_bytes, hits = db.session.execute(
+        select(
+            func.count(AIResponseCache.key),
+            func.coalesce(func.sum(AIResponseCache.size_bytes), 0),
+            func.coalesce(func.sum(AIResponseCache.hit_count), 0),
+        )
+    ).one()
+    return {"entries": int(count), "bytes": int(total_bytes), "hits": int(hits)}
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("ai-cache-prune")
+@with_appcontext
+@click.option("--clear", is_flag=True, help="Delete every cached AI response.")
+def ai_cache_prune_command(clear):
+    # Remove expired AI responses and enforce the size limits (or empty the cache)
+    if clear:
+        removed = db.session.execute(delete(AIResponseCache)).rowcount or 0
+        db.session.commit()
+    else:
+        removed = evict_ai_cache()
+    click.echo(f"Removed {removed} cached AI response(s).")
+# VERSION 7 END
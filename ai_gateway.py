@@ -0,0 +1,224 @@
+# VERSION 7 START
+# This file is the single entry point for AI calls made on behalf of a user.
+# Identical requests that are already running upstream are coalesced: later callers wait for the
+# first one's answer instead of making their own call (double clicks, two organisers on the same event).
+# Each user has a small per-minute budget of upstream calls. The concurrency cap and queue deadline are
+# the client manager's call slots (OPENROUTER_MAX_CONCURRENCY, OPENROUTER_ACQUIRE_TIMEOUT).
+# All state is per worker process.
+
+import hashlib
+import json
+import threading
+import time
+
+from flask import current_app
+
+from openrouter_client import chat, chat_stream, client_manager, resolve_model, OpenRouterError
+
+
+# Raised when a user has used up their AI budget; routes answer it with HTTP 429
+class AIRateLimited(OpenRouterError):
+    pass
+
+
+def _normalise_content(content):
+    # Whitespace differences (trailing spaces, blank lines, double spaces) do not change the answer
+    return " ".join(str(content or "").split())
+
+
+def request_key(messages, model, temperature, max_tokens):
+    # SHA-256 of a canonical JSON form of everything that determines the model's output.
+    # Used to coalesce identical in-flight calls and as the response cache key.
+    payload = {
+        "messages": [{"role": (m.get("role") or "").strip().lower(), "content": _normalise_content(m.get("content"))} for m in messages],
+        "model": model,
+        "temperature": round(float(temperature), 3),
+        "max_tokens": int(max_tokens),
+    }
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _InFlight:
+    # One upstream call that other callers with the same key can wait on
+    def __init__(self):
+        self.done = threading.Event()
+        self.text = None
+        self.error = None
+        self.started = time.monotonic()
+
+    def finish(self, text=None, error=None):
+        self.text, self.error = text, error
+        self.done.set()
+
+
+class TokenBucket:
+    # Reference: Token bucket rate limiting (Wikipedia, 2025)
+    # https://en.wikipedia.org/wiki/Token_bucket
+    # Holds up to `capacity` calls and refills at `per_minute` calls a minute
+    def __init__(self, capacity, per_minute, now):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.tokens = float(capacity)
+        # Same clock reading as the first take(), so the first refill is never negative
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def retry_after(self):
+        # Seconds until the next call is allowed
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate else None
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class AIGateway:
+    # Flask extension wrapping chat() / chat_stream() with coalescing, per-user budgets and counters
+
+    # Idle (full) buckets are dropped once this many users have one
+    MAX_BUCKETS = 10_000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._buckets = {}
+        self.counters = {"upstream_calls": 0, "coalesced": 0, "rate_limited": 0, "errors": 0}
+
+    def init_app(self, app):
+        app.extensions["ai_gateway"] = self
+
+    def _take_budget(self, user_key):
+        # Charges one upstream call to the user; callers without a user (CLI) are not limited
+        cfg = current_app.config
+        per_minute = cfg.get("AI_USER_CALLS_PER_MINUTE", 6)
+        if user_key is None or not per_minute:
+            return
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(user_key)
+            if bucket is None:
+                if len(self._buckets) >= self.MAX_BUCKETS:
+                    self._buckets = {k: b for k, b in self._buckets.items() if not b.full(now)}
+                bucket = self._buckets[user_key] = TokenBucket(cfg.get("AI_USER_BURST", 3), per_minute, now)
+            allowed = bucket.take(now)
+            retry_after = bucket.retry_after()
+            if not allowed:
+                self.counters["rate_limited"] += 1
+        if not allowed:
+            raise AIRateLimited(f"You have made a lot of AI requests. Please try again in {max(1, round(retry_after))} seconds.")
+
+    def _wait_limit(self):
+        # Longest a leader can take to get a call slot and finish its call
+        cfg = current_app.config
+        return cfg.get("OPENROUTER_ACQUIRE_TIMEOUT", 10.0) + cfg.get("OPENROUTER_READ_TIMEOUT", 60.0)
+
+    def _running(self, key):
+        # The in-flight call for the key, ignoring one whose stream was never read (and so never finished)
+        entry = self._inflight.get(key)
+        if entry is not None and time.monotonic() - entry.started > self._wait_limit():
+            del self._inflight[key]
+            entry.finish(error=OpenRouterError("The AI request was abandoned. Please try again."))
+            return None
+        return entry
+
+    def _join_or_lead(self, key, user_key):
+        # Returns (entry, leader). Followers share the leader's call and are not charged for it.
+        with self._lock:
+            entry = self._running(key)
+            if entry is not None:
+                self.counters["coalesced"] += 1
+                return entry, False
+        self._take_budget(user_key)
+        with self._lock:
+            # Another caller may have started the same call while the budget was checked
+            entry = self._running(key)
+            if entry is not None:
+                self.counters["coalesced"] += 1
+                return entry, False
+            entry = self._inflight[key] = _InFlight()
+            self.counters["upstream_calls"] += 1
+            return entry, True
+
+    def _release(self, key, entry, text=None, error=None):
+        with self._lock:
+            if self._inflight.get(key) is entry:
+                del self._inflight[key]
+            if error is not None:
+                self.counters["errors"] += 1
+        entry.finish(text, error)
+
+    def _wait(self, entry):
+        # Followers wait no longer than the leader could take
+        if not entry.done.wait(self._wait_limit()):
+            raise OpenRouterError("The AI service is busy. Please try again in a moment.")
+        if entry.error is not None:
+            # A fresh exception per waiter, since several threads may raise it at once
+            raise type(entry.error)(str(entry.error))
+        return entry.text
+
+    def chat(self, messages, *, model=None, temperature=0.7, max_tokens=500, user_key=None):
+        # chat() for a user: joins an identical in-flight call, otherwise charges the user's budget.
+        # model=None keeps the configured fallback chain; the key uses the chain's first model.
+        key = request_key(messages, resolve_model(model), temperature, max_tokens)
+        entry, leader = self._join_or_lead(key, user_key)
+        if not leader:
+            return self._wait(entry)
+        try:
+            text = chat(messages, model=model, temperature=temperature, max_tokens=max_tokens)
+        except OpenRouterError as e:
+            self._release(key, entry, error=e)
+            raise
+        self._release(key, entry, text=text)
+        return text
+
+    def stream(self, messages, *, model=None, temperature=0.7, max_tokens=500, user_key=None):
+        # chat_stream() for a user. Budget and coalescing are decided before the first chunk;
+        # a caller that joins a running call receives its full text as a single chunk.
+        key = request_key(messages, resolve_model(model), temperature, max_tokens)
+        entry, leader = self._join_or_lead(key, user_key)
+        if not leader:
+            return self._follow(entry)
+        return self._lead(key, entry, chat_stream(messages, model=model, temperature=temperature, max_tokens=max_tokens))
+
+    def _follow(self, entry):
+        text = self._wait(entry)
+        if text:
+            yield text
+
+    def _lead(self, key, entry, chunks):
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        except OpenRouterError as e:
+            self._release(key, entry, error=e)
+            raise
+        else:
+            self._release(key, entry, text="".join(parts).strip())
+        finally:
+            # Still unresolved when the client disconnected mid-stream: let followers retry
+            if not entry.done.is_set():
+                self._release(key, entry, error=OpenRouterError("The AI request was cancelled. Please try again."))
+
+    def stats(self):
+        # Counters plus the client manager's queue depth and latency percentiles, for the admin pages
+        with self._lock:
+            stats = dict(self.counters, in_flight=len(self._inflight))
+        stats.update(client_manager.stats())
+        return stats
+
+
+gateway = AIGateway()
+# VERSION 7 END
@@ -16,6 +16,26 @@ from models import db, User
 # VERSION 4 START
 from extensions import mail
 # VERSION 4 END
+# VERSION 7 START
+import os
+import click
+from sweeper import sweeper
+from jobs import job_worker
+from receipts import bench_receipts_command
+from blob_store import blobs
+from query_checks import check_list_queries_command, bench_event_listing_command
+from cover_images import build_cover_variants_command
+from schema import upgrade_schema_command
+from event_stats import rebuild_event_stats_command
+from app_cache import cache
+from audit_storage import audit_partitions_command, audit_archive_command
+from audit import audit_spool
+from ai_cache import ai_cache_prune_command
+from ai_gateway import gateway
+from fake_llm import fake_llm_command, bench_ai_stream_command
+from outbox import outbox_stats_command
+from mail_sink import mail_sink_command
+# VERSION 7 END
 
 def create_app():
     # Load environment variables from the .env file (for keys, database URL, etc.)
@@ -72,12 +92,60 @@ def create_app():
     # Reference: Flask Blueprints (Pallets Projects, 2024)
     # https://flask.palletsprojects.com/en/stable/blueprints/
     app.register_blueprint(main_bp)
+
+    # VERSION 7 START
+    # Stale-event sweeper (replaces the old per-request auto-complete hook); started by start_background_threads
+    sweeper.init_app(app)
+    # Blob store for receipt PDFs and cover images (also registers `flask migrate-blobs`)
+    blobs.init_app(app)
+    # Application cache for hot aggregates such as the homepage platform stats
+    cache.init_app(app)
+    # Audit spool directory for AUDIT_WRITE_MODE=file (also registers `flask audit-load-spool`)
+    audit_spool.init_app(app)
+    # Coalescing and per-user budgets for AI calls
+    gateway.init_app(app)
+    # Background job workers (receipt rendering, impact summaries and the email outbox); started by start_background_threads
+    job_worker.init_app(app)
+    app.cli.add_command(bench_receipts_command)
+    app.cli.add_command(check_list_queries_command)
+    app.cli.add_command(bench_event_listing_command)
+    app.cli.add_command(build_cover_variants_command)
+    app.cli.add_command(upgrade_schema_command)
+    app.cli.add_command(rebuild_event_stats_command)
+    app.cli.add_command(audit_partitions_command)
+    app.cli.add_command(audit_archive_command)
+    app.cli.add_command(ai_cache_prune_command)
+    app.cli.add_command(fake_llm_command)
+    app.cli.add_command(bench_ai_stream_command)
+    app.cli.add_command(outbox_stats_command)
+    app.cli.add_command(mail_sink_command)
+    # VERSION 7 END
     return app
 
 
+# VERSION 7 START
+def start_background_threads(app):
+    # Starts the in-process background threads (stale-event sweeper, job workers). Only called when serving
+    # requests: from gunicorn's post_worker_init hook (gunicorn.conf.py) or `python app.py`.
+    # Never started from `flask` commands, so build steps and one-off commands cannot pick up work
+    # and then be killed part way through it.
+    if app.testing or click.get_current_context(silent=True) is not None:
+        return
+    if app.config.get("SWEEPER_ENABLED", True):
+        sweeper.start(app)
+    if app.config.get("JOBS_IN_PROCESS_WORKER", True):
+        job_worker.start(app, app.config.get("JOBS_WORKER_CONCURRENCY", 2))
+# VERSION 7 END
+
+
 # Run the application in debug mode if executed directly
 if __name__ == "__main__":
     app = create_app()
+    # VERSION 7 START
+    # With the debug reloader, only the child process that serves requests starts the threads
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_threads(app)
+    # VERSION 7 END
     app.run(debug=True)
 
 # VERSION 1
\ No newline at end of file
@@ -0,0 +1,206 @@
+# VERSION 7 START
+# This file provides a small application cache for values that are expensive to compute and
+# read on almost every request (e.g. the homepage platform stats).
+# Entries expire after a TTL and can be invalidated by key, or by tag (surrogate key) for groups
+# of entries such as cached pages, once the transaction that changed the underlying data commits. The default backend is an in-process dictionary; a Redis backend
+# can be selected so every gunicorn worker shares (and invalidates) the same entries.
+
+import pickle
+import threading
+import time
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db
+
+# Keys for cached values, kept together so writers and readers use the same names
+PLATFORM_STATS_KEY = "platform_stats"
+
+# Session.info entries holding keys and tags to invalidate when the current transaction commits
+_PENDING_KEY = "app_cache_invalidate"
+_PENDING_TAGS = "app_cache_invalidate_tags"
+
+# Stored in place of None so a cached None is distinguishable from a miss
+_MISSING = object()
+
+
+class MemoryCacheBackend:
+    # Per-process TTL cache. Expired entries are dropped when read, and the oldest entries
+    # are evicted once max_entries is reached so the dictionary cannot grow without bound.
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return _MISSING
+            return value
+
+    def set(self, key, value, ttl):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key not in self._data and len(self._data) >= self.max_entries:
+                # Dicts keep insertion order, so the first key is the oldest entry
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (value, expires_at)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisCacheBackend:
+    # Shared cache in Redis; values are pickled and expire with Redis' own TTL.
+    # Any client exposing get/set/delete works, so a local stand-in can be passed instead.
+
+    def __init__(self, client, prefix="cache:"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_config(cls, cfg):
+        # Reference: redis-py client (Redis Ltd., 2025)
+        # https://redis.readthedocs.io/en/stable/connections.html
+        # redis is only needed when the Redis backend is selected
+        import redis
+        return cls(redis.Redis.from_url(cfg["CACHE_REDIS_URL"]), cfg.get("CACHE_KEY_PREFIX", "cache:"))
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return _MISSING if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        # Only used in development; Redis entries are left to expire
+        pass
+
+
+class AppCache:
+    # Flask extension that picks the configured backend and counts hits and misses.
+    # Counters are per process; they are shown on the admin system health page.
+
+    def __init__(self):
+        self.backend = MemoryCacheBackend()
+        self.default_ttl = 60
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def init_app(self, app):
+        cfg = app.config
+        if cfg.get("CACHE_BACKEND", "memory") == "redis":
+            self.backend = RedisCacheBackend.from_config(cfg)
+        else:
+            self.backend = MemoryCacheBackend(cfg.get("CACHE_MAX_ENTRIES", 1024))
+        self.default_ttl = cfg.get("CACHE_DEFAULT_TTL_SECONDS", 60)
+
+    def _count(self, hit):
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key, default=None):
+        value = self.backend.get(key)
+        self._count(value is not _MISSING)
+        return default if value is _MISSING else value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(key, value, self.default_ttl if ttl is None else ttl)
+
+    def get_or_set(self, key, compute, ttl=None):
+        # Returns the cached value, or calls compute() and caches its result on a miss
+        value = self.backend.get(key)
+        self._count(value is not _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+    def delete(self, *keys):
+        self.backend.delete(*keys)
+
+    def clear(self):
+        self.backend.clear()
+
+    # Tags work by version: an entry records the version of each of its tags when it is stored and
+    # is treated as stale once any of them changes. Versions are random tokens rather than counters
+    # so an evicted or expired version can never come back with a value an old entry recorded.
+    def _tag_version(self, tag):
+        version = self.backend.get("tag:" + tag)
+        return None if version is _MISSING else version
+
+    def tag_versions(self, tags):
+        return {tag: self._tag_version(tag) for tag in tags}
+
+    def tags_current(self, versions):
+        return all(self._tag_version(tag) == version for tag, version in versions.items())
+
+    def invalidate_tags(self, *tags):
+        for tag in tags:
+            self.backend.set("tag:" + tag, uuid.uuid4().hex, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": "redis" if isinstance(self.backend, RedisCacheBackend) else "memory",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+cache = AppCache()
+
+
+def invalidate_after_commit(*keys, tags=(), session=None):
+    # Drops the keys (and every entry carrying one of the tags) once the current transaction commits.
+    # Invalidating before the commit would let another request re-cache the old values in between;
+    # on rollback nothing is dropped.
+    info = (session or db.session).info
+    info.setdefault(_PENDING_KEY, set()).update(keys)
+    info.setdefault(_PENDING_TAGS, set()).update(tags)
+
+
+# Reference: SQLAlchemy session events after_commit / after_transaction_end (SQLAlchemy, 2025)
+# https://docs.sqlalchemy.org/en/20/orm/events.html#sqlalchemy.orm.SessionEvents.after_commit
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    keys = session.info.pop(_PENDING_KEY, None)
+    tags = session.info.pop(_PENDING_TAGS, None)
+    if keys:
+        cache.delete(*keys)
+    if tags:
+        cache.invalidate_tags(*tags)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_pending(session, transaction):
+    # Runs after after_commit, so anything still pending here was rolled back.
+    # Savepoints (nested transactions) ending do not affect the outer transaction's keys.
+    if transaction.parent is None:
+        session.info.pop(_PENDING_KEY, None)
+        session.info.pop(_PENDING_TAGS, None)
+# VERSION 7 END
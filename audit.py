@@ -1,12 +1,33 @@
 # VERSION 4 START
 from models import db, AuditLog
 from flask_login import current_user
+# VERSION 4 END
+# VERSION 7 START
+import csv
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from io import StringIO
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from sqlalchemy import select, insert, event, create_engine
+from sqlalchemy.orm import Session
+# VERSION 7 END
+# VERSION 4 START
 
 def log_action(action, entity_type, entity_id=None, meta=None):
     # Records an action in the audit log for traceability.
 
-    # Create a new audit log entry
-    log = AuditLog(
+    # VERSION 7 START
+    # Build the audit row; it is buffered and written with the rest of the transaction at commit
+    entry = dict(
         # ID of the user performing the action (if logged in)
         actor_id=getattr(current_user, "id", None),
         # Role of the user at the time of the action
@@ -19,7 +40,307 @@ def log_action(action, entity_type, entity_id=None, meta=None):
         entity_id=entity_id,
         # Extra contextual data stored as JSON
         meta=meta,
+        # When the action happened (not when the buffered row is finally written)
+        created_at=datetime.utcnow(),
     )
-    # Add the audit entry to the database session
-    db.session.add(log)
-# VERSION 4 END
\ No newline at end of file
+    record_audit_entries([entry])
+    # VERSION 7 END
+# VERSION 4 END
+
+# VERSION 7 START
+# Buffered audit writes.
+# log_action used to add one AuditLog object per call, so a request that scanned 20 tickets flushed
+# 20 separate INSERTs. Entries are now collected on the session and written at commit time as a
+# single multi-row INSERT, or (AUDIT_WRITE_MODE=file) appended to a local spool file by a
+# background thread once the transaction has committed and bulk-loaded later by `flask audit-load-spool`.
+
+# Session.info entries: rows waiting for the commit, and committed rows waiting for the spool writer
+_AUDIT_BUFFER = "audit_buffer"
+_AUDIT_SPOOL_PENDING = "audit_spool_pending"
+
+
+def record_audit_entries(entries, session=None):
+    # Queues audit rows (dicts of AuditLog columns) to be written when the session commits.
+    # Rows of a transaction that rolls back are discarded with it.
+    (session or db.session).info.setdefault(_AUDIT_BUFFER, []).extend(entries)
+
+
+def _write_mode():
+    if has_app_context():
+        return current_app.config.get("AUDIT_WRITE_MODE", "db")
+    return "db"
+
+
+# Reference: SQLAlchemy session events before_commit / after_commit (SQLAlchemy, 2025)
+# https://docs.sqlalchemy.org/en/20/orm/events.html#sqlalchemy.orm.SessionEvents.before_commit
+@event.listens_for(Session, "before_commit")
+def _flush_audit_buffer(session):
+    entries = session.info.pop(_AUDIT_BUFFER, None)
+    if not entries:
+        return
+    if _write_mode() == "file":
+        # Only spool once the commit has succeeded, so rolled-back actions are never recorded
+        session.info.setdefault(_AUDIT_SPOOL_PENDING, []).extend(entries)
+        return
+    # Reference: SQLAlchemy ORM bulk INSERT (SQLAlchemy, 2025)
+    # https://docs.sqlalchemy.org/en/20/orm/queryguide/dml.html#orm-bulk-insert-statements
+    # One executemany INSERT for the whole transaction, inside the same transaction
+    session.execute(insert(AuditLog), entries)
+
+
+@event.listens_for(Session, "after_commit")
+def _spool_committed_entries(session):
+    entries = session.info.pop(_AUDIT_SPOOL_PENDING, None)
+    if entries:
+        audit_spool.write(entries)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_audit_buffer(session, transaction):
+    # Anything still buffered when the outermost transaction ends was rolled back
+    if transaction.parent is None:
+        session.info.pop(_AUDIT_BUFFER, None)
+        session.info.pop(_AUDIT_SPOOL_PENDING, None)
+
+
+class AuditSpool:
+    # Append-only JSON-lines files written by a background thread in each process.
+    # Each process writes its own files, one per minute, so the loader only ever reads files
+    # that are no longer being appended to.
+
+    def __init__(self):
+        self.path = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.path = app.config.get("AUDIT_SPOOL_PATH") or os.path.join(app.instance_path, "audit_spool")
+        app.cli.add_command(audit_load_spool_command)
+        app.cli.add_command(bench_audit_command)
+
+    def _ensure_thread(self):
+        # Started lazily, and again after a fork (threads do not survive into gunicorn workers)
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name="audit-spool-writer", daemon=True)
+            self._thread.start()
+
+    def write(self, entries):
+        # Hands committed entries to the writer thread; the request does not wait for the disk
+        self._ensure_thread()
+        self._queue.put(entries)
+
+    def flush(self, timeout=5):
+        # Waits until every queued entry is on disk (used by the CLI and the benchmark)
+        if self._thread and self._thread.is_alive():
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait(timeout)
+
+    def _run(self):
+        while True:
+            batches = [self._queue.get()]
+            # Drain whatever else is waiting so bursts become one write
+            while not self._queue.empty():
+                batches.append(self._queue.get_nowait())
+            lines = []
+            for batch in batches:
+                if isinstance(batch, threading.Event):
+                    continue
+                for entry in batch:
+                    row = dict(entry)
+                    row["created_at"] = row["created_at"].isoformat() if row.get("created_at") else None
+                    lines.append(json.dumps(row, default=str) + "\n")
+            if lines:
+                os.makedirs(self.path, exist_ok=True)
+                name = f"audit-{os.getpid()}-{datetime.utcnow():%Y%m%d%H%M}.jsonl"
+                with open(os.path.join(self.path, name), "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+            for batch in batches:
+                if isinstance(batch, threading.Event):
+                    batch.set()
+
+
+audit_spool = AuditSpool()
+
+
+def _release_stale_claims(timeout_minutes):
+    # Puts back files claimed by a loader that died before finishing, so they are loaded again
+    stale_before = time.time() - timeout_minutes * 60
+    for claimed in glob.glob(os.path.join(audit_spool.path, "audit-*.jsonl.loading")):
+        try:
+            if os.path.getmtime(claimed) < stale_before:
+                os.rename(claimed, claimed[:-len(".loading")])
+        except FileNotFoundError:
+            # Finished, or put back by another loader
+            continue
+
+
+def load_audit_spool(batch_size=1000, grace_minutes=2, echo=print, claim_timeout_minutes=60):
+    # Bulk-loads spool files that writers have finished with into audit_logs, then deletes them.
+    # Every worker's sweeper may run this at once, so each file is first claimed by renaming it to
+    # .loading (atomic: exactly one loader wins, the others skip it). Each file is loaded in one
+    # transaction and removed only after it commits.
+    if not audit_spool.path or not os.path.isdir(audit_spool.path):
+        return 0
+    _release_stale_claims(claim_timeout_minutes)
+    cutoff = (datetime.utcnow() - timedelta(minutes=grace_minutes)).strftime("%Y%m%d%H%M")
+    loaded = 0
+    for path in sorted(glob.glob(os.path.join(audit_spool.path, "audit-*.jsonl"))):
+        stamp = os.path.basename(path).rsplit("-", 1)[-1].split(".")[0]
+        if stamp >= cutoff:
+            continue
+        claimed = path + ".loading"
+        try:
+            os.rename(path, claimed)
+            # The claim's age counts from now, not from the last write
+            os.utime(claimed)
+        except FileNotFoundError:
+            # Another worker claimed it first
+            continue
+        rows = []
+        try:
+            f = open(claimed, encoding="utf-8")
+        except FileNotFoundError:
+            # Put back by another loader's stale check between the rename and utime
+            continue
+        with f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash mid-write
+                    echo(f"{os.path.basename(path)}: skipped an unreadable line")
+                    continue
+                row["created_at"] = datetime.fromisoformat(row["created_at"]) if row.get("created_at") else datetime.utcnow()
+                rows.append(row)
+        for start in range(0, len(rows), batch_size):
+            db.session.execute(insert(AuditLog), rows[start:start + batch_size])
+        db.session.commit()
+        os.remove(claimed)
+        loaded += len(rows)
+    return loaded
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("audit-load-spool")
+@with_appcontext
+@click.option("--grace-minutes", default=2, type=int, help="Skip files written to in the last N minutes.")
+def audit_load_spool_command(grace_minutes):
+    # Load spooled audit entries (AUDIT_WRITE_MODE=file) into audit_logs
+    loaded = load_audit_spool(grace_minutes=grace_minutes, echo=click.echo)
+    click.echo(f"Loaded {loaded} spooled audit entries.")
+
+
+# Reference: Python time.perf_counter (Python Software Foundation, 2025)
+# https://docs.python.org/3/library/time.html#time.perf_counter
+@click.command("bench-audit")
+@with_appcontext
+@click.option("--requests", "n_requests", default=2000, type=int, help="Simulated requests.")
+@click.option("--entries", default=5, type=int, help="Audit entries logged per request.")
+def bench_audit_command(n_requests, entries):
+    # Compares per-request audit overhead: one AuditLog object per call (old), buffered bulk
+    # insert at commit, and the async spool file. Uses a throwaway SQLite file database.
+    import tempfile
+    app = current_app._get_current_object()
+    workdir = tempfile.mkdtemp(prefix="bench-audit-")
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    AuditLog.__table__.create(engine)
+
+    def entry(i, j):
+        return dict(actor_id=None, actor_role="organiser", action="TICKET_REDEEMED", entity_type="Ticket",
+                    entity_id=i * entries + j, meta={"order_id": i}, created_at=datetime.utcnow())
+
+    def run(label, log):
+        with Session(engine) as session:
+            start = time.perf_counter()
+            for i in range(n_requests):
+                for j in range(entries):
+                    log(session, entry(i, j))
+                session.commit()
+            elapsed = time.perf_counter() - start
+        click.echo(f"{label:<32} {elapsed / n_requests * 1000:8.3f} ms/request")
+        return elapsed
+
+    old_mode, old_path = app.config.get("AUDIT_WRITE_MODE", "db"), audit_spool.path
+    try:
+        app.config["AUDIT_WRITE_MODE"] = "db"
+        run("One AuditLog per call (old)", lambda session, row: session.add(AuditLog(**row)))
+        run("Buffered bulk insert at commit", lambda session, row: record_audit_entries([row], session))
+        app.config["AUDIT_WRITE_MODE"] = "file"
+        audit_spool.path = os.path.join(workdir, "spool")
+        run("Async spool file", lambda session, row: record_audit_entries([row], session))
+        audit_spool.flush()
+    finally:
+        app.config["AUDIT_WRITE_MODE"] = old_mode
+        audit_spool.path = old_path
+    click.echo(f"{n_requests} requests x {entries} audit entries each")
+# VERSION 7 END
+
+# VERSION 7 START
+# Streaming audit log export.
+# Rows are read through a server-side cursor in batches and written out as CSV chunks, so the
+# export uses the same small amount of memory whether the table holds a thousand rows or millions.
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_ROWS = 1000
+
+AUDIT_CSV_HEADER = ["timestamp", "actor_id", "actor_role", "action", "entity_type", "entity_id", "meta"]
+
+
+def audit_export_query(date_from=None, date_to=None, actions=None, entity_type=None, entity_id=None, source=None):
+    # Selects only the exported columns, newest first. Selecting columns rather than AuditLog
+    # entities also skips the eager join to the user table that the actor relationship adds.
+    # source is any selectable with audit_logs' columns (see audit_storage.audit_source).
+    t = (source if source is not None else AuditLog.__table__).c
+    q = select(t.created_at, t.actor_id, t.actor_role, t.action, t.entity_type, t.entity_id, t.meta)
+    if date_from:
+        q = q.where(t.created_at >= date_from)
+    if date_to:
+        # date_to is inclusive: everything before midnight at the end of that day
+        q = q.where(t.created_at < date_to + timedelta(days=1))
+    if actions:
+        q = q.where(t.action.in_(actions))
+    if entity_type:
+        q = q.where(t.entity_type == entity_type)
+    if entity_id is not None:
+        q = q.where(t.entity_id == entity_id)
+    return q.order_by(t.created_at.desc(), t.id.desc())
+
+
+def iter_audit_csv(query, batch_rows=EXPORT_BATCH_ROWS):
+    # Yields the CSV export as text chunks of about batch_rows rows each
+    # Reference: SQLAlchemy yield_per / server-side cursors (SQLAlchemy, 2025)
+    # https://docs.sqlalchemy.org/en/20/orm/queryguide/api.html#fetching-large-result-sets-with-yield-per
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(AUDIT_CSV_HEADER)
+    result = db.session.execute(query.execution_options(yield_per=batch_rows))
+    for rows in result.partitions():
+        for created_at, actor_id, actor_role, action, entity_type, entity_id, meta in rows:
+            writer.writerow([created_at.isoformat(), actor_id, actor_role, action, entity_type, entity_id, meta])
+        yield buf.getvalue()
+        # Reuse the buffer for the next batch instead of letting it grow
+        buf.seek(0)
+        buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def gzip_chunks(chunks, level=6):
+    # Compresses a stream of text chunks into a gzip stream without holding it all in memory
+    # Reference: zlib.compressobj with gzip framing (Python Software Foundation, 2025)
+    # https://docs.python.org/3/library/zlib.html#zlib.compressobj
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header/trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+# VERSION 7 END
@@ -0,0 +1,367 @@
+# VERSION 7 START
+# This file manages how audit logs are stored over time.
+# On PostgreSQL, audit_logs is a table partitioned by month: each month's rows live in their own
+# partition (audit_logs_y2025m01, ...), so inserts only touch a small current table and old months
+# can be removed by dropping a partition instead of deleting millions of rows.
+# SQLite has no partitioning, so audit_logs holds the current month and older months are rolled
+# into tables with the same names; ids keep counting up across them. Months past the retention period are exported to gzip CSV
+# files in the blob store (recorded in audit_archives) and then removed from the database.
+
+import re
+import tempfile
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import (text, select, insert, delete, func, and_, union_all, inspect,
+                        table, column, Integer, String, DateTime, JSON)
+
+from models import db, AuditLog, AuditArchive
+from audit import iter_audit_csv, gzip_chunks
+from blob_store import blobs
+
+PARENT_TABLE = "audit_logs"
+# PostgreSQL: rows from before partitioning was switched on, and rows with no monthly partition
+LEGACY_PARTITION = "audit_logs_legacy"
+DEFAULT_PARTITION = "audit_logs_default"
+_MONTHLY_RE = re.compile(r"^audit_logs_y(\d{4})m(\d{2})$")
+_BOUND_RE = re.compile(r"TO \('(\d{4}-\d{2}-\d{2})")
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, n):
+    years, month_index = divmod(month.month - 1 + n, 12)
+    return datetime(month.year + years, month_index + 1, 1)
+
+
+def partition_name(month):
+    return f"audit_logs_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name):
+    # The month a monthly partition/table holds, or None for any other table
+    match = _MONTHLY_RE.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def _is_postgres():
+    return db.engine.dialect.name == "postgresql"
+
+
+def _audit_table(name):
+    # Table construct for audit_logs or any of its partitions/rolling tables (same columns)
+    return table(
+        name,
+        column("id", Integer), column("actor_id", Integer), column("actor_role", String),
+        column("action", String), column("entity_type", String), column("entity_id", Integer),
+        column("meta", JSON), column("created_at", DateTime),
+    )
+
+
+def _export_columns(t):
+    # Column order expected by audit.iter_audit_csv
+    return [t.c.created_at, t.c.actor_id, t.c.actor_role, t.c.action, t.c.entity_type, t.c.entity_id, t.c.meta]
+
+
+def is_partitioned():
+    # True once audit_logs is a partitioned table (PostgreSQL only)
+    if not _is_postgres():
+        return False
+    return bool(db.session.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:name)"), {"name": PARENT_TABLE}
+    ).scalar())
+
+
+def list_partitions():
+    # Tables holding audit rows besides audit_logs itself: PostgreSQL partitions or SQLite rolling tables
+    if _is_postgres():
+        rows = db.session.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:name)"
+        ), {"name": PARENT_TABLE}).scalars()
+    else:
+        rows = db.session.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'audit\\_logs\\_y%' ESCAPE '\\'"
+        )).scalars()
+    return sorted(rows)
+
+
+def _legacy_upper_bound():
+    # First instant after the legacy partition's range (monthly partitions start here)
+    bound = db.session.execute(text(
+        "SELECT pg_get_expr(c.relpartbound, c.oid) FROM pg_class c WHERE c.oid = to_regclass(:name)"
+    ), {"name": LEGACY_PARTITION}).scalar()
+    match = _BOUND_RE.search(bound or "")
+    return datetime.strptime(match.group(1), "%Y-%m-%d") if match else None
+
+
+def convert_to_partitioned(echo=print):
+    # One-off switch (run explicitly with `audit-partitions --convert`, never from a deploy) of an existing PostgreSQL audit_logs table to monthly range partitioning.
+    # The old table becomes the legacy partition for everything up to the end of this month,
+    # so no rows are copied; monthly partitions take over from next month.
+    # Reference: PostgreSQL declarative partitioning (PostgreSQL, 2025)
+    # https://www.postgresql.org/docs/current/ddl-partitioning.html
+    insp = inspect(db.engine)
+    pk_name = insp.get_pk_constraint(PARENT_TABLE).get("name")
+    index_names = [ix["name"] for ix in insp.get_indexes(PARENT_TABLE)]
+    boundary = add_months(month_start(datetime.utcnow()), 1)
+
+    statements = [f"ALTER TABLE {PARENT_TABLE} RENAME TO {LEGACY_PARTITION}"]
+    if pk_name:
+        statements.append(f"ALTER TABLE {LEGACY_PARTITION} RENAME CONSTRAINT {pk_name} TO {LEGACY_PARTITION}_pkey")
+    # Free the index names for the partitioned indexes; equivalent ones are attached, not rebuilt
+    statements += [f"ALTER INDEX {name} RENAME TO {name}_legacy" for name in index_names]
+    statements += [
+        # Same columns, defaults (including the id sequence) and NOT NULLs as the old table.
+        # The legacy partition is never dropped (archiving deletes its rows), so the sequence it owns stays.
+        f"CREATE TABLE {PARENT_TABLE} (LIKE {LEGACY_PARTITION} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+        f"PARTITION BY RANGE (created_at)",
+        # The partition key must be part of the primary key on a partitioned table
+        f"ALTER TABLE {PARENT_TABLE} ADD PRIMARY KEY (id, created_at)",
+        f'ALTER TABLE {PARENT_TABLE} ADD FOREIGN KEY (actor_id) REFERENCES "user" (id)',
+        f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {LEGACY_PARTITION} "
+        f"FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat(sep=' ')}')",
+        f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT",
+    ]
+    for sql in statements:
+        db.session.execute(text(sql))
+    db.session.commit()
+    # Recreate the model's indexes on the parent (partitioned indexes cascade to every partition)
+    for index in AuditLog.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+    echo(f"Converted {PARENT_TABLE} to monthly partitions; existing rows are in {LEGACY_PARTITION}.")
+
+
+def ensure_monthly_partitions(months_ahead, echo=print):
+    # Creates partitions for this month and the next months_ahead months (PostgreSQL).
+    # Rows for months with no partition land in the default partition, so a missed run loses nothing.
+    first_free = _legacy_upper_bound()
+    existing = set(list_partitions())
+    current = month_start(datetime.utcnow())
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        name = partition_name(month)
+        if name in existing or (first_free and month < first_free):
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.execute(text(
+                    f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} "
+                    f"FOR VALUES FROM ('{month.isoformat(sep=' ')}') TO ('{add_months(month, 1).isoformat(sep=' ')}')"
+                ))
+            echo(f"Created partition {name}")
+        except Exception as e:
+            # Usually rows for that month already sit in the default partition
+            echo(f"Could not create partition {name}: {str(e).splitlines()[0]}")
+    db.session.commit()
+
+
+def _ensure_sqlite_autoincrement(echo=print):
+    # A plain SQLite table hands out max(id) + 1, so ids would be reused once rows are moved out and
+    # entity_history could show two rows with the same id. Tables created before the model asked for
+    # AUTOINCREMENT are rebuilt once with it.
+    # Reference: SQLite AUTOINCREMENT (SQLite, 2025)
+    # https://www.sqlite.org/autoinc.html
+    ddl = db.session.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": PARENT_TABLE}
+    ).scalar() or ""
+    if "AUTOINCREMENT" in ddl.upper():
+        return
+    old = f"{PARENT_TABLE}_rebuild"
+    db.session.execute(text(f"ALTER TABLE {PARENT_TABLE} RENAME TO {old}"))
+    # Free the index names for the new table
+    index_names = db.session.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name AND sql IS NOT NULL"
+    ), {"name": old}).scalars().all()
+    for name in index_names:
+        db.session.execute(text(f"DROP INDEX {name}"))
+    AuditLog.__table__.create(bind=db.session.connection())
+    columns = ", ".join(c.name for c in AuditLog.__table__.columns)
+    db.session.execute(text(f"INSERT INTO {PARENT_TABLE} ({columns}) SELECT {columns} FROM {old}"))
+    db.session.execute(text(f"DROP TABLE {old}"))
+    db.session.commit()
+    echo(f"Rebuilt {PARENT_TABLE} with AUTOINCREMENT ids")
+
+
+def _raise_sqlite_sequence(rolled):
+    # Next audit_logs id continues after the highest id in any rolling table
+    top = max([
+        db.session.execute(select(func.max(_audit_table(name).c.id))).scalar() or 0
+        for name in [PARENT_TABLE] + rolled
+    ])
+    params = {"name": PARENT_TABLE, "top": top}
+    db.session.execute(text("UPDATE sqlite_sequence SET seq = :top WHERE name = :name AND seq < :top"), params)
+    db.session.execute(text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :top "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"
+    ), params)
+
+
+def rotate_sqlite_tables(echo=print):
+    # Moves every completed month out of audit_logs into its own table (SQLite's stand-in for partitions)
+    _ensure_sqlite_autoincrement(echo=echo)
+    logs = _audit_table(PARENT_TABLE)
+    current = month_start(datetime.utcnow())
+    while True:
+        oldest = db.session.execute(select(func.min(logs.c.created_at)).where(logs.c.created_at < current)).scalar()
+        if oldest is None:
+            return
+        if isinstance(oldest, str):
+            oldest = datetime.fromisoformat(oldest)
+        month = month_start(oldest)
+        name = partition_name(month)
+        in_month = and_(logs.c.created_at >= month, logs.c.created_at < add_months(month, 1))
+        db.session.execute(text(f"CREATE TABLE IF NOT EXISTS {name} AS SELECT * FROM {PARENT_TABLE} WHERE 0"))
+        db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{name}_entity ON {name} (entity_type, entity_id, created_at)"))
+        db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{name}_created_at ON {name} (created_at)"))
+        moved = db.session.execute(insert(_audit_table(name)).from_select(
+            [c.name for c in logs.columns], select(*logs.columns).where(in_month)
+        )).rowcount
+        _raise_sqlite_sequence(list_partitions())
+        db.session.execute(delete(logs).where(in_month))
+        db.session.commit()
+        echo(f"Moved {moved} audit rows into {name}")
+
+
+def maintain_audit_storage(months_ahead=None, convert=False, echo=print):
+    # Keeps partitions/rolling tables up to date; safe to run on every deploy and on an interval.
+    # An unpartitioned PostgreSQL table is only converted when asked to (convert=True).
+    months_ahead = current_app.config.get("AUDIT_PARTITION_MONTHS_AHEAD", 3) if months_ahead is None else months_ahead
+    if _is_postgres():
+        if not is_partitioned():
+            if not convert:
+                echo(f"{PARENT_TABLE} is not partitioned; run `flask --app app audit-partitions --convert` once to convert it.")
+                return
+            convert_to_partitioned(echo=echo)
+        ensure_monthly_partitions(months_ahead, echo=echo)
+    elif db.engine.dialect.name == "sqlite":
+        rotate_sqlite_tables(echo=echo)
+    else:
+        echo(f"Audit partitioning is not supported on {db.engine.dialect.name}; audit_logs stays a single table.")
+
+
+def _archive_range(source, start, end, drop_table, dry_run, echo):
+    # Exports one month of rows from source to a gzip CSV in the blob store, records it in
+    # audit_archives, then drops the table (whole monthly partition) or deletes the rows
+    t = _audit_table(source)
+    in_range = and_(t.c.created_at >= start, t.c.created_at < end)
+    count = db.session.execute(select(func.count()).select_from(t).where(in_range)).scalar()
+    if dry_run:
+        echo(f"Would archive {count} rows from {source} ({start:%Y-%m})")
+        return count
+
+    if count:
+        # Spool the compressed export to disk so only the final file is held in memory for the upload
+        with tempfile.TemporaryFile() as f:
+            query = select(*_export_columns(t)).where(in_range).order_by(t.c.created_at, t.c.id)
+            for chunk in gzip_chunks(iter_audit_csv(query)):
+                f.write(chunk)
+            f.seek(0)
+            key, size = blobs.put(f.read(), "application/gzip")
+        db.session.add(AuditArchive(
+            source_table=source, period_start=start, period_end=end,
+            row_count=count, blob_key=key, blob_size=size,
+        ))
+
+    if drop_table:
+        if _is_postgres():
+            db.session.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {source}"))
+        db.session.execute(text(f"DROP TABLE {source}"))
+    elif count:
+        db.session.execute(delete(t).where(in_range))
+    db.session.commit()
+    echo(f"Archived {count} rows from {source} ({start:%Y-%m})")
+    return count
+
+
+def archive_audit_logs(retain_months=None, dry_run=False, echo=print):
+    # Archives and removes every month older than the retention period. Returns the rows archived.
+    retain_months = current_app.config.get("AUDIT_RETENTION_MONTHS", 24) if retain_months is None else retain_months
+    cutoff = add_months(month_start(datetime.utcnow()), -retain_months)
+    if not dry_run:
+        maintain_audit_storage(echo=echo)
+    archived = 0
+
+    partitions = list_partitions()
+    for name in partitions:
+        month = partition_month(name)
+        if month and add_months(month, 1) <= cutoff:
+            archived += _archive_range(name, month, add_months(month, 1), True, dry_run, echo)
+
+    # Tables that span many months (the PostgreSQL legacy/default partitions, or an unrotated
+    # audit_logs) are archived month by month and their old rows deleted
+    spanning = [name for name in (LEGACY_PARTITION, DEFAULT_PARTITION) if name in partitions]
+    if not is_partitioned():
+        spanning.append(PARENT_TABLE)
+    for name in spanning:
+        t = _audit_table(name)
+        oldest = db.session.execute(select(func.min(t.c.created_at)).where(t.c.created_at < cutoff)).scalar()
+        if oldest is None:
+            continue
+        if isinstance(oldest, str):
+            oldest = datetime.fromisoformat(oldest)
+        month = month_start(oldest)
+        while month < cutoff:
+            archived += _archive_range(name, month, add_months(month, 1), False, dry_run, echo)
+            month = add_months(month, 1)
+    return archived
+
+
+def audit_source():
+    # Every audit row still in the database as one selectable with audit_logs' columns.
+    # On PostgreSQL the parent table already covers all partitions; on SQLite the rolling
+    # tables are combined with audit_logs.
+    parent = _audit_table(PARENT_TABLE)
+    rolled = list_partitions() if db.engine.dialect.name == "sqlite" else []
+    if not rolled:
+        return parent
+    return union_all(*[select(*_audit_table(name).c) for name in [PARENT_TABLE] + rolled]).subquery("all_audit_logs")
+
+
+def entity_history(entity_type, entity_id, limit=100):
+    # The newest audit entries for one entity, e.g. entity_history("Order", 42).
+    # Served by the (entity_type, entity_id, created_at) index on every partition/table.
+    src = audit_source()
+    query = (
+        select(src.c.id, *_export_columns(src))
+        .where(src.c.entity_type == entity_type, src.c.entity_id == entity_id)
+        .order_by(src.c.created_at.desc(), src.c.id.desc())
+        .limit(limit)
+    )
+    return [dict(row._mapping) for row in db.session.execute(query)]
+
+
+def archived_periods():
+    # (start, end) of every archived month, so callers can tell the history is incomplete
+    return [
+        (a.period_start, a.period_end)
+        for a in AuditArchive.query.order_by(AuditArchive.period_start).all()
+    ]
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("audit-partitions")
+@with_appcontext
+@click.option("--months-ahead", default=None, type=int, help="Monthly partitions to create in advance (PostgreSQL).")
+@click.option("--convert/--no-convert", default=False,
+              help="One-time conversion of an unpartitioned audit_logs table (PostgreSQL). Off by default.")
+def audit_partitions_command(months_ahead, convert):
+    # Partition audit_logs by month (PostgreSQL) or roll finished months into their own tables (SQLite)
+    maintain_audit_storage(months_ahead=months_ahead, convert=convert, echo=click.echo)
+    click.echo("Audit log storage is up to date.")
+
+
+@click.command("audit-archive")
+@with_appcontext
+@click.option("--retain-months", default=None, type=int, help="Months of audit logs to keep in the database.")
+@click.option("--dry-run", is_flag=True, help="Only report what would be archived.")
+def audit_archive_command(retain_months, dry_run):
+    # Export audit months past the retention period to gzip CSVs in the blob store, then remove them
+    archived = archive_audit_logs(retain_months=retain_months, dry_run=dry_run, echo=click.echo)
+    click.echo(f"{'Would archive' if dry_run else 'Archived'} {archived} audit rows.")
+# VERSION 7 END
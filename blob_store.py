@@ -0,0 +1,291 @@
+# VERSION 7 START
+# This file stores large binary files (receipt PDFs, event cover images) outside the database.
+# Blobs are content-addressed: the key is the SHA-256 of the bytes, so identical files are stored once.
+# The local backend keeps them on disk; the S3 backend works with AWS S3 or any S3-compatible service,
+# or with the in-memory stand-in in fake_s3.py (BLOB_STORAGE_BACKEND=s3-memory) for local checks.
+
+import hashlib
+import io
+import os
+import tempfile
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text, select, update, table, column, LargeBinary
+
+from models import db
+from schema import upgrade_schema
+from fake_s3 import MemoryS3Client
+
+
+class BlobNotFound(Exception):
+    pass
+
+
+def blob_key(data):
+    # Content address for a blob: hex SHA-256 of its bytes
+    return hashlib.sha256(data).hexdigest()
+
+
+class LocalBlobStore:
+    # Stores blobs on the local filesystem under sharded paths: <root>/ab/cd/abcd1234...
+    # Sharding keeps any single directory small even with millions of receipts.
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, data, content_type=None):
+        # Saves the bytes and returns (key, size); writing an existing blob is a no-op
+        key = blob_key(data)
+        dest = self.path(key)
+        if not os.path.exists(dest):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            # Reference: atomic file replacement with os.replace (Python Software Foundation, 2025)
+            # https://docs.python.org/3/library/os.html#os.replace
+            # Write to a temp file first so readers never see a half-written blob
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, dest)
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        return key, len(data)
+
+    def get(self, key):
+        # The whole blob as bytes; use open() to stream it instead
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def open(self, key):
+        # Returns a real file object so Flask can stream it with the server's file wrapper
+        try:
+            return open(self.path(key), "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class S3BlobStore:
+    # Stores blobs in an S3 bucket (or S3-compatible service such as MinIO via endpoint_url).
+    # Any client exposing put_object/get_object/head_object/delete_object works, so a local
+    # stand-in can be passed in place of a boto3 client.
+
+    def __init__(self, client, bucket, prefix="blobs/"):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    @classmethod
+    def from_config(cls, cfg):
+        # Reference: boto3 S3 client (Amazon Web Services, 2025)
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html
+        # boto3 is only needed when the S3 backend is selected
+        import boto3
+        client = boto3.client(
+            "s3",
+            endpoint_url=cfg.get("BLOB_S3_ENDPOINT_URL") or None,
+            region_name=cfg.get("BLOB_S3_REGION") or None,
+        )
+        return cls(client, cfg["BLOB_S3_BUCKET"], cfg.get("BLOB_S3_PREFIX", "blobs/"))
+
+    def _object_key(self, key):
+        return f"{self.prefix}{key[:2]}/{key[2:4]}/{key}"
+
+    def put(self, data, content_type=None):
+        key = blob_key(data)
+        if not self.exists(key):
+            extra = {"ContentType": content_type} if content_type else {}
+            self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data, **extra)
+        return key, len(data)
+
+    def get(self, key):
+        try:
+            resp = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if _is_missing(e):
+                raise BlobNotFound(key)
+            raise
+        return resp["Body"].read()
+
+    def open(self, key):
+        return io.BytesIO(self.get(key))
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception as e:
+            if _is_missing(e):
+                return False
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+def _is_missing(exc):
+    # botocore raises ClientError with a 404/NoSuchKey code; stand-ins may raise KeyError
+    if isinstance(exc, (KeyError, FileNotFoundError)):
+        return True
+    code = str(getattr(exc, "response", {}).get("Error", {}).get("Code", ""))
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+class BlobStorage:
+    # Flask extension that picks the configured backend and forwards calls to it.
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        cfg = app.config
+        backend = cfg.get("BLOB_STORAGE_BACKEND", "local")
+        if backend == "s3":
+            self.backend = S3BlobStore.from_config(cfg)
+        elif backend == "s3-memory":
+            self.backend = S3BlobStore(MemoryS3Client(), cfg.get("BLOB_S3_BUCKET") or "dev", cfg.get("BLOB_S3_PREFIX", "blobs/"))
+        else:
+            self.backend = LocalBlobStore(cfg.get("BLOB_STORAGE_PATH") or os.path.join(app.instance_path, "blobs"))
+        app.cli.add_command(migrate_blobs_command)
+        app.cli.add_command(check_blob_store_command)
+
+    def put(self, data, content_type=None):
+        return self.backend.put(data, content_type)
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def open(self, key):
+        return self.backend.open(key)
+
+    def exists(self, key):
+        return self.backend.exists(key)
+
+    def delete(self, key):
+        return self.backend.delete(key)
+
+
+blobs = BlobStorage()
+
+
+# Legacy LargeBinary columns, described without the ORM since the models no longer map them
+_LEGACY_BLOB_COLUMNS = [
+    # (table, legacy bytes column, new key column, new size column, content type column or fixed type)
+    ("order", "receipt_pdf", "receipt_pdf_key", "receipt_pdf_size", "application/pdf"),
+    ("event", "cover_image", "cover_image_key", "cover_image_size", None),
+]
+
+
+def migrate_legacy_blobs(batch_size=100, drop_legacy=False, echo=print):
+    # Moves bytes out of the old LargeBinary columns into the blob store, batch by batch.
+    # Safe to re-run: only rows that still hold bytes and have no key are processed.
+    # The key/size columns must exist before rows can be copied into them
+    upgrade_schema(echo=echo)
+    insp = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+
+    for table_name, legacy_col, key_col, size_col, content_type in _LEGACY_BLOB_COLUMNS:
+        if legacy_col not in {c["name"] for c in insp.get_columns(table_name)}:
+            echo(f"{table_name}.{legacy_col}: already removed, nothing to migrate")
+            continue
+
+        t = table(table_name, column("id"), column(legacy_col, LargeBinary), column(key_col), column(size_col))
+        moved = 0
+        last_id = 0
+        while True:
+            # Keyset pagination on id so each batch is a cheap index range scan
+            rows = db.session.execute(
+                select(t.c.id, t.c[legacy_col])
+                .where(t.c.id > last_id, t.c[legacy_col] != None, t.c[key_col] == None)
+                .order_by(t.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for row_id, data in rows:
+                key, size = blobs.put(bytes(data), content_type)
+                db.session.execute(
+                    update(t).where(t.c.id == row_id).values({key_col: key, size_col: size, legacy_col: None})
+                )
+                last_id = row_id
+            db.session.commit()
+            moved += len(rows)
+            echo(f"{table_name}.{legacy_col}: moved {moved} blobs")
+
+        if drop_legacy:
+            remaining = db.session.execute(select(t.c.id).where(t.c[legacy_col] != None).limit(1)).first()
+            if remaining:
+                echo(f"{table_name}.{legacy_col}: still holds data, not dropped")
+                continue
+            db.session.execute(text(f"ALTER TABLE {preparer.quote(table_name)} DROP COLUMN {preparer.quote(legacy_col)}"))
+            db.session.commit()
+            echo(f"{table_name}.{legacy_col}: column dropped")
+
+
+def check_blob_store(store, echo=print):
+    # Round-trips a random blob through a backend (put, exists, get, open, delete) and reports each
+    # step; returns True if all of them behaved. Random bytes never collide with a stored file.
+    data = os.urandom(256 * 1024)
+    started = time.perf_counter()
+    key, size = store.put(data, "application/octet-stream")
+    with store.open(key) as f:
+        streamed = f.read()
+    checks = [
+        ("put returns the content key and size", key == blob_key(data) and size == len(data)),
+        ("exists after put", store.exists(key)),
+        ("get returns the same bytes", store.get(key) == data),
+        ("open streams the same bytes", streamed == data),
+    ]
+    store.delete(key)
+    try:
+        store.get(key)
+        missing = False
+    except BlobNotFound:
+        missing = True
+    checks += [("gone after delete", not store.exists(key)), ("get of a missing blob raises BlobNotFound", missing)]
+
+    for label, passed in checks:
+        echo(f"{label}: {'ok' if passed else 'FAILED'}")
+    echo(f"{type(store).__name__}: round trip of {len(data) // 1024} KB in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return all(passed for _, passed in checks)
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("check-blob-store")
+@with_appcontext
+@click.option("--s3-memory", is_flag=True, help="Check the S3 backend against the in-memory stand-in instead.")
+def check_blob_store_command(s3_memory):
+    # Fail (exit code 1) if the configured blob store, e.g. a new S3 bucket, does not round-trip a blob
+    store = S3BlobStore(MemoryS3Client(), "check") if s3_memory else blobs.backend
+    if not check_blob_store(store, echo=click.echo):
+        raise SystemExit(1)
+
+
+@click.command("migrate-blobs")
+@with_appcontext
+@click.option("--batch-size", default=100, type=int, help="Rows moved per transaction.")
+@click.option("--drop-legacy", is_flag=True, help="Drop the old LargeBinary columns once they are empty.")
+def migrate_blobs_command(batch_size, drop_legacy):
+    # Move existing receipt PDFs and cover images from the database into the blob store
+    migrate_legacy_blobs(batch_size=batch_size, drop_legacy=drop_legacy, echo=click.echo)
+# VERSION 7 END
@@ -9,4 +9,13 @@ pip install -r requirements.txt
 
 # Create database tables if they don't already exist
 python -c "from app import create_app; from models import db; app = create_app(); app.app_context().push(); db.create_all(); print('Database tables ready.')"
-# VERSION 6 END
\ No newline at end of file
+# VERSION 6 END
+# VERSION 7 START
+# Add any new columns and indexes to existing tables (create_all only creates missing tables)
+flask --app app upgrade-schema
+# Fill the event_stats rollup from existing orders the first time it is deployed
+flask --app app rebuild-event-stats --if-empty
+# Create the upcoming monthly audit partitions. Converting an existing audit_logs table is a
+# one-time manual step (`flask --app app audit-partitions --convert`), never part of a deploy.
+flask --app app audit-partitions --no-convert
+# VERSION 7 END
\ No newline at end of file
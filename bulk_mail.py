@@ -0,0 +1,206 @@
+# VERSION 7 START
+# This file delivers a batch of emails without opening a connection per email.
+# On SMTP the whole batch goes over one connection (mail.connect()) instead of one per mail.send().
+# On Brevo every batch in the process shares one API client, and emails in the batch that differ only in
+# their personal fields are sent as a single request using messageVersions, with those fields filled in by
+# Brevo from each version's params. Personal parts of a body are written as bulk_field("name") placeholders.
+# Each email gets its own outcome, so the outbox (outbox.py) can retry just the ones that failed.
+
+import html
+import os
+import smtplib
+import threading
+from collections import namedtuple
+
+from flask import current_app
+from flask_mail import Message
+
+from email_utils import brevo_api, brevo_sender, _send_via_brevo
+from extensions import mail
+
+
+def bulk_field(name):
+    # Placeholder for a per-recipient value; control characters cannot appear in event text
+    return f"\x00{name}\x00"
+
+
+def render(template, fields):
+    # The template with every placeholder replaced by this recipient's value
+    for name, value in fields.items():
+        template = template.replace(bulk_field(name), str(value))
+    return template
+
+
+def _brevo_html(template, names):
+    # Reference: Brevo transactional emails – personalising content with params (Brevo, 2025)
+    # https://developers.brevo.com/docs/send-a-transactional-email
+    # Brevo fills {{ params.name }} in htmlContent, so the plain-text body is sent as preformatted HTML.
+    # Returns None when the text itself contains template syntax that Brevo would try to evaluate.
+    escaped = html.escape(template)
+    if "{{" in escaped or "{%" in escaped:
+        return None
+    for name in names:
+        escaped = escaped.replace(bulk_field(name), "{{ params.%s }}" % name)
+    return f'<div style="white-space:pre-wrap;font-family:Arial,sans-serif">{escaped}</div>'
+
+
+# One email to deliver. fields fill the body's bulk_field() placeholders; attachment is (filename, bytes) or None
+OutgoingEmail = namedtuple("OutgoingEmail", "to_email subject body fields attachment")
+
+
+class DeliveryError(Exception):
+    # A failed delivery; permanent failures (unknown mailbox, invalid address) are not retried
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def _smtp_error(e):
+    # 5xx replies are permanent, 4xx replies and dropped connections are worth retrying
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in e.recipients.values()]
+        return DeliveryError(f"Recipient refused: {e.recipients}", permanent=bool(codes) and min(codes) >= 500)
+    code = getattr(e, "smtp_code", 0) or 0
+    return DeliveryError(f"{type(e).__name__}: {e}", permanent=code >= 500)
+
+
+_brevo = {"client": None, "key": None}
+_brevo_lock = threading.Lock()
+
+
+def _reset_brevo_client():
+    # A forked worker must not share the parent's HTTP connections
+    _brevo["client"] = _brevo["key"] = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_brevo_client)
+
+
+def shared_brevo_api():
+    # One Brevo client (and its HTTP connection pool) per process, rebuilt if the API key changes
+    with _brevo_lock:
+        key = os.getenv("BREVO_API_KEY")
+        if _brevo["client"] is None or _brevo["key"] != key:
+            _brevo["client"], _brevo["key"] = brevo_api(), key
+        return _brevo["client"]
+
+
+class MailTransport:
+    # Sends a batch of OutgoingEmail with the configured provider (Brevo if BREVO_API_KEY is set, else SMTP)
+
+    def __init__(self):
+        self.use_brevo = bool(os.getenv("BREVO_API_KEY"))
+
+    def batch_size(self):
+        # How many emails to hand over at once: one SMTP connection, or one Brevo messageVersions request
+        cfg = current_app.config
+        if self.use_brevo:
+            return max(cfg.get("BREVO_BATCH_SIZE", 500), 1)
+        return max(cfg.get("MAIL_BULK_BATCH_SIZE", 100), 1)
+
+    def send(self, emails, on_result=None):
+        # Returns one outcome per email, in order: None when sent, else a DeliveryError.
+        # on_result(index, outcome) is called as soon as each outcome is known, so the caller can
+        # record it before the next email goes out.
+        if not emails:
+            return []
+        report = on_result or (lambda index, outcome: None)
+        if self.use_brevo:
+            return self._send_brevo(emails, report)
+        return self._send_smtp(emails, report)
+
+    def _send_smtp(self, emails, report):
+        # Reference: Flask-Mail bulk emails over one connection (Pallets Projects, 2025)
+        # https://flask-mail.readthedocs.io/en/latest/#bulk-emails
+        sender = current_app.config.get("MAIL_DEFAULT_SENDER")
+        outcomes = [None] * len(emails)
+        position = 0
+        error = None
+        # Reconnect once if the server drops the connection part way through the batch
+        for _ in range(2):
+            if position == len(emails):
+                break
+            try:
+                with mail.connect() as conn:
+                    while position < len(emails):
+                        email = emails[position]
+                        msg = Message(subject=email.subject, recipients=[email.to_email], body=render(email.body, email.fields), sender=sender)
+                        if email.attachment:
+                            msg.attach(filename=email.attachment[0], content_type="application/pdf", data=email.attachment[1])
+                        try:
+                            conn.send(msg)
+                        except smtplib.SMTPServerDisconnected:
+                            raise
+                        except smtplib.SMTPException as e:
+                            # Rejected recipient or message; the connection is still usable
+                            outcomes[position] = _smtp_error(e)
+                        position += 1
+                        report(position - 1, outcomes[position - 1])
+            except OSError as e:
+                # SMTPException is an OSError too: covers connect failures and dropped connections
+                current_app.logger.warning(f"SMTP connection lost during batch ({len(emails) - position} left): {e}")
+                error = DeliveryError(f"SMTP connection failed: {e}")
+        for index in range(position, len(emails)):
+            outcomes[index] = error
+            report(index, error)
+        return outcomes
+
+    def _send_brevo(self, emails, report):
+        # Emails sharing subject and body (and without attachments) go out as one messageVersions request
+        outcomes = [None] * len(emails)
+        groups = {}
+        for index, email in enumerate(emails):
+            key = None if email.attachment else (email.subject, email.body)
+            groups.setdefault(key, []).append(index)
+        for key, indexes in groups.items():
+            if key is not None and len(indexes) > 1 and self._send_brevo_versions([emails[i] for i in indexes]):
+                for index in indexes:
+                    report(index, None)
+                continue
+            for index in indexes:
+                outcomes[index] = self._send_brevo_one(emails[index])
+                report(index, outcomes[index])
+        return outcomes
+
+    def _send_brevo_versions(self, emails):
+        # Reference: Brevo – send customised versions of a transactional email in one request (Brevo, 2025)
+        # https://developers.brevo.com/docs/batch-send-transactional-emails
+        # Returns False if the batch has to be sent one email at a time instead
+        from sib_api_v3_sdk import SendSmtpEmail, SendSmtpEmailMessageVersions
+        from sib_api_v3_sdk.rest import ApiException
+
+        names = sorted({name for email in emails for name in email.fields})
+        html_content = _brevo_html(emails[0].body, names)
+        if html_content is None:
+            return False
+        request = SendSmtpEmail(
+            sender=brevo_sender(),
+            subject=emails[0].subject,
+            html_content=html_content,
+            message_versions=[
+                SendSmtpEmailMessageVersions(to=[{"email": email.to_email}], params={k: str(v) for k, v in email.fields.items()})
+                for email in emails
+            ],
+        )
+        try:
+            shared_brevo_api().send_transac_email(request)
+            return True
+        except ApiException as e:
+            # One invalid address rejects the whole request, so the emails are retried individually
+            current_app.logger.warning(f"Brevo batch of {len(emails)} rejected, sending individually: {e.status} {e.reason}")
+            return False
+
+    def _send_brevo_one(self, email):
+        from sib_api_v3_sdk.rest import ApiException
+
+        attachment = email.attachment or (None, None)
+        try:
+            _send_via_brevo(email.to_email, email.subject, render(email.body, email.fields), attachment[1], attachment[0], api=shared_brevo_api())
+        except ApiException as e:
+            # 400 means Brevo rejected this email itself (e.g. invalid address); anything else may pass later
+            return DeliveryError(f"Brevo {e.status}: {e.reason}", permanent=e.status == 400)
+        except Exception as e:
+            return DeliveryError(f"{type(e).__name__}: {e}")
+        return None
+# VERSION 7 END
@@ -68,5 +68,115 @@ class Config:
     # VERSION 6 END
     # VERSION 4 END
 
+    # VERSION 7 START
+    # Background sweeper that auto-completes events 7 days after they start
+    SWEEPER_ENABLED = os.getenv("SWEEPER_ENABLED", "1") == "1"
+    SWEEPER_INTERVAL_SECONDS = int(os.getenv("SWEEPER_INTERVAL_SECONDS", "300"))
+    SWEEPER_BATCH_SIZE = int(os.getenv("SWEEPER_BATCH_SIZE", "500"))
+
+    # Database-backed job queue (receipt rendering and emails)
+    # Set JOBS_IN_PROCESS_WORKER=0 when running a separate `flask jobs-worker` process
+    JOBS_IN_PROCESS_WORKER = os.getenv("JOBS_IN_PROCESS_WORKER", "1") == "1"
+    JOBS_WORKER_CONCURRENCY = int(os.getenv("JOBS_WORKER_CONCURRENCY", "2"))
+    JOBS_POLL_INTERVAL_SECONDS = float(os.getenv("JOBS_POLL_INTERVAL_SECONDS", "2"))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+    JOB_BACKOFF_SECONDS = int(os.getenv("JOB_BACKOFF_SECONDS", "30"))
+    JOB_BACKOFF_MAX_SECONDS = int(os.getenv("JOB_BACKOFF_MAX_SECONDS", "3600"))
+    JOB_LOCK_TIMEOUT_SECONDS = int(os.getenv("JOB_LOCK_TIMEOUT_SECONDS", "600"))
+
+    # Blob store for receipt PDFs and cover images: "local" (disk), "s3" (S3-compatible bucket) or
+    # "s3-memory" (the in-process S3 stand-in from fake_s3.py, for trying the S3 code path locally)
+    # Render's filesystem is not persistent, so production should use s3 or a mounted disk path
+    BLOB_STORAGE_BACKEND = os.getenv("BLOB_STORAGE_BACKEND", "local")
+    BLOB_STORAGE_PATH = os.getenv("BLOB_STORAGE_PATH")  # defaults to instance/blobs
+    BLOB_S3_BUCKET = os.getenv("BLOB_S3_BUCKET")
+    BLOB_S3_PREFIX = os.getenv("BLOB_S3_PREFIX", "blobs/")
+    BLOB_S3_ENDPOINT_URL = os.getenv("BLOB_S3_ENDPOINT_URL")
+    BLOB_S3_REGION = os.getenv("BLOB_S3_REGION")
+
+    # Cover image upload processing: size cap, max stored dimension and output encoding
+    COVER_MAX_UPLOAD_BYTES = int(os.getenv("COVER_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+    COVER_MAX_PIXELS = int(os.getenv("COVER_MAX_PIXELS", "40000000"))
+    COVER_MAX_DIMENSION = int(os.getenv("COVER_MAX_DIMENSION", "2400"))
+    COVER_IMAGE_FORMAT = os.getenv("COVER_IMAGE_FORMAT", "webp")  # webp or jpeg
+    COVER_IMAGE_QUALITY = int(os.getenv("COVER_IMAGE_QUALITY", "80"))
+    # Reference: Flask MAX_CONTENT_LENGTH (Pallets Projects, 2025)
+    # https://flask.palletsprojects.com/en/stable/config/#MAX_CONTENT_LENGTH
+    # Reject request bodies over the cover limit (plus room for the form fields) before they are parsed
+    MAX_CONTENT_LENGTH = COVER_MAX_UPLOAD_BYTES + 1024 * 1024
+
+    # Rows per page for paginated organiser tables
+    ANALYTICS_ORDERS_PER_PAGE = int(os.getenv("ANALYTICS_ORDERS_PER_PAGE", "50"))
+    REPORT_ORDERS_PER_PAGE = int(os.getenv("REPORT_ORDERS_PER_PAGE", "100"))
+    # Public event listing page size and number of upcoming events featured on the homepage
+    EVENTS_PER_PAGE = int(os.getenv("EVENTS_PER_PAGE", "24"))
+    HOMEPAGE_FEATURED_EVENTS = int(os.getenv("HOMEPAGE_FEATURED_EVENTS", "6"))
+
+    # Application cache: "memory" (per worker process) or "redis" (shared by all workers)
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+    CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+    CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "cache:")
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+    CACHE_DEFAULT_TTL_SECONDS = int(os.getenv("CACHE_DEFAULT_TTL_SECONDS", "60"))
+    # Upper bound on how stale the homepage stats can be in workers that missed an invalidation
+    HOMEPAGE_STATS_TTL_SECONDS = int(os.getenv("HOMEPAGE_STATS_TTL_SECONDS", "300"))
+    # Full-page cache for anonymous visitors to the public pages (per-route TTLs are set in routes.py).
+    # Only used with CACHE_BACKEND=redis, so an event change reaches every worker.
+    PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "1") == "1"
+
+    # Audit log storage: monthly partitions created in advance, and months kept before `flask audit-archive`
+    # exports them to the blob store
+    AUDIT_PARTITION_MONTHS_AHEAD = int(os.getenv("AUDIT_PARTITION_MONTHS_AHEAD", "3"))
+    AUDIT_RETENTION_MONTHS = int(os.getenv("AUDIT_RETENTION_MONTHS", "24"))
+    # "db": buffered rows are bulk-inserted at commit. "file": committed rows are appended to a local
+    # spool (AUDIT_SPOOL_PATH, default instance/audit_spool) and bulk-loaded by the sweeper; needs a persistent disk
+    AUDIT_WRITE_MODE = os.getenv("AUDIT_WRITE_MODE", "db")
+    AUDIT_SPOOL_PATH = os.getenv("AUDIT_SPOOL_PATH")
+
+    # OpenRouter HTTP client: one pooled client per process, explicit timeouts and a cap on
+    # concurrent AI calls (callers wait up to OPENROUTER_ACQUIRE_TIMEOUT for a slot)
+    OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+    OPENROUTER_CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "5"))
+    OPENROUTER_READ_TIMEOUT = float(os.getenv("OPENROUTER_READ_TIMEOUT", "60"))
+    OPENROUTER_KEEPALIVE_SECONDS = float(os.getenv("OPENROUTER_KEEPALIVE_SECONDS", "60"))
+    OPENROUTER_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "10"))
+    OPENROUTER_MAX_CONCURRENCY = int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "8"))
+    OPENROUTER_ACQUIRE_TIMEOUT = float(os.getenv("OPENROUTER_ACQUIRE_TIMEOUT", "10"))
+    OPENROUTER_MAX_RETRIES = int(os.getenv("OPENROUTER_MAX_RETRIES", "2"))
+
+    # Stored AI responses: identical requests are answered from the ai_response_cache table until the
+    # TTL runs out; least recently used entries are evicted beyond the entry and size limits
+    AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "1") == "1"
+    AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "5000"))
+    AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", str(20 * 1024 * 1024)))
+
+    # AI gateway: each user may start AI_USER_BURST upstream calls at once, refilled at
+    # AI_USER_CALLS_PER_MINUTE (0 turns the budget off); cached and coalesced answers are free
+    AI_USER_CALLS_PER_MINUTE = float(os.getenv("AI_USER_CALLS_PER_MINUTE", "6"))
+    AI_USER_BURST = int(os.getenv("AI_USER_BURST", "3"))
+
+    # Model fallback chain: comma-separated models in order of preference (defaults to OPENROUTER_MODEL).
+    # OPENROUTER_MODEL_TIMEOUTS sets per-model read timeouts ("model=seconds,..."). When a model has not
+    # answered within OPENROUTER_HEDGE_AFTER_SECONDS the next one is started too (0 turns hedging off).
+    # Models that fail or are slow over the last OPENROUTER_MODEL_STATS_WINDOW_SECONDS move down the chain.
+    OPENROUTER_MODELS = os.getenv("OPENROUTER_MODELS", "")
+    OPENROUTER_MODEL_TIMEOUTS = os.getenv("OPENROUTER_MODEL_TIMEOUTS", "")
+    OPENROUTER_HEDGE_AFTER_SECONDS = float(os.getenv("OPENROUTER_HEDGE_AFTER_SECONDS", "15"))
+    OPENROUTER_MODEL_STATS_WINDOW_SECONDS = int(os.getenv("OPENROUTER_MODEL_STATS_WINDOW_SECONDS", "300"))
+
+    # Email outbox batches: MAIL_BULK_BATCH_SIZE emails share one SMTP connection; on Brevo up to
+    # BREVO_BATCH_SIZE emails (Brevo allows 1000) that differ only in personal fields are one API request
+    MAIL_BULK_BATCH_SIZE = int(os.getenv("MAIL_BULK_BATCH_SIZE", "100"))
+    BREVO_BATCH_SIZE = int(os.getenv("BREVO_BATCH_SIZE", "500"))
+    # Failed deliveries are retried after EMAIL_OUTBOX_BACKOFF_SECONDS, doubling up to the maximum, until
+    # EMAIL_OUTBOX_MAX_ATTEMPTS; sent emails keep their body for EMAIL_OUTBOX_KEEP_DAYS
+    EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "6"))
+    EMAIL_OUTBOX_BACKOFF_SECONDS = int(os.getenv("EMAIL_OUTBOX_BACKOFF_SECONDS", "60"))
+    EMAIL_OUTBOX_BACKOFF_MAX_SECONDS = int(os.getenv("EMAIL_OUTBOX_BACKOFF_MAX_SECONDS", str(6 * 3600)))
+    EMAIL_OUTBOX_LOCK_TIMEOUT_SECONDS = int(os.getenv("EMAIL_OUTBOX_LOCK_TIMEOUT_SECONDS", "600"))
+    EMAIL_OUTBOX_KEEP_DAYS = int(os.getenv("EMAIL_OUTBOX_KEEP_DAYS", "30"))
+    # VERSION 7 END
+
 
 # VERSION 1
\ No newline at end of file
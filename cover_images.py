@@ -0,0 +1,237 @@
+# VERSION 7 START
+# This file processes, stores and serves event cover images.
+# Uploads are size-capped, decoded, stripped of metadata, downsized and re-encoded before storage.
+# The processed cover goes to the blob store together with pre-sized variants (thumb, card, hero),
+# and the cover route answers with ETag/Last-Modified caching headers so browsers revalidate cheaply.
+
+import io
+from datetime import datetime, timezone
+
+import click
+from flask import request, abort, send_file, Response, current_app
+from flask.cli import with_appcontext
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+from sqlalchemy import select
+
+from models import db, Event
+from blob_store import blobs, BlobNotFound
+from schema import upgrade_schema
+
+# Bounding boxes for the resized variants (width, height); the aspect ratio is kept
+COVER_VARIANTS = {
+    "thumb": (320, 180),    # organiser edit page preview
+    "card": (800, 450),     # event cards on listings
+    "hero": (1600, 900),    # event detail banner
+}
+
+# Pillow format name -> mimetype for the formats covers are re-encoded to
+OUTPUT_MIMETYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+# Uploads are read in chunks of this size so an oversized file is rejected early
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+# Versioned cover URLs (?v=<content key>) never change content, so they can be cached for a year.
+# Unversioned URLs get a short lifetime and are revalidated with the ETag.
+COVER_MAX_AGE_VERSIONED = 365 * 24 * 3600
+COVER_MAX_AGE_UNVERSIONED = 300
+
+
+# Raised for uploads that are rejected; the message is shown to the organiser
+class CoverImageError(ValueError):
+    pass
+
+
+def _output_format():
+    # WebP is smaller at the same quality; fall back to JPEG if Pillow was built without it
+    fmt = current_app.config.get("COVER_IMAGE_FORMAT", "webp").upper()
+    if fmt == "WEBP" and not features.check("webp"):
+        fmt = "JPEG"
+    return fmt if fmt in OUTPUT_MIMETYPES else "JPEG"
+
+
+def _encode(img, fmt):
+    # Re-encodes an image with no metadata (EXIF, XMP, comments) carried over from the upload
+    quality = current_app.config.get("COVER_IMAGE_QUALITY", 80)
+    if fmt == "JPEG" and img.mode != "RGB":
+        # JPEG has no alpha channel: flatten transparent areas onto white
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        rgba = img.convert("RGBA")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        img = background
+    buf = io.BytesIO()
+    # Reference: Pillow image file format options for WebP and JPEG (Pillow, 2025)
+    # https://pillow.readthedocs.io/en/stable/handbook/image-file-formats.html
+    if fmt == "WEBP":
+        img.save(buf, "WEBP", quality=quality, method=4)
+    else:
+        img.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def read_upload(file_storage, max_bytes):
+    # Reads an uploaded file in chunks, stopping as soon as it goes over max_bytes
+    chunks = []
+    total = 0
+    while True:
+        chunk = file_storage.stream.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise CoverImageError(f"Images must be {round(max_bytes / (1024 * 1024), 2):g} MB or smaller.")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def process_cover_upload(file_storage):
+    # Validates and normalises an uploaded cover image.
+    # Returns (bytes, mimetype, original size in bytes) ready for store_cover_image.
+    cfg = current_app.config
+    data = read_upload(file_storage, cfg.get("COVER_MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+    if not data:
+        raise CoverImageError("The uploaded image is empty.")
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        # Check the header dimensions before decoding so huge images are never expanded in memory
+        if img.width * img.height > cfg.get("COVER_MAX_PIXELS", 40_000_000):
+            raise CoverImageError("The image dimensions are too large.")
+        img.load()
+    except CoverImageError:
+        raise
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise CoverImageError("The file could not be read as an image.")
+
+    # Reference: Pillow ImageOps.exif_transpose (Pillow, 2025)
+    # https://pillow.readthedocs.io/en/stable/reference/ImageOps.html#PIL.ImageOps.exif_transpose
+    # Apply the camera's orientation tag to the pixels, since the EXIF data is dropped on re-encode
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+
+    max_dim = cfg.get("COVER_MAX_DIMENSION", 2400)
+    img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+
+    fmt = _output_format()
+    return _encode(img, fmt), OUTPUT_MIMETYPES[fmt], len(data)
+
+
+def build_cover_variants(data):
+    # Returns {variant name: (bytes, mimetype)} for every variant smaller than the cover.
+    # Images Pillow cannot decode get no variants and are always served as stored.
+    # Reference: Pillow Image.thumbnail (Pillow, 2025)
+    # https://pillow.readthedocs.io/en/stable/reference/Image.html#PIL.Image.Image.thumbnail
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            original = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    except (UnidentifiedImageError, OSError):
+        return {}
+
+    fmt = _output_format()
+    variants = {}
+    for name, box in COVER_VARIANTS.items():
+        if original.width <= box[0] and original.height <= box[1]:
+            # Already small enough: serve the cover itself for this size
+            continue
+        resized = original.copy()
+        resized.thumbnail(box, Image.LANCZOS)
+        variants[name] = (_encode(resized, fmt), OUTPUT_MIMETYPES[fmt])
+    return variants
+
+
+def store_cover_image(ev, data, mimetype, original_size=None):
+    # Saves a cover and its variants to the blob store and points the event at them.
+    # original_size is the uploaded file size, kept to compare against the stored size.
+    ev.cover_image_key, ev.cover_image_size = blobs.put(data, mimetype)
+    ev.cover_image_mimetype = mimetype
+    ev.cover_image_original_size = original_size or ev.cover_image_size
+    variants = {}
+    for name, (variant_bytes, variant_mimetype) in build_cover_variants(data).items():
+        variants[name] = {"key": blobs.put(variant_bytes, variant_mimetype)[0], "mimetype": variant_mimetype}
+    ev.cover_image_variants = variants
+    ev.cover_image_updated_at = datetime.utcnow()
+
+
+def clear_cover_image(ev):
+    # The blobs themselves are left in place since other events may share the same content key
+    ev.cover_image_key = None
+    ev.cover_image_size = None
+    ev.cover_image_mimetype = None
+    ev.cover_image_original_size = None
+    ev.cover_image_variants = None
+    ev.cover_image_updated_at = datetime.utcnow()
+
+
+def cover_response(event_id, size=None):
+    # Serves an event cover (or one of its variants) with caching headers.
+    # Conditional requests are answered from the event row alone, without opening the blob.
+    row = db.session.execute(
+        select(Event.cover_image_key, Event.cover_image_mimetype, Event.cover_image_variants, Event.cover_image_updated_at)
+        .where(Event.id == event_id)
+    ).first()
+    if not row or not row.cover_image_key:
+        abort(404)
+
+    key, mimetype = row.cover_image_key, row.cover_image_mimetype or "image/jpeg"
+    variant = (row.cover_image_variants or {}).get(size)
+    if variant:
+        key, mimetype = variant["key"], variant["mimetype"]
+
+    # The blob key is the SHA-256 of the served bytes, so it is a strong ETag as-is
+    etag = key
+    last_modified = row.cover_image_updated_at.replace(tzinfo=timezone.utc, microsecond=0) if row.cover_image_updated_at else None
+    versioned = request.args.get("v") == row.cover_image_key[:12]
+    max_age = COVER_MAX_AGE_VERSIONED if versioned else COVER_MAX_AGE_UNVERSIONED
+
+    # Reference: HTTP conditional requests (MDN Web Docs, 2025)
+    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Conditional_requests
+    # If-None-Match takes precedence over If-Modified-Since when both are sent
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = bool(last_modified and request.if_modified_since and last_modified <= request.if_modified_since)
+
+    if not_modified:
+        resp = Response(status=304)
+    else:
+        try:
+            resp = send_file(blobs.open(key), mimetype=mimetype, conditional=False, etag=False, max_age=max_age)
+        except BlobNotFound:
+            abort(404)
+
+    # Reference: Werkzeug response cache control and ETag helpers (Pallets Projects, 2025)
+    # https://werkzeug.palletsprojects.com/en/stable/wrappers/#werkzeug.wrappers.Response.cache_control
+    resp.set_etag(etag)
+    if last_modified:
+        resp.last_modified = last_modified
+    resp.cache_control.public = True
+    resp.cache_control.max_age = max_age
+    if versioned:
+        resp.cache_control.immutable = True
+    return resp
+
+
+def backfill_cover_variants(echo=print):
+    # Builds variants for events whose cover was uploaded before variants existed
+    upgrade_schema(echo=echo)
+    events = Event.query.filter(Event.cover_image_key != None, Event.cover_image_variants.is_(None)).all()
+    for ev in events:
+        try:
+            data = blobs.get(ev.cover_image_key)
+        except BlobNotFound:
+            echo(f"Event {ev.id}: cover blob missing, skipped")
+            continue
+        store_cover_image(ev, data, ev.cover_image_mimetype or "image/jpeg", ev.cover_image_original_size)
+        db.session.commit()
+    echo(f"Built cover variants for {len(events)} events.")
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("build-cover-variants")
+@with_appcontext
+def build_cover_variants_command():
+    # Generate thumb/card/hero variants for existing cover images
+    backfill_cover_variants(echo=click.echo)
+# VERSION 7 END
@@ -1,17 +1,32 @@
 # VERSION 4 START
 
-# Reference: Flask-Mail – sending emails and attachments (Pallets Projects, 2025)
-# https://flask-mail.readthedocs.io/en/latest/
-
-from flask import current_app
-from flask_mail import Message
-
 # Claude: https://claude.ai/share/259f7745-1066-4528-a8ab-213828dfac51
 # VERSION 6 START
 import base64
 import os
 
-def _send_via_brevo(to_email, subject, body, pdf_bytes=None, filename=None):
+# VERSION 7 START
+def brevo_api():
+    # A Brevo transactional email client; one client can send many emails over the same connection pool
+    from sib_api_v3_sdk import Configuration, ApiClient, TransactionalEmailsApi
+
+    api_key = os.getenv("BREVO_API_KEY")
+    if not api_key:
+        raise RuntimeError("BREVO_API_KEY not set")
+
+    # Configure the Brevo API client with our API key
+    config = Configuration()
+    config.api_key["api-key"] = api_key
+    return TransactionalEmailsApi(ApiClient(config))
+
+
+def brevo_sender():
+    # Sender with a display name for professional inbox display
+    return {"name": "CharityConnect", "email": os.getenv("BREVO_SENDER_EMAIL", "noreply@charityconnect.ie")}
+# VERSION 7 END
+
+
+def _send_via_brevo(to_email, subject, body, pdf_bytes=None, filename=None, api=None):
     """Send a transactional email via Brevo's HTTP API.
     Bypasses SMTP port blocks on Render free tier.
     Args:
@@ -20,23 +35,23 @@ def _send_via_brevo(to_email, subject, body, pdf_bytes=None, filename=None):
         body:       Plain-text email body.
         pdf_bytes:  Optional PDF content as bytes.
         filename:   Filename for the PDF attachment.
+        api:        Optional shared TransactionalEmailsApi (see brevo_api).
     """
     # Reference: Brevo (Sendinblue) Transactional Email API (Brevo, 2025)
     # https://developers.brevo.com/docs/send-a-transactional-email
-    from sib_api_v3_sdk import Configuration, ApiClient, TransactionalEmailsApi, SendSmtpEmail
+    from sib_api_v3_sdk import SendSmtpEmail
 
-    api_key = os.getenv("BREVO_API_KEY")
-    if not api_key:
-        raise RuntimeError("BREVO_API_KEY not set")
-
-    # Configure the Brevo API client with our API key
-    config = Configuration()
-    config.api_key["api-key"] = api_key
-    api = TransactionalEmailsApi(ApiClient(config))
+    # VERSION 7 START
+    # Bulk senders pass one shared client instead of building a new one per email
+    if api is None:
+        api = brevo_api()
+    # VERSION 7 END
 
     # Build the email payload with sender name for professional inbox display
     email = SendSmtpEmail(
-        sender={"name": "CharityConnect", "email": os.getenv("BREVO_SENDER_EMAIL", "noreply@charityconnect.ie")},
+        # VERSION 7 START
+        sender=brevo_sender(),
+        # VERSION 7 END
         to=[{"email": to_email}],
         subject=subject,
         text_content=body,
@@ -53,37 +68,11 @@ def _send_via_brevo(to_email, subject, body, pdf_bytes=None, filename=None):
     api.send_transac_email(email)
 # VERSION 6 END
 
-def send_receipt_email(mail, to_email: str, subject: str, body: str, pdf_bytes: bytes, filename: str):
-    # Sends an email with a PDF receipt attached.
-    # VERSION 6 START
-    # Try Brevo HTTP API first (works on Render free tier where SMTP is blocked)
-    if os.getenv("BREVO_API_KEY"):
-        _send_via_brevo(to_email, subject, body, pdf_bytes, filename)
-        return
-    # VERSION 6 END
-
-    # Create the email message
-    msg = Message(
-        subject=subject,
-        recipients=[to_email],
-        body=body,
-        sender=current_app.config.get("MAIL_DEFAULT_SENDER"),
-    )
-
-    # Attach the PDF receipt if it exists
-    if pdf_bytes:
-        msg.attach(
-            filename=filename,
-            content_type="application/pdf",
-            data=pdf_bytes,
-        )
-
-    # Send the email using Flask-Mail
-    mail.send(msg)
-
 # VERSION 5 START
-def send_refund_decision_email(mail, to_email: str, event_title: str, approved: bool, organiser_note: str):
-     # Send an email informing the user whether their refund request was approved or denied.
+# VERSION 7 START
+def refund_decision_content(event_title: str, approved: bool, organiser_note: str):
+    # Subject and plain-text body telling the user whether their refund request was approved or denied.
+# VERSION 7 END
 
     # Determine decision wording for subject line
     status_word = "approved" if approved else "denied"
@@ -110,26 +99,16 @@ def send_refund_decision_email(mail, to_email: str, event_title: str, approved:
         "\nIf you have any questions, please contact the event organiser directly.\n\n"
         "CharityConnect"
     )
+    # VERSION 7 START
+    return subject, body
+    # VERSION 7 END
 
-    # VERSION 6 START
-    # Try Brevo HTTP API first (works on Render free tier where SMTP is blocked)
-    if os.getenv("BREVO_API_KEY"):
-        _send_via_brevo(to_email, subject, body)
-        return
-    # VERSION 6 END
 
-    # Create email message
-    msg = Message(
-        subject=subject,
-        recipients=[to_email],
-        body=body,
-        sender=current_app.config.get("MAIL_DEFAULT_SENDER"),
-    )
-    mail.send(msg)
-
-
-def send_impact_summary_email(mail, to_email: str, event_title: str, event_date: str, user_contribution_eur: float, total_raised_eur: float, tickets_sold: int, allocations: list):
-    # Send a post-event summary showing how the user's contribution was distributed.
+# VERSION 7 START
+def impact_summary_content(event_title: str, event_date: str, user_contribution: str, total_raised_eur: float, tickets_sold: int, allocations: list):
+    # Subject and plain-text body of a post-event impact summary. user_contribution is already
+    # formatted (e.g. "€12.50") so the bulk mailer can put a per-recipient placeholder there.
+# VERSION 7 END
 
     # Subject highlights the purpose of the email
     subject = f"Your Impact: {event_title}"
@@ -142,7 +121,9 @@ def send_impact_summary_email(mail, to_email: str, event_title: str, event_date:
         # Personal contribution section
         "Your contribution\n"
         "-----------------\n"
-        f"€{user_contribution_eur:.2f}\n\n"
+        # VERSION 7 START
+        f"{user_contribution}\n\n"
+        # VERSION 7 END
         # Overall event totals
         "Event totals\n"
         "------------\n"
@@ -164,21 +145,8 @@ def send_impact_summary_email(mail, to_email: str, event_title: str, event_date:
         "If you have any questions, please contact the event organiser.\n\n"
         "CharityConnect Team"
     )
-
-    # VERSION 6 START
-    # Try Brevo HTTP API first (works on Render free tier where SMTP is blocked)
-    if os.getenv("BREVO_API_KEY"):
-        _send_via_brevo(to_email, subject, body)
-        return
-    # VERSION 6 END
-
-    # Create email message
-    msg = Message(
-        subject=subject,
-        recipients=[to_email],
-        body=body,
-        sender=current_app.config.get("MAIL_DEFAULT_SENDER"),
-    )
-    mail.send(msg)
+    # VERSION 7 START
+    return subject, body
+    # VERSION 7 END
 # VERSION 5 END
 # VERSION 4 END
\ No newline at end of file
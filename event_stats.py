@@ -0,0 +1,182 @@
+# VERSION 7 START
+# This file maintains the event_stats rollup table.
+# Every change that affects an event's totals (order paid, ticket redeemed or refunded) adds its
+# delta to the event's row inside the same database transaction, so the totals are always
+# consistent with the orders they summarise. rebuild_event_stats recomputes them from raw orders.
+
+from datetime import datetime
+from types import SimpleNamespace
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, insert, func, case
+from sqlalchemy.exc import IntegrityError
+
+from models import db, EventStats, Order, Ticket
+from app_cache import invalidate_after_commit, PLATFORM_STATS_KEY
+from page_cache import PLATFORM_STATS_TAG
+
+# Counter columns kept in the rollup
+STAT_FIELDS = ("paid_orders", "tickets_sold", "total_raised_cents", "donation_cents", "tickets_redeemed", "tickets_refunded")
+
+
+def _bump(event_id, **deltas):
+    # Adds deltas to an event's counters in the current transaction, creating the row if needed.
+    # "col = col + delta" lets concurrent transactions update the same row without losing counts.
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not event_id or not deltas:
+        return
+    values = {name: getattr(EventStats, name) + delta for name, delta in deltas.items()}
+    stmt = (
+        update(EventStats)
+        .where(EventStats.event_id == event_id)
+        .values(updated_at=datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.execute(stmt).rowcount:
+        return
+
+    # First change for this event: insert its row
+    row = {name: 0 for name in STAT_FIELDS}
+    row.update(deltas)
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(EventStats).values(event_id=event_id, updated_at=datetime.utcnow(), **row))
+    except IntegrityError:
+        # Another transaction inserted the row first; add to it instead
+        db.session.execute(stmt)
+
+
+def record_order_paid(order):
+    # Call when an order changes to PAID, before the commit
+    _bump(
+        order.event_id,
+        paid_orders=1,
+        tickets_sold=order.qty or 0,
+        total_raised_cents=order.total_cents or 0,
+        donation_cents=order.donation_cents or 0,
+    )
+
+
+def record_tickets_redeemed(event_id, count=1):
+    _bump(event_id, tickets_redeemed=count)
+
+
+def record_tickets_refunded(event_id, count=1):
+    _bump(event_id, tickets_refunded=count)
+
+
+def _empty_stats(event_id=None):
+    return SimpleNamespace(event_id=event_id, **{name: 0 for name in STAT_FIELDS})
+
+
+def stats_for_event(event_id):
+    # The rollup row for one event (all zeros if nothing has been sold yet)
+    return db.session.get(EventStats, event_id) or _empty_stats(event_id)
+
+
+def stats_for_events(event_ids):
+    # {event_id: stats} for several events in one query
+    event_ids = list(event_ids)
+    found = {}
+    if event_ids:
+        found = {s.event_id: s for s in EventStats.query.filter(EventStats.event_id.in_(event_ids)).all()}
+    return {event_id: found.get(event_id) or _empty_stats(event_id) for event_id in event_ids}
+
+
+def platform_totals():
+    # Platform-wide totals: sums one row per event rather than every order
+    row = db.session.execute(
+        select(*[func.coalesce(func.sum(getattr(EventStats, name)), 0).label(name) for name in STAT_FIELDS])
+    ).one()
+    return SimpleNamespace(**{name: int(getattr(row, name)) for name in STAT_FIELDS})
+
+
+def _raw_event_totals():
+    # Recomputes every event's counters from the orders and tickets tables
+    totals = {}
+    order_rows = db.session.execute(
+        select(
+            Order.event_id,
+            func.count(Order.id),
+            func.coalesce(func.sum(Order.qty), 0),
+            func.coalesce(func.sum(Order.total_cents), 0),
+            func.coalesce(func.sum(Order.donation_cents), 0),
+        )
+        .where(Order.status == "PAID")
+        .group_by(Order.event_id)
+    ).all()
+    for event_id, paid_orders, tickets_sold, total_raised, donations in order_rows:
+        totals[event_id] = dict.fromkeys(STAT_FIELDS, 0)
+        totals[event_id].update(paid_orders=paid_orders, tickets_sold=tickets_sold, total_raised_cents=total_raised, donation_cents=donations)
+
+    ticket_rows = db.session.execute(
+        select(
+            Order.event_id,
+            func.coalesce(func.sum(case((Ticket.redeemed == True, 1), else_=0)), 0),
+            func.coalesce(func.sum(case((Ticket.refunded == True, 1), else_=0)), 0),
+        )
+        .join(Order, Order.id == Ticket.order_id)
+        .group_by(Order.event_id)
+    ).all()
+    for event_id, redeemed, refunded in ticket_rows:
+        totals.setdefault(event_id, dict.fromkeys(STAT_FIELDS, 0))
+        totals[event_id].update(tickets_redeemed=redeemed, tickets_refunded=refunded)
+    return {event_id: {k: int(v) for k, v in t.items()} for event_id, t in totals.items()}
+
+
+def rebuild_event_stats(verify_only=False, echo=print):
+    # Compares the rollup with totals recomputed from raw orders, reporting every difference.
+    # Unless verify_only is set, drifted or missing rows are rewritten with the recomputed values.
+    # Returns the number of events that had drifted.
+    raw = _raw_event_totals()
+    stored = {s.event_id: s for s in EventStats.query.all()}
+    drifted = 0
+
+    for event_id in sorted(set(raw) | set(stored)):
+        expected = raw.get(event_id, dict.fromkeys(STAT_FIELDS, 0))
+        current = stored.get(event_id)
+        diffs = {
+            name: (getattr(current, name) if current else 0, value)
+            for name, value in expected.items()
+            if (getattr(current, name) if current else 0) != value
+        }
+        if not diffs:
+            continue
+        drifted += 1
+        echo(f"Event {event_id}: " + ", ".join(f"{name} {old} -> {new}" for name, (old, new) in diffs.items()))
+        if verify_only:
+            continue
+        if current is None:
+            current = EventStats(event_id=event_id)
+            db.session.add(current)
+        for name, value in expected.items():
+            setattr(current, name, value)
+        current.updated_at = datetime.utcnow()
+
+    if not verify_only:
+        if drifted:
+            invalidate_after_commit(PLATFORM_STATS_KEY, tags=(PLATFORM_STATS_TAG,))
+        db.session.commit()
+    return drifted
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("rebuild-event-stats")
+@with_appcontext
+@click.option("--verify", is_flag=True, help="Only report drift; exit with status 1 if any is found.")
+@click.option("--if-empty", is_flag=True, help="Only rebuild when the rollup table has no rows yet (used by build.sh).")
+def rebuild_event_stats_command(verify, if_empty):
+    # Recompute the event_stats rollup from raw orders and report any drift
+    if if_empty and db.session.query(EventStats.event_id).first():
+        click.echo("event_stats already populated; skipped.")
+        return
+    drifted = rebuild_event_stats(verify_only=verify, echo=click.echo)
+    if verify:
+        click.echo(f"{drifted} event(s) drifted from raw orders.")
+        if drifted:
+            raise SystemExit(1)
+    else:
+        click.echo(f"Rebuilt event_stats; {drifted} event(s) corrected.")
+# VERSION 7 END
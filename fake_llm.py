@@ -0,0 +1,162 @@
+# VERSION 7 START
+# This file runs a local stand-in for the OpenRouter chat completions API.
+# It answers POST /v1/chat/completions with a canned reply built from the last user message, either
+# as one JSON response or streamed as Server-Sent Events chunks with a delay between tokens, so the
+# AI features (including streaming and time-to-first-token) can be checked without an API key:
+#     flask --app app fake-llm --port 8765
+#     OPENROUTER_BASE_URL=http://127.0.0.1:8765/v1 OPENROUTER_API_KEY=dev python app.py
+# Model names ending in ":fail" get a 503 error and ":slow" adds SLOW_MODEL_DELAY seconds before the
+# first token, for trying out the model fallback chain (e.g. OPENROUTER_MODELS=a:slow,b).
+
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from openrouter_client import chat, chat_stream, client_manager
+
+
+def fake_reply(messages):
+    # Deterministic reply so repeated requests can be compared
+    prompt = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    words = " ".join(prompt.split()[:40])
+    return f"This is a locally generated reply to: {words}"
+
+
+# Extra delay for models named "...:slow"
+SLOW_MODEL_DELAY = 5.0
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    # Reference: OpenAI chat completions object and streaming chunk format (OpenAI, 2025)
+    # https://platform.openai.com/docs/api-reference/chat/object
+    # https://platform.openai.com/docs/api-reference/chat-streaming
+    protocol_version = "HTTP/1.1"
+    # Set on the server: seconds to wait before the first token and between tokens
+    first_token_delay = 0.0
+    token_delay = 0.05
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        try:
+            self._respond()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (timeout, hedged request won elsewhere); nothing left to send
+            self.close_connection = True
+
+    def _respond(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        model = body.get("model", "fake")
+        if model.endswith(":fail"):
+            self._send_json(503, {"error": {"message": f"{model} is overloaded", "code": 503}})
+            return
+        first_token_delay = self.first_token_delay + (SLOW_MODEL_DELAY if model.endswith(":slow") else 0)
+        text = fake_reply(body.get("messages") or [])
+        base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": model}
+
+        if not body.get("stream"):
+            time.sleep(first_token_delay + self.token_delay * len(text.split()))
+            self._send_json(200, dict(base, object="chat.completion", choices=[
+                {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}},
+            ]))
+            return
+
+        # Streamed reply: one chunk per word, then the finish chunk and [DONE]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        time.sleep(first_token_delay)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            delta = {"content": word if i == 0 else " " + word}
+            if i == 0:
+                delta["role"] = "assistant"
+            self._write_event(dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+            time.sleep(self.token_delay)
+        self._write_event(dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _write_event(self, payload):
+        self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+        self.wfile.flush()
+
+
+def start_fake_llm(host="127.0.0.1", port=0, token_delay=0.05, first_token_delay=0.0):
+    # Starts the server on a daemon thread and returns it; server.server_port is the bound port
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {
+        "token_delay": token_delay,
+        "first_token_delay": first_token_delay,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("fake-llm")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8765, show_default=True, type=int)
+@click.option("--token-delay", default=0.05, show_default=True, type=float, help="Seconds between streamed tokens.")
+@click.option("--first-token-delay", default=0.5, show_default=True, type=float, help="Seconds before the first token.")
+def fake_llm_command(host, port, token_delay, first_token_delay):
+    # Run a local OpenAI-compatible chat completions server for development
+    server = start_fake_llm(host, port, token_delay, first_token_delay)
+    click.echo(f"Fake LLM listening on http://{host}:{server.server_port}/v1 (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+@click.command("bench-ai-stream")
+@with_appcontext
+@click.option("--token-delay", default=0.02, show_default=True, type=float)
+@click.option("--first-token-delay", default=0.5, show_default=True, type=float)
+def bench_ai_stream_command(token_delay, first_token_delay):
+    # Compare time to first text for chat() and chat_stream() against the local fake server
+    server = start_fake_llm(token_delay=token_delay, first_token_delay=first_token_delay)
+    current_app.config.update(
+        OPENROUTER_BASE_URL=f"http://127.0.0.1:{server.server_port}/v1",
+        OPENROUTER_API_KEY=current_app.config.get("OPENROUTER_API_KEY") or "dev",
+    )
+    messages = [{"role": "user", "content": " ".join(f"word{i}" for i in range(100))}]
+    try:
+        start = time.perf_counter()
+        chat(messages, max_tokens=200)
+        blocking = time.perf_counter() - start
+
+        start = time.perf_counter()
+        first = None
+        for _ in chat_stream(messages, max_tokens=200):
+            if first is None:
+                first = time.perf_counter() - start
+        streamed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        client_manager.close()
+    click.echo(f"chat():        first text after {blocking * 1000:.0f} ms (whole reply)")
+    click.echo(f"chat_stream(): first text after {first * 1000:.0f} ms, whole reply after {streamed * 1000:.0f} ms")
+# VERSION 7 END
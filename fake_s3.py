@@ -0,0 +1,56 @@
+# VERSION 7 START
+# This file is an in-memory stand-in for the S3 client used by the blob store.
+# It implements the calls S3BlobStore makes (put_object, get_object, head_object, delete_object)
+# with the same arguments and response shapes as boto3, keeping objects in a dict, so the S3 code
+# path can be tried without AWS, MinIO or boto3:
+#     BLOB_STORAGE_BACKEND=s3-memory flask --app app run
+#     flask --app app check-blob-store --s3-memory
+# Objects live in one process only and are gone on restart; never use it in production.
+
+import hashlib
+import io
+import threading
+
+
+class FakeS3Error(Exception):
+    # Shaped like botocore's ClientError: the code is in e.response["Error"]["Code"]
+    def __init__(self, code, message):
+        super().__init__(f"{code}: {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+class MemoryS3Client:
+    # Reference: boto3 S3 client (Amazon Web Services, 2025)
+    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def _find(self, bucket, key):
+        with self._lock:
+            found = self._objects.get((bucket, key))
+        if found is None:
+            raise FakeS3Error("NoSuchKey", f"{bucket}/{key} does not exist")
+        return found
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, **kwargs):
+        data = bytes(Body) if isinstance(Body, (bytes, bytearray, memoryview)) else Body.read()
+        with self._lock:
+            self._objects[(Bucket, Key)] = (data, ContentType or "binary/octet-stream")
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        data, content_type = self._find(Bucket, Key)
+        return {"Body": io.BytesIO(data), "ContentLength": len(data), "ContentType": content_type}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        data, content_type = self._find(Bucket, Key)
+        return {"ContentLength": len(data), "ContentType": content_type}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        # Like S3, deleting a missing object is not an error
+        with self._lock:
+            self._objects.pop((Bucket, Key), None)
+        return {}
+# VERSION 7 END
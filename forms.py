@@ -68,7 +68,9 @@ class EventForm(FlaskForm):
     # VERSION 5 START
     cover_image = FileField("Event Image (optional)", validators=[
         Optional(),
-        FileAllowed(['jpg', 'jpeg', 'png'], 'JPG and PNG only.')
+        # VERSION 7 START
+        FileAllowed(['jpg', 'jpeg', 'png', 'webp'], 'JPG, PNG and WebP only.')
+        # VERSION 7 END
     ])
     # VERSION 5 END
 
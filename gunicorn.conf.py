@@ -0,0 +1,13 @@
+# VERSION 7 START
+# Gunicorn settings, loaded automatically when gunicorn is started from the project directory
+# (e.g. the Render start command `gunicorn "app:create_app()"`).
+# Reference: Gunicorn server hooks (Gunicorn, 2025)
+# https://docs.gunicorn.org/en/stable/settings.html#post-worker-init
+
+
+def post_worker_init(worker):
+    # Each serving worker starts its background threads once the app is loaded. Threads do not
+    # survive a fork, and `flask` commands (build.sh, one-off commands) never get here.
+    from app import start_background_threads
+    start_background_threads(worker.wsgi)
+# VERSION 7 END
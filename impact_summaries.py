@@ -0,0 +1,149 @@
+# VERSION 7 START
+# This file sends post-event impact summaries as a background job.
+# Completing an event (or pressing "Send Impact Summaries") queues one impact_summaries job instead of
+# emailing every attendee inside the organiser's request. The job builds the summary once and adds one
+# email per attendee to the email outbox, which delivers them in batches. Each email's dedupe key is
+# (event, email address, IMPACT_SUMMARY), so pressing the button again only emails attendees who have
+# not been sent a summary yet.
+
+from sqlalchemy import select
+
+from models import db, Event, Order, Job
+from audit import log_action
+from email_utils import impact_summary_content
+from event_stats import stats_for_event
+from jobs import enqueue, job_handler, report_progress
+from bulk_mail import bulk_field
+from outbox import queue_emails, group_counts, dedupe_key, IMPACT_SUMMARY
+
+IMPACT_SUMMARIES_JOB = "impact_summaries"
+
+
+def _job_key_prefix(event_id):
+    return f"impact-summaries:{event_id}:"
+
+
+def latest_impact_summaries_job(event_id):
+    # The most recent impact summary job for the event, or None
+    return (
+        Job.query
+        .filter(Job.kind == IMPACT_SUMMARIES_JOB, Job.idempotency_key.like(_job_key_prefix(event_id) + "%"))
+        .order_by(Job.id.desc())
+        .first()
+    )
+
+
+def _run_number(job):
+    # Runs are numbered per event: impact-summaries:<event id>:<run>
+    return int(job.idempotency_key.rsplit(":", 1)[1])
+
+
+def queue_impact_summaries(ev, requested_by=None):
+    # Queues the job for the event and returns it, or returns the job already waiting or running
+    # (double clicks, completing the event while the emails are being queued). Commits with the caller.
+    job = latest_impact_summaries_job(ev.id)
+    if job is not None and job.status in ("QUEUED", "RUNNING"):
+        return job
+    # The key follows from the last run, so two requests that both found no job waiting queue the
+    # same key and the second gets the first one's job back instead of a duplicate
+    run = _run_number(job) + 1 if job is not None else 1
+    return enqueue(
+        IMPACT_SUMMARIES_JOB,
+        {"event_id": ev.id, "requested_by": requested_by},
+        idempotency_key=f"{_job_key_prefix(ev.id)}{run}",
+        max_attempts=3,
+    )
+
+
+def _group_key(event_id):
+    # Outbox group holding the event's impact summary emails
+    return f"impact-summaries:{event_id}"
+
+
+def impact_summaries_status(event_id):
+    # JSON-friendly progress for the analytics page: the queueing job, then the outbox deliveries
+    job = latest_impact_summaries_job(event_id)
+    if job is None:
+        return {"status": None}
+    counts = group_counts(_group_key(event_id))
+    waiting = counts.get("PENDING", 0) + counts.get("SENDING", 0)
+    status = job.status
+    if status == "DONE" and waiting:
+        status = "SENDING"
+    return {
+        "status": status,
+        "total": sum(counts.values()) if job.status == "DONE" else None,
+        "sent": counts.get("SENT", 0),
+        "failed": counts.get("FAILED", 0),
+        "queued_now": (job.progress or {}).get("queued"),
+        "error": job.last_error if job.status == "FAILED" else None,
+    }
+
+
+# AI Reference: https://chatgpt.com/share/699701ad-b814-8004-a7e4-87f0f5dcd97e
+def impact_summary_recipients(ev):
+    # One (email, fields) per unique attendee address, with the contribution of their first paid order
+    rows = db.session.execute(
+        select(Order.email, Order.total_cents)
+        .where(Order.event_id == ev.id, Order.status == "PAID")
+        .order_by(Order.id)
+    )
+    recipients = {}
+    for email, total_cents in rows:
+        email = email.lower()
+        if email not in recipients:
+            recipients[email] = {"contribution": f"€{total_cents / 100:.2f}"}
+    return list(recipients.items())
+
+
+def _allocations(ev, total_raised_cents):
+    allocations = []
+    for beneficiary in ev.beneficiaries:
+        charity_name = beneficiary.charity.name if beneficiary.charity else "Unknown"
+        percent = beneficiary.allocation_percent or 0
+        amount_cents = int(round((total_raised_cents * percent) / 100))
+        allocations.append({
+            "charity_name": charity_name,
+            "percent": percent,
+            "amount_eur": amount_cents / 100,
+        })
+    return allocations
+
+
+@job_handler(IMPACT_SUMMARIES_JOB)
+def impact_summaries_job(payload):
+    # Adds an impact summary email to the outbox for every paid attendee who has not had one yet
+    ev = db.session.get(Event, payload["event_id"])
+    if ev is None:
+        return
+    recipients = impact_summary_recipients(ev)
+    stats = stats_for_event(ev.id)
+    # One shared body; each attendee's contribution is filled in when the email is sent
+    subject, body = impact_summary_content(
+        event_title=ev.title,
+        event_date=ev.starts_at.strftime('%d %B %Y'),
+        user_contribution=bulk_field("contribution"),
+        total_raised_eur=stats.total_raised_cents / 100,
+        tickets_sold=stats.tickets_sold,
+        allocations=_allocations(ev, stats.total_raised_cents),
+    )
+    queued = queue_emails(
+        IMPACT_SUMMARY,
+        [
+            {"recipient": email, "subject": subject, "body": body, "fields": fields, "key": dedupe_key(IMPACT_SUMMARY, ev.id, email)}
+            for email, fields in recipients
+        ],
+        group_key=_group_key(ev.id),
+    )
+
+    # The emails are only queued here; the outbox delivers them afterwards
+    log_action(
+        action="IMPACT_SUMMARIES_QUEUED",
+        entity_type="Event",
+        entity_id=ev.id,
+        meta={"event_title": ev.title, "emails_queued": queued, "already_sent": len(recipients) - queued, "requested_by": payload.get("requested_by")},
+    )
+    # Saved with the emails, so the page can say how many this run added
+    report_progress({"total": len(recipients), "queued": queued})
+    db.session.commit()
+# VERSION 7 END
@@ -0,0 +1,260 @@
+# VERSION 7 START
+# This file implements a small database-backed job queue.
+# Jobs are stored in the jobs table and drained by worker threads, either inside the web
+# process or in a separate `flask jobs-worker` process, so no external broker is needed.
+# When no job is due, the same threads deliver emails waiting in the email outbox (outbox.py).
+
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Job
+from outbox import deliver_outbox_batch, requeue_stale_outbox
+
+# Registered handlers: job kind -> function(payload)
+_handlers = {}
+# The job running on this thread, for report_progress()
+_current = threading.local()
+
+
+def job_handler(kind):
+    # Decorator that registers a function as the handler for one job kind
+    def decorator(fn):
+        _handlers[kind] = fn
+        return fn
+    return decorator
+
+
+def enqueue(kind, payload=None, idempotency_key=None, run_at=None, max_attempts=None):
+    # Adds a job to the current session so it commits together with the caller's changes.
+    # If a job with the same idempotency key already exists, that job is returned instead.
+    if idempotency_key:
+        existing = Job.query.filter_by(idempotency_key=idempotency_key).first()
+        if existing:
+            return existing
+
+    job = Job(
+        kind=kind,
+        payload=payload or {},
+        idempotency_key=idempotency_key,
+        run_at=run_at or datetime.utcnow(),
+        max_attempts=max_attempts or current_app.config.get("JOB_MAX_ATTEMPTS", 5),
+    )
+    # Reference: SQLAlchemy SAVEPOINT via Session.begin_nested() (SQLAlchemy, 2025)
+    # https://docs.sqlalchemy.org/en/20/orm/session_transaction.html#using-savepoint
+    try:
+        with db.session.begin_nested():
+            db.session.add(job)
+    except IntegrityError:
+        # A concurrent request (e.g. webhook and order page) queued the same key first
+        return Job.query.filter_by(idempotency_key=idempotency_key).first()
+    return job
+
+
+def _backoff(attempts):
+    # Exponential backoff: base, 2x base, 4x base ... capped at the configured maximum
+    cfg = current_app.config
+    seconds = cfg.get("JOB_BACKOFF_SECONDS", 30) * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(seconds, cfg.get("JOB_BACKOFF_MAX_SECONDS", 3600)))
+
+
+def claim_next_job(worker_id):
+    # Claims the oldest due job for this worker, or returns None if there is nothing to do
+    now = datetime.utcnow()
+
+    # Reference: SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL, 2025)
+    # https://www.postgresql.org/docs/current/sql-select.html#SQL-FOR-UPDATE-SHARE
+    # Skip rows another worker is claiming; SQLite ignores this and relies on the guarded UPDATE below
+    job_id = db.session.execute(
+        select(Job.id)
+        .where(Job.status == "QUEUED", Job.run_at <= now)
+        .order_by(Job.run_at, Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar()
+    if job_id is None:
+        db.session.rollback()
+        return None
+
+    claimed = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "QUEUED")
+        .values(status="RUNNING", locked_at=now, locked_by=worker_id, attempts=Job.attempts + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return db.session.get(Job, job_id) if claimed else None
+
+
+def run_job(job):
+    # Runs one claimed job and records the outcome. Returns True on success.
+    job_id = job.id
+    handler = _handlers.get(job.kind)
+    try:
+        if handler is None:
+            raise RuntimeError(f"No handler registered for job kind '{job.kind}'")
+        _current.job_id = job_id
+        handler(job.payload or {})
+    except Exception as e:
+        # Discard anything the handler left half-done before updating the job row
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.last_error = f"{type(e).__name__}: {e}"[:2000]
+        job.locked_at = None
+        job.locked_by = None
+        if job.attempts >= job.max_attempts:
+            job.status = "FAILED"
+            job.finished_at = datetime.utcnow()
+            current_app.logger.error(f"Job {job_id} ({job.kind}) failed permanently: {job.last_error}")
+        else:
+            job.status = "QUEUED"
+            job.run_at = datetime.utcnow() + _backoff(job.attempts)
+            current_app.logger.warning(f"Job {job_id} ({job.kind}) attempt {job.attempts} failed, retrying at {job.run_at}: {job.last_error}")
+        db.session.commit()
+        return False
+    finally:
+        _current.job_id = None
+
+    job = db.session.get(Job, job_id)
+    job.status = "DONE"
+    job.finished_at = datetime.utcnow()
+    job.locked_at = None
+    job.locked_by = None
+    job.last_error = None
+    db.session.commit()
+    return True
+
+
+def report_progress(progress):
+    # Saves the running job's progress and commits. Also refreshes the lock so a long job that is
+    # still reporting is not mistaken for one whose worker died.
+    job_id = getattr(_current, "job_id", None)
+    if job_id is None:
+        return
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(progress=progress, locked_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def requeue_stale_jobs():
+    # Recovers jobs whose worker died mid-run (locked for too long). The lost run counts as a failed
+    # attempt: jobs with attempts left are queued again after the usual backoff, the rest are failed.
+    timeout = current_app.config.get("JOB_LOCK_TIMEOUT_SECONDS", 600)
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=timeout)
+    stale = db.session.execute(
+        select(Job.id, Job.kind, Job.attempts, Job.max_attempts)
+        .where(Job.status == "RUNNING", Job.locked_at < cutoff)
+    ).all()
+    count = 0
+    for job_id, kind, attempts, max_attempts in stale:
+        error = f"Worker stopped responding (lock older than {timeout}s)"
+        if attempts >= max_attempts:
+            values = {"status": "FAILED", "finished_at": now}
+            current_app.logger.error(f"Job {job_id} ({kind}) failed permanently: {error}")
+        else:
+            values = {"status": "QUEUED", "run_at": now + _backoff(attempts)}
+            current_app.logger.warning(f"Job {job_id} ({kind}) attempt {attempts} lost, retrying at {values['run_at']}: {error}")
+        # Guarded so a job that finished or was recovered by another process meanwhile is left alone
+        count += db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "RUNNING", Job.locked_at < cutoff)
+            .values(locked_at=None, locked_by=None, last_error=error, **values)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    db.session.commit()
+    return count
+
+
+class JobWorker:
+    # Pool of threads that claim and run jobs until stopped.
+
+    def __init__(self):
+        self._threads = []
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        # Register the CLI command only. In-process workers are started by start_background_threads()
+        # when the web process is serving (JOBS_IN_PROCESS_WORKER), never from `flask` commands.
+        app.cli.add_command(jobs_worker_command)
+
+    def start(self, app, concurrency, burst=False):
+        self._stop.clear()
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        for i in range(max(concurrency, 1)):
+            t = threading.Thread(target=self._run, args=(app, f"{prefix}:{i}", i == 0, burst), name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self):
+        # Wait for all threads; short timeouts keep Ctrl+C responsive
+        for t in self._threads:
+            while t.is_alive():
+                t.join(timeout=0.5)
+
+    def _run(self, app, worker_id, recovers_stale, burst):
+        poll = app.config.get("JOBS_POLL_INTERVAL_SECONDS", 2)
+        next_recovery = datetime.utcnow()
+        while not self._stop.is_set():
+            ran = False
+            with app.app_context():
+                try:
+                    # One thread per process periodically rescues jobs from crashed workers
+                    if recovers_stale and datetime.utcnow() >= next_recovery:
+                        requeue_stale_jobs()
+                        requeue_stale_outbox()
+                        next_recovery = datetime.utcnow() + timedelta(seconds=60)
+                    job = claim_next_job(worker_id)
+                    if job:
+                        run_job(job)
+                        ran = True
+                    elif not burst and deliver_outbox_batch(worker_id):
+                        # Jobs come first; emails are sent one batch at a time in between. Only
+                        # long-running workers send email, never a --burst run that may be cut short.
+                        ran = True
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception(f"Job worker {worker_id} crashed while polling")
+            if ran:
+                continue
+            if burst:
+                return
+            self._stop.wait(poll)
+
+
+job_worker = JobWorker()
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("jobs-worker")
+@with_appcontext
+@click.option("--concurrency", default=None, type=int, help="Number of worker threads.")
+@click.option("--burst", is_flag=True, help="Drain all due jobs and exit instead of polling forever (emails are left to the long-running workers).")
+def jobs_worker_command(concurrency, burst):
+    # Run a standalone worker process (e.g. a Render background worker)
+    app = current_app._get_current_object()
+    concurrency = concurrency or app.config.get("JOBS_WORKER_CONCURRENCY", 2)
+    worker = JobWorker()
+    worker.start(app, concurrency, burst=burst)
+    click.echo(f"Jobs worker running with {concurrency} thread(s).")
+    try:
+        worker.join()
+    except KeyboardInterrupt:
+        worker.stop()
+        worker.join()
+# VERSION 7 END
@@ -0,0 +1,101 @@
+# VERSION 7 START
+# This file runs a local SMTP sink for trying out the email outbox without a mail provider.
+# It accepts mail over plain SMTP, counts connections and messages, and never delivers anything:
+#     flask --app app mail-sink --port 1025
+#     MAIL_HOST=127.0.0.1 MAIL_PORT=1025 MAIL_USE_TLS=0 python app.py
+# Recipients containing "+bounce" are refused with a permanent 550 and "+defer" with a temporary 451,
+# to see failed and retried deliveries in the outbox.
+
+import socketserver
+import threading
+import time
+
+import click
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    # Reference: RFC 5321 Simple Mail Transfer Protocol (IETF, 2008)
+    # https://www.rfc-editor.org/rfc/rfc5321
+    # Just enough of the protocol for smtplib: EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT
+
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.server.record("connections")
+        self._reply("220 mail-sink ready")
+        accepted = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self._reply("250 mail-sink")
+            elif verb == "MAIL":
+                accepted = []
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                if "+bounce" in command:
+                    self._reply("550 No such user")
+                elif "+defer" in command:
+                    self._reply("451 Try again later")
+                else:
+                    accepted.append(command)
+                    self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline().rstrip(b"\r\n") != b".":
+                    pass
+                self.server.record("messages", len(accepted))
+                self._reply("250 OK: queued")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                # RSET, NOOP and anything else
+                self._reply("250 OK")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, SMTPSinkHandler)
+        self.counts = {"connections": 0, "messages": 0}
+        self._lock = threading.Lock()
+
+    def record(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+
+def start_mail_sink(host="127.0.0.1", port=0):
+    # Starts the sink on a daemon thread and returns it; server.server_address[1] is the bound port
+    server = SMTPSink((host, port))
+    threading.Thread(target=server.serve_forever, name="mail-sink", daemon=True).start()
+    return server
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("mail-sink")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=1025, show_default=True, type=int)
+def mail_sink_command(host, port):
+    # Run a local SMTP server that accepts and counts mail without delivering it
+    server = start_mail_sink(host, port)
+    click.echo(f"Mail sink listening on {host}:{server.server_address[1]} (Ctrl+C to stop)")
+    last = None
+    try:
+        while True:
+            time.sleep(5)
+            counts = dict(server.counts)
+            if counts != last:
+                click.echo(f"{counts['messages']} message(s) over {counts['connections']} connection(s)")
+                last = counts
+    except KeyboardInterrupt:
+        server.shutdown()
+# VERSION 7 END
@@ -0,0 +1,157 @@
+# VERSION 7 START
+# This file decides which OpenRouter models a chat call tries, and in what order.
+# OPENROUTER_MODELS lists models in order of preference. A call that fails moves on to the next model.
+# If the current model has not answered within OPENROUTER_HEDGE_AFTER_SECONDS, the next model is started
+# as well (a hedged request) and whichever answers first wins.
+# Every attempt is recorded in rolling per-model stats. Models that keep failing, or are slower than the
+# latency budget, are moved down the chain until their recent record improves.
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+# Model used when neither OPENROUTER_MODELS nor OPENROUTER_MODEL is set
+DEFAULT_MODEL = "arcee-ai/trinity-large-preview:free"
+
+# A model needs this many recent attempts before its stats affect the order
+MIN_SAMPLES = 5
+# Recent error rate at which a model is moved to the end of the chain
+UNHEALTHY_ERROR_RATE = 0.5
+
+
+def _split(value):
+    # Accepts a list or a comma-separated string
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [part.strip() for part in (value or "").split(",") if part.strip()]
+
+
+def model_chain(cfg):
+    # The configured models in order of preference, without duplicates
+    models = _split(cfg.get("OPENROUTER_MODELS")) or [cfg.get("OPENROUTER_MODEL") or DEFAULT_MODEL]
+    return list(dict.fromkeys(models))
+
+
+def model_timeout(cfg, model):
+    # Per-model read timeout from OPENROUTER_MODEL_TIMEOUTS ("model=seconds,..."), else OPENROUTER_READ_TIMEOUT
+    for entry in _split(cfg.get("OPENROUTER_MODEL_TIMEOUTS")):
+        name, _, seconds = entry.rpartition("=")
+        if name.strip() == model:
+            try:
+                return float(seconds)
+            except ValueError:
+                break
+    return cfg.get("OPENROUTER_READ_TIMEOUT", 60.0)
+
+
+class ModelStats:
+    # Rolling record of recent attempts per model: (finished at, succeeded, seconds taken)
+
+    def __init__(self, size=50):
+        self.size = size
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, ok, seconds):
+        with self._lock:
+            self._attempts.setdefault(model, deque(maxlen=self.size)).append((time.monotonic(), ok, seconds))
+
+    def summary(self, model, window_seconds=300):
+        # Attempts, error rate and median successful latency over the last window_seconds
+        cutoff = time.monotonic() - window_seconds
+        with self._lock:
+            recent = [a for a in self._attempts.get(model, ()) if a[0] >= cutoff]
+        latencies = sorted(seconds for _, ok, seconds in recent if ok)
+        failures = sum(1 for _, ok, _ in recent if not ok)
+        return {
+            "attempts": len(recent),
+            "error_rate": failures / len(recent) if recent else 0.0,
+            "p50_ms": round(latencies[(len(latencies) - 1) // 2] * 1000) if latencies else None,
+        }
+
+    def rank(self, models, cfg):
+        # Reorders the chain: healthy models first, then those slower than the latency budget, then
+        # those failing too often. Within each group the configured preference is kept, and models
+        # without enough recent attempts keep their configured place.
+        window = cfg.get("OPENROUTER_MODEL_STATS_WINDOW_SECONDS", 300)
+        hedge_after = cfg.get("OPENROUTER_HEDGE_AFTER_SECONDS", 0)
+
+        def key(item):
+            index, model = item
+            s = self.summary(model, window)
+            if s["attempts"] < MIN_SAMPLES:
+                return (0, 0, index)
+            budget = hedge_after or model_timeout(cfg, model) / 2
+            unhealthy = s["error_rate"] >= UNHEALTHY_ERROR_RATE
+            slow = s["p50_ms"] is not None and s["p50_ms"] > budget * 1000
+            return (int(unhealthy), int(slow), index)
+
+        return [model for _, model in sorted(enumerate(models), key=key)]
+
+    def report(self, models, cfg):
+        # Per-model summaries in current chain order, for the admin system health page
+        window = cfg.get("OPENROUTER_MODEL_STATS_WINDOW_SECONDS", 300)
+        return [dict(self.summary(model, window), model=model) for model in self.rank(models, cfg)]
+
+
+model_stats = ModelStats()
+
+
+def _timed(model, attempt):
+    # Runs one attempt, recording its outcome and duration
+    started = time.monotonic()
+    try:
+        result = attempt(model)
+    except Exception:
+        model_stats.record(model, False, time.monotonic() - started)
+        raise
+    model_stats.record(model, True, time.monotonic() - started)
+    return result
+
+
+def _start(model, attempt):
+    # Runs an attempt on its own thread so the caller can wait on several at once
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(_timed(model, attempt))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=f"ai-attempt-{model}", daemon=True).start()
+    return future
+
+
+def run_with_fallback(models, attempt, hedge_after=0):
+    # Calls attempt(model) down the chain until one succeeds and returns its result.
+    # With hedge_after > 0 the next model is also started whenever every running attempt has been
+    # going for hedge_after seconds; the first success wins and slower attempts are left to finish
+    # in the background (their outcome still counts towards the stats).
+    # Raises the last failure if every model fails.
+    remaining = list(models)
+    last_error = None
+
+    if not hedge_after or len(remaining) < 2:
+        for model in remaining:
+            try:
+                return _timed(model, attempt)
+            except Exception as e:
+                last_error = e
+        raise last_error
+
+    # Reference: Hedged requests, "The Tail at Scale" (Dean and Barroso, 2013)
+    # https://research.google/pubs/the-tail-at-scale/
+    running = {_start(remaining.pop(0), attempt)}
+    while running:
+        done, running = wait(running, timeout=hedge_after if remaining else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            last_error = future.exception()
+        # Start the next model when the hedge timer fires, or when every running attempt has failed
+        if remaining and (not done or not running):
+            running.add(_start(remaining.pop(0), attempt))
+    raise last_error
+# VERSION 7 END
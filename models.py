@@ -9,7 +9,6 @@ import datetime as dt
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 # VERSION 2 START
-from sqlalchemy import LargeBinary
 from datetime import datetime
 # VERSION 2 END
 
@@ -91,7 +90,12 @@ class Event(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     organiser_id = db.Column(db.Integer, db.ForeignKey('organiser.id'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
-    description = db.Column(db.Text)
+    # VERSION 7 START
+    # Reference: SQLAlchemy deferred column loading (SQLAlchemy, 2025)
+    # https://docs.sqlalchemy.org/en/20/orm/queryguide/columns.html#deferred-column-loading
+    # Long free text is only loaded when accessed (or undeferred by the query)
+    description = db.deferred(db.Column(db.Text), group="event_text")
+    # VERSION 7 END
     venue = db.Column(db.String(200))
     starts_at = db.Column(db.DateTime, nullable=False)
     published = db.Column(db.Boolean, default=False)
@@ -102,8 +106,20 @@ class Event(db.Model):
     completed_at = db.Column(db.DateTime, nullable=True)
     # VERSION 4 END
     # VERSION 5 START
-    cover_image = db.Column(db.LargeBinary, nullable=True)
+    # VERSION 7 START
+    # Cover image bytes live in the blob store; the event only keeps the content key and size
+    cover_image_key = db.Column(db.String(64), nullable=True)
+    cover_image_size = db.Column(db.Integer, nullable=True)
+    # VERSION 7 END
     cover_image_mimetype = db.Column(db.String(32), nullable=True)
+    # VERSION 7 START
+    # Size of the file as uploaded, before processing (cover_image_size is the stored size)
+    cover_image_original_size = db.Column(db.Integer, nullable=True)
+    # Resized cover variants, e.g. {"card": {"key": ..., "mimetype": "image/webp"}, ...}
+    cover_image_variants = db.Column(db.JSON(none_as_null=True), nullable=True)
+    # When the cover last changed (sent as Last-Modified)
+    cover_image_updated_at = db.Column(db.DateTime, nullable=True)
+    # VERSION 7 END
     # VERSION 5 END
 
     # Relationships to organiser and beneficiaries
@@ -112,6 +128,11 @@ class Event(db.Model):
     # https://docs.sqlalchemy.org/en/20/orm/relationship_api.html
     # https://docs.sqlalchemy.org/en/20/orm/cascades.html
     beneficiaries = db.relationship('EventBeneficiary', backref='event', cascade="all, delete-orphan")
+    # VERSION 7 START
+    # Public listings filter on published/is_completed and page in (starts_at, id) order, so this
+    # index serves both the filter and the ORDER BY without a sort step
+    __table_args__ = (db.Index("ix_event_listing", "published", "is_completed", "starts_at", "id"),)
+    # VERSION 7 END
 
 # Event Beneficiaries
 class EventBeneficiary(db.Model):
@@ -139,16 +160,23 @@ class Order(db.Model):
     # VERSION 2 START
     status = db.Column(db.String(32), default='PENDING')
     stripe_payment_intent = db.Column(db.String(100), index=True)
-    receipt_pdf = db.Column(LargeBinary, nullable=True)
+    # VERSION 7 START
+    # Receipt PDF bytes live in the blob store; the order only keeps the content key and size
+    receipt_pdf_key = db.Column(db.String(64), nullable=True)
+    receipt_pdf_size = db.Column(db.Integer, nullable=True)
+    # VERSION 7 END
     # VERSION 2 END
     # VERSION 4 START
     receipt_emailed_at = db.Column(db.DateTime, nullable=True)
     # VERSION 4 END
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     # VERSION 3 START
-    consent_checkout_at = db.Column(db.DateTime, nullable=True)
-    consent_checkout_ip = db.Column(db.String(64), nullable=True)
-    consent_checkout_ua = db.Column(db.String(255), nullable=True)
+    # VERSION 7 START
+    # Consent evidence is written at checkout and never shown in list views, so it is deferred as a group
+    consent_checkout_at = db.deferred(db.Column(db.DateTime, nullable=True), group="consent")
+    consent_checkout_ip = db.deferred(db.Column(db.String(64), nullable=True), group="consent")
+    consent_checkout_ua = db.deferred(db.Column(db.String(255), nullable=True), group="consent")
+    # VERSION 7 END
     # VERSION 3 END
 
     # Relationships to other tables
@@ -158,6 +186,11 @@ class Order(db.Model):
     # https://docs.sqlalchemy.org/en/20/orm/relationship_api.html
     tickets = db.relationship('Ticket', backref='order', cascade="all, delete-orphan", lazy='dynamic')
 
+    # VERSION 7 START
+    # Paid-order reports filter on status and a date range and page newest-first by (created_at, id)
+    __table_args__ = (db.Index("ix_order_status_created_at_id", "status", "created_at", "id"),)
+    # VERSION 7 END
+
 # Ticket
 class Ticket(db.Model):
     # Represents an individual ticket generated from an order
@@ -191,6 +224,18 @@ class AuditLog(db.Model):
     created_at = db.Column(db.DateTime, server_default=db.func.now(), nullable=False)
     # Relationship to the user who performed the action
     actor = db.relationship("User", lazy="joined")
+    # VERSION 7 START
+    # Indexes for the common lookups: date ranges, one action type, and one entity's history.
+    # On PostgreSQL the table is partitioned by month (audit_storage.py) and these become
+    # partitioned indexes that exist on every partition. On SQLite ids use AUTOINCREMENT so they are
+    # never reused after finished months are moved out of the table.
+    __table_args__ = (
+        db.Index("ix_audit_logs_created_at", "created_at"),
+        db.Index("ix_audit_logs_action_created_at", "action", "created_at"),
+        db.Index("ix_audit_logs_entity", "entity_type", "entity_id", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
+    # VERSION 7 END
 # VERSION 4 END
 
 # VERSION 5 START
@@ -211,4 +256,140 @@ class RefundRequest(db.Model):
     user = db.relationship('User')
 # VERSION 5 END
 
+# VERSION 7 START
+class Job(db.Model):
+    # Durable background job queue (receipt rendering, emails) drained by the jobs worker
+    __tablename__ = "jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    # Handler name registered with jobs.job_handler (e.g. render_receipt)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=True)
+    # Unique key so the same work is never queued twice (e.g. receipt-email:42)
+    idempotency_key = db.Column(db.String(200), unique=True, nullable=True)
+    # QUEUED, RUNNING, DONE, FAILED
+    status = db.Column(db.String(20), nullable=False, default="QUEUED")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    # Earliest time the job may run (pushed back after each failed attempt)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    locked_by = db.Column(db.String(100), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # Progress reported by long-running handlers (e.g. emails sent so far); kept across retries
+    progress = db.Column(db.JSON, nullable=True)
+
+    # Workers poll for the oldest due job in a given status
+    __table_args__ = (db.Index("ix_jobs_status_run_at", "status", "run_at"),)
+
+
+class EmailOutbox(db.Model):
+    # Outgoing emails, added in the same transaction as the change that triggers them and
+    # delivered by outbox.py with retries, so a mail provider outage never loses a message
+    __tablename__ = "email_outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    # Unique per logical email (e.g. IMPACT_SUMMARY:12:ann@example.com) so it is never queued twice
+    dedupe_key = db.Column(db.String(400), unique=True, nullable=False)
+    # RECEIPT, REFUND_DECISION, IMPACT_SUMMARY
+    template = db.Column(db.String(50), nullable=False)
+    recipient = db.Column(db.String(320), nullable=False)
+    # subject, body (with per-recipient placeholders), fields, attachment blob key/filename and
+    # template-specific ids; cleared on old sent rows, which are only kept for deduplication
+    payload = db.Column(db.JSON, nullable=True)
+    # Emails sent together (e.g. impact-summaries:12), for progress counts
+    group_key = db.Column(db.String(100), nullable=True, index=True)
+    # PENDING, SENDING, SENT, FAILED
+    status = db.Column(db.String(20), nullable=False, default="PENDING")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=6)
+    # Earliest time the next delivery attempt may run (pushed back after each failure)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    locked_by = db.Column(db.String(100), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True, index=True)
+
+    # Workers poll for the oldest due message in a given status
+    __table_args__ = (db.Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),)
+
+
+class EventStats(db.Model):
+    # Running financial totals per event, kept up to date by event_stats.py in the same
+    # transaction as the order/ticket change, so pages read one row instead of summing orders
+    __tablename__ = "event_stats"
+    event_id = db.Column(db.Integer, db.ForeignKey("event.id"), primary_key=True)
+    # Totals over PAID orders
+    paid_orders = db.Column(db.Integer, nullable=False, default=0)
+    tickets_sold = db.Column(db.Integer, nullable=False, default=0)
+    total_raised_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    donation_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    # Ticket status counts
+    tickets_redeemed = db.Column(db.Integer, nullable=False, default=0)
+    tickets_refunded = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Deleted together with its event
+    event = db.relationship("Event", backref=db.backref("stats", uselist=False, cascade="all, delete-orphan"))
+
+
+class AuditArchive(db.Model):
+    # One archived month of audit logs: the rows were exported to a gzip CSV in the blob store
+    # and removed from the database by `flask audit-archive`
+    __tablename__ = "audit_archives"
+    id = db.Column(db.Integer, primary_key=True)
+    # Partition or table the rows came from (e.g. audit_logs_y2024m01)
+    source_table = db.Column(db.String(100), nullable=False)
+    period_start = db.Column(db.DateTime, nullable=False)
+    period_end = db.Column(db.DateTime, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    blob_key = db.Column(db.String(64), nullable=False)
+    blob_size = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class AIResponseCache(db.Model):
+    # A stored LLM response, keyed by a hash of the normalised request (messages, model,
+    # temperature, max_tokens) so an identical AI button click is answered without calling the model
+    __tablename__ = "ai_response_cache"
+    key = db.Column(db.String(64), primary_key=True)
+    model = db.Column(db.String(200), nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    # Length of the response in bytes, summed for size-based eviction
+    size_bytes = db.Column(db.Integer, nullable=False)
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    # Least recently used entries are evicted first
+    last_used_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+# Reference: SQLAlchemy load_only and joinedload loader options (SQLAlchemy, 2025)
+# https://docs.sqlalchemy.org/en/20/orm/queryguide/columns.html#using-load-only-to-reduce-loaded-columns
+# https://docs.sqlalchemy.org/en/20/orm/queryguide/relationships.html#joined-eager-loading
+# Column-loading profiles for list pages: only the columns each page renders are selected.
+# Anything else is still loaded on first access, so a profile that misses a column costs a query, not a bug.
+
+# Event cards on the public events listing
+EVENT_CARD_LOAD = db.load_only(
+    Event.id, Event.title, Event.description, Event.venue, Event.starts_at,
+    Event.ticket_price_cents, Event.published, Event.is_completed,
+    Event.cover_image_key, Event.cover_image_mimetype,
+)
+
+# Homepage event list: same as the cards but without the description
+EVENT_SUMMARY_LOAD = db.load_only(
+    Event.id, Event.title, Event.venue, Event.starts_at, Event.ticket_price_cents,
+    Event.published, Event.is_completed, Event.cover_image_key, Event.cover_image_mimetype,
+)
+
+# Order rows in My Orders and the admin failed-payments table, with the event title/date in the same query
+ORDER_LIST_LOAD = (
+    db.load_only(
+        Order.id, Order.event_id, Order.user_id, Order.email, Order.qty, Order.donation_cents,
+        Order.total_cents, Order.status, Order.stripe_payment_intent, Order.receipt_pdf_key, Order.created_at,
+    ),
+    db.joinedload(Order.event).load_only(Event.id, Event.title, Event.starts_at, Event.is_completed),
+)
+# VERSION 7 END
+
 # VERSION 1
\ No newline at end of file
@@ -5,11 +5,187 @@
 # Provides an OpenAI-compatible client configured to communicate with OpenRouter
 from openai import OpenAI
 from flask import current_app
+# VERSION 7 START
+import atexit
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from openai import DefaultHttpxClient, Timeout
+
+from model_router import model_chain, model_timeout, model_stats, run_with_fallback
+# The HTTP library bundled with the OpenAI SDK (httpx, renamed httpx2 in newer SDK releases)
+try:
+    import httpx
+except ImportError:
+    import httpx2 as httpx
+# VERSION 7 END
 
 # Custom error type for OpenRouter-related failures
 class OpenRouterError(Exception):
     pass
 
+# VERSION 7 START
+class LatencyWindow:
+    # The most recent `size` durations (seconds), for percentile reporting on the admin pages
+
+    def __init__(self, size=500):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentiles(self, *points):
+        # Nearest-rank percentiles in milliseconds, e.g. percentiles(50, 95) -> {"p50": 812, "p95": 2400}
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {f"p{point}": None for point in points}
+        # The p-th percentile is the smallest sample with at least p% of samples at or below it
+        return {f"p{point}": round(samples[max(math.ceil(point / 100 * len(samples)), 1) - 1] * 1000) for point in points}
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class OpenRouterClientManager:
+    # Process-wide cache of OpenAI clients, one per (base_url, api_key).
+    # Each client owns an httpx connection pool, so reusing it keeps TLS connections to OpenRouter
+    # alive between requests instead of paying a new handshake for every chat() call.
+    # A semaphore caps how many AI calls this process makes at once.
+
+    def __init__(self):
+        self._reset_state()
+        # Reference: os.register_at_fork (Python Software Foundation, 2025)
+        # https://docs.python.org/3/library/os.html#os.register_at_fork
+        # gunicorn forks workers from the master; sockets and locks must not be shared across the fork
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_state)
+        atexit.register(self.close)
+
+    def _reset_state(self):
+        # Drops inherited clients without closing them: their sockets still belong to the parent
+        self._pid = os.getpid()
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._semaphore = None
+        self._semaphore_size = None
+        # Calls waiting for a slot / holding one, and how long each waited and ran upstream
+        self.waiting = 0
+        self.active = 0
+        self.queue_wait = LatencyWindow()
+        self.upstream_latency = LatencyWindow()
+
+    def _check_pid(self):
+        # Fallback for platforms without register_at_fork
+        if self._pid != os.getpid():
+            self._reset_state()
+
+    def get(self, base_url, api_key, cfg):
+        self._check_pid()
+        key = (base_url, api_key)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = self._clients[key] = self._build(base_url, api_key, cfg)
+        return client
+
+    def _build(self, base_url, api_key, cfg):
+        # Reference: httpx timeouts and pool limits (Encode, 2025)
+        # https://www.python-httpx.org/advanced/timeouts/
+        # https://www.python-httpx.org/advanced/resource-limits/
+        max_connections = cfg.get("OPENROUTER_MAX_CONNECTIONS", 10)
+        # DefaultHttpxClient keeps the SDK's own defaults (e.g. following redirects) for anything not set here
+        http_client = DefaultHttpxClient(
+            timeout=Timeout(
+                connect=cfg.get("OPENROUTER_CONNECT_TIMEOUT", 5.0),
+                read=cfg.get("OPENROUTER_READ_TIMEOUT", 60.0),
+                write=cfg.get("OPENROUTER_CONNECT_TIMEOUT", 5.0),
+                pool=cfg.get("OPENROUTER_CONNECT_TIMEOUT", 5.0),
+            ),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=cfg.get("OPENROUTER_KEEPALIVE_SECONDS", 60.0),
+            ),
+        )
+        # Reference: OpenAI Python SDK – custom HTTP client and retries (OpenAI, 2025)
+        # https://github.com/openai/openai-python#configuring-the-http-client
+        return OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            http_client=http_client,
+            max_retries=cfg.get("OPENROUTER_MAX_RETRIES", 2),
+        )
+
+    @contextmanager
+    def slot(self, cfg):
+        # Holds one of OPENROUTER_MAX_CONCURRENCY call slots; waits up to OPENROUTER_ACQUIRE_TIMEOUT
+        self._check_pid()
+        size = cfg.get("OPENROUTER_MAX_CONCURRENCY", 8)
+        if self._semaphore is None or self._semaphore_size != size:
+            with self._lock:
+                if self._semaphore is None or self._semaphore_size != size:
+                    self._semaphore = threading.BoundedSemaphore(size)
+                    self._semaphore_size = size
+        semaphore = self._semaphore
+        queued_at = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            acquired = semaphore.acquire(timeout=cfg.get("OPENROUTER_ACQUIRE_TIMEOUT", 10.0))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            raise OpenRouterError("The AI service is busy. Please try again in a moment.")
+        started_at = time.monotonic()
+        self.queue_wait.record(started_at - queued_at)
+        with self._lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            # The slot is held exactly as long as the upstream call (or stream) runs
+            self.upstream_latency.record(time.monotonic() - started_at)
+            with self._lock:
+                self.active -= 1
+            semaphore.release()
+
+    def stats(self):
+        # Queue depth and latency percentiles for this process
+        return {
+            "waiting": self.waiting,
+            "active": self.active,
+            "max_concurrency": self._semaphore_size,
+            "queue_wait_ms": self.queue_wait.percentiles(50, 95, 99),
+            "upstream_ms": self.upstream_latency.percentiles(50, 95, 99),
+            "samples": len(self.upstream_latency),
+        }
+
+    def close(self):
+        # Closes this process's connection pools (at exit, or from tests)
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+client_manager = OpenRouterClientManager()
+# VERSION 7 END
+
 # Reference: Flask application configuration access (Pallets Projects, 2024)
 # https://flask.palletsprojects.com/en/stable/config/
 # Creates and returns an OpenAI client configured for OpenRouter using app config
@@ -22,11 +198,10 @@ def _client() -> OpenAI:
         # Fail early if the key is missing
         raise OpenRouterError("Missing OPENROUTER_API_KEY")
 
-    # Create and return an OpenAI client pointed at OpenRouter
-    return OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=key,
-    )
+    # VERSION 7 START
+    # Return this process's shared client for OpenRouter (built on first use)
+    return client_manager.get(cfg.get("OPENROUTER_BASE_URL") or "https://openrouter.ai/api/v1", key, cfg)
+    # VERSION 7 END
 
 # Reference: Defensive object-to-dictionary conversion (OpenAI SDK, 2024)
 # https://platform.openai.com/docs/api-reference/chat/object
@@ -44,6 +219,12 @@ def _to_dict(obj):
     except Exception:
         return None
 
+# VERSION 7 START
+def resolve_model(model=None):
+    # The model a call is keyed under: passed in > first model of the configured chain
+    return model or model_chain(current_app.config)[0]
+# VERSION 7 END
+
 # Reference: Chat Completions API abstraction (OpenRouter, 2024)
 # https://openrouter.ai/docs/api/api-reference/chat/send-chat-completion-request
 # Sends structured system and user prompts to an LLM and returns generated text
@@ -51,23 +232,46 @@ def chat(messages, *, model=None, temperature=0.7, max_tokens=500) -> str:
     # Main helper used by routes to send prompts to OpenRouter
     cfg = current_app.config
 
-    # Choose model: passed in > config value > default model
-    model = model or cfg.get("OPENROUTER_MODEL") or "arcee-ai/trinity-large-preview:free"
+    # VERSION 7 START
+    # Choose models: passed in > configured chain (reordered by recent stats) > default model
+    models = [model] if model else model_stats.rank(model_chain(cfg), cfg)
 
     try:
-        # Send chat completion request to OpenRouter
-        resp = _client().chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            extra_headers={
-                # Reference: Optional OpenRouter request headers (OpenRouter, 2024)
-                # https://openrouter.ai/docs/api/reference/overview
-                "HTTP-Referer": cfg.get("OPENROUTER_SITE_URL", ""),
-                "X-Title": cfg.get("OPENROUTER_SITE_NAME", "CharityConnect"),
-            },
+        client = _client()
+        # Try the chain in order, starting the next model as well when one is slow to answer
+        return run_with_fallback(
+            models,
+            lambda m: _complete(client, cfg, m, messages, temperature, max_tokens),
+            hedge_after=cfg.get("OPENROUTER_HEDGE_AFTER_SECONDS", 0),
         )
+    except OpenRouterError:
+        raise
+    except Exception as e:
+        raise OpenRouterError(str(e))
+
+# One chat completion against one model. Hedged attempts run on their own thread, so everything
+# needed is passed in rather than read from current_app.
+def _complete(client, cfg, model, messages, temperature, max_tokens):
+    # VERSION 7 END
+    try:
+        # Send chat completion request to OpenRouter
+        # VERSION 7 START
+        with client_manager.slot(cfg):
+            resp = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                # Per-model read timeout (OPENROUTER_MODEL_TIMEOUTS)
+                timeout=Timeout(model_timeout(cfg, model), connect=cfg.get("OPENROUTER_CONNECT_TIMEOUT", 5.0)),
+                extra_headers={
+                    # Reference: Optional OpenRouter request headers (OpenRouter, 2024)
+                    # https://openrouter.ai/docs/api/reference/overview
+                    "HTTP-Referer": cfg.get("OPENROUTER_SITE_URL", ""),
+                    "X-Title": cfg.get("OPENROUTER_SITE_NAME", "CharityConnect"),
+                },
+            )
+        # VERSION 7 END
 
         # First attempt: access response using SDK attributes
         choices = getattr(resp, "choices", None)
@@ -97,3 +301,73 @@ def chat(messages, *, model=None, temperature=0.7, max_tokens=500) -> str:
         # Catch-all to avoid leaking raw exceptions into routes
         raise OpenRouterError(str(e))
 # VERSION 3 END
+
+# VERSION 7 START
+# Reference: OpenAI Python SDK – streaming responses (OpenAI, 2025)
+# https://github.com/openai/openai-python#streaming-responses
+# Streaming variant of chat(): yields the completion text piece by piece as the model produces it
+def chat_stream(messages, *, model=None, temperature=0.7, max_tokens=500):
+    cfg = current_app.config
+    models = [model] if model else model_stats.rank(model_chain(cfg), cfg)
+
+    try:
+        client = _client()
+    except OpenRouterError:
+        raise
+    except Exception as e:
+        raise OpenRouterError(str(e))
+
+    # Fall back to the next model while nothing has been sent yet; once text has gone out a
+    # failure ends the stream (hedging does not apply to streams)
+    for index, model in enumerate(models):
+        started = time.monotonic()
+        sent = False
+        try:
+            for text in _stream_once(client, cfg, model, messages, temperature, max_tokens):
+                sent = True
+                yield text
+        except OpenRouterError:
+            model_stats.record(model, False, time.monotonic() - started)
+            if sent or index == len(models) - 1:
+                raise
+            continue
+        model_stats.record(model, True, time.monotonic() - started)
+        return
+
+
+def _stream_once(client, cfg, model, messages, temperature, max_tokens):
+    try:
+        # The call slot is held until the stream finishes or the consumer stops reading
+        with client_manager.slot(cfg):
+            stream = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                timeout=Timeout(model_timeout(cfg, model), connect=cfg.get("OPENROUTER_CONNECT_TIMEOUT", 5.0)),
+                extra_headers={
+                    "HTTP-Referer": cfg.get("OPENROUTER_SITE_URL", ""),
+                    "X-Title": cfg.get("OPENROUTER_SITE_NAME", "CharityConnect"),
+                },
+            )
+            try:
+                for chunk in stream:
+                    # Keep-alive and usage chunks carry no choices
+                    choices = getattr(chunk, "choices", None)
+                    if not choices:
+                        continue
+                    delta = getattr(choices[0], "delta", None)
+                    text = getattr(delta, "content", None) if delta else None
+                    if text:
+                        yield text
+            finally:
+                # Closes the HTTP response (and frees its connection) if the consumer stopped early
+                stream.close()
+
+    except OpenRouterError:
+        raise
+    except Exception as e:
+        # Same contract as chat(): callers only need to handle OpenRouterError
+        raise OpenRouterError(str(e))
+# VERSION 7 END
@@ -0,0 +1,326 @@
+# VERSION 7 START
+# This file implements the email outbox.
+# Emails are not sent inside the request or job that creates them. queue_email() adds a row to the
+# email_outbox table in the same transaction, and the job worker threads deliver due rows in batches
+# between jobs. A failed delivery is retried with exponential backoff until EMAIL_OUTBOX_MAX_ATTEMPTS;
+# permanent rejections (unknown mailbox) fail straight away. Every row has a dedupe key such as
+# IMPACT_SUMMARY:<event id>:<email>, so the same email is never queued, and so never sent, twice.
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, insert, func
+from sqlalchemy.exc import IntegrityError
+
+from models import db, EmailOutbox
+from bulk_mail import MailTransport, OutgoingEmail, DeliveryError
+from blob_store import blobs
+
+# Templates (the kind of email each row holds)
+RECEIPT = "RECEIPT"
+REFUND_DECISION = "REFUND_DECISION"
+IMPACT_SUMMARY = "IMPACT_SUMMARY"
+
+# Registered callbacks: template -> function(row), run in the delivering transaction once a row is sent
+_sent_handlers = {}
+
+
+def on_email_sent(template):
+    # Decorator that registers a function to run when an email of this template has been sent
+    def decorator(fn):
+        _sent_handlers[template] = fn
+        return fn
+    return decorator
+
+
+def dedupe_key(template, *parts):
+    # e.g. dedupe_key(IMPACT_SUMMARY, 12, "ann@example.com") -> "IMPACT_SUMMARY:12:ann@example.com"
+    return ":".join([template] + [str(part).lower() for part in parts])
+
+
+def _row_values(template, recipient, subject, body, key, fields=None, attachment_key=None, attachment_name=None, group_key=None, meta=None):
+    payload = dict(meta or {}, subject=subject, body=body, fields=fields or {})
+    if attachment_key:
+        payload.update(attachment_key=attachment_key, attachment_name=attachment_name)
+    return dict(
+        dedupe_key=key,
+        template=template,
+        recipient=recipient,
+        payload=payload,
+        group_key=group_key,
+        status="PENDING",
+        attempts=0,
+        max_attempts=current_app.config.get("EMAIL_OUTBOX_MAX_ATTEMPTS", 6),
+        next_attempt_at=datetime.utcnow(),
+        created_at=datetime.utcnow(),
+    )
+
+
+def queue_email(template, recipient, subject, body, key, **options):
+    # Adds an email to the current session so it is only sent if the caller's transaction commits.
+    # options: fields, attachment_key, attachment_name (blob store PDF), group_key, meta (extra payload).
+    # If an email with the same dedupe key was already queued, that row is returned instead.
+    existing = EmailOutbox.query.filter_by(dedupe_key=key).first()
+    if existing:
+        return existing
+    row = EmailOutbox(**_row_values(template, recipient, subject, body, key, **options))
+    # Reference: SQLAlchemy SAVEPOINT via Session.begin_nested() (SQLAlchemy, 2025)
+    # https://docs.sqlalchemy.org/en/20/orm/session_transaction.html#using-savepoint
+    try:
+        with db.session.begin_nested():
+            db.session.add(row)
+    except IntegrityError:
+        # A concurrent request queued the same email first
+        return EmailOutbox.query.filter_by(dedupe_key=key).first()
+    return row
+
+
+def queue_emails(template, emails, group_key=None):
+    # Queues many emails with one multi-row INSERT, skipping dedupe keys that are already queued.
+    # emails: dicts with recipient, subject, body, key and optional fields. Returns how many were added.
+    added = 0
+    for start in range(0, len(emails), 500):
+        chunk = emails[start:start + 500]
+        existing = set(db.session.execute(
+            select(EmailOutbox.dedupe_key).where(EmailOutbox.dedupe_key.in_([e["key"] for e in chunk]))
+        ).scalars())
+        rows = [
+            _row_values(template, e["recipient"], e["subject"], e["body"], e["key"], fields=e.get("fields"), group_key=group_key)
+            for e in chunk if e["key"] not in existing
+        ]
+        if rows:
+            db.session.execute(insert(EmailOutbox), rows)
+            added += len(rows)
+    return added
+
+
+def _backoff(attempts):
+    # Exponential backoff: base, 2x base, 4x base ... capped at the configured maximum
+    cfg = current_app.config
+    seconds = cfg.get("EMAIL_OUTBOX_BACKOFF_SECONDS", 60) * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(seconds, cfg.get("EMAIL_OUTBOX_BACKOFF_MAX_SECONDS", 6 * 3600)))
+
+
+def claim_outbox_batch(worker_id, limit):
+    # Claims up to `limit` due emails for this worker, oldest first; returns the claimed rows
+    now = datetime.utcnow()
+
+    # Reference: SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL, 2025)
+    # https://www.postgresql.org/docs/current/sql-select.html#SQL-FOR-UPDATE-SHARE
+    ids = db.session.execute(
+        select(EmailOutbox.id)
+        .where(EmailOutbox.status == "PENDING", EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not ids:
+        db.session.rollback()
+        return []
+
+    # Guarded UPDATE: rows another worker claimed in the meantime are no longer PENDING
+    db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.id.in_(ids), EmailOutbox.status == "PENDING")
+        .values(status="SENDING", locked_at=now, locked_by=worker_id, attempts=EmailOutbox.attempts + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return (
+        EmailOutbox.query
+        .filter(EmailOutbox.id.in_(ids), EmailOutbox.status == "SENDING", EmailOutbox.locked_by == worker_id, EmailOutbox.locked_at == now)
+        .order_by(EmailOutbox.id)
+        .all()
+    )
+
+
+class OutboxMetrics:
+    # Delivery counters for this worker process, for the admin system health page
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {"sent": 0, "retried": 0, "failed": 0, "batches": 0, "send_seconds": 0.0}
+
+    def record(self, sent, retried, failed, seconds):
+        with self._lock:
+            self.counters["sent"] += sent
+            self.counters["retried"] += retried
+            self.counters["failed"] += failed
+            self.counters["batches"] += 1
+            self.counters["send_seconds"] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.counters)
+        # Throughput while actually sending (idle time between batches is not counted)
+        stats["per_second"] = round(stats["sent"] / stats["send_seconds"], 1) if stats["send_seconds"] else None
+        return stats
+
+
+outbox_metrics = OutboxMetrics()
+
+
+def _outgoing(row):
+    payload = row.payload or {}
+    attachment = None
+    if payload.get("attachment_key"):
+        attachment = (payload.get("attachment_name") or "attachment.pdf", blobs.get(payload["attachment_key"]))
+    return OutgoingEmail(row.recipient, payload.get("subject", ""), payload.get("body", ""), payload.get("fields") or {}, attachment)
+
+
+def _record_outcome(row, error, counts):
+    # Applies one delivery outcome to its row: SENT, back to PENDING with backoff, or FAILED
+    now = datetime.utcnow()
+    row.locked_at = None
+    row.locked_by = None
+    if error is None:
+        row.status = "SENT"
+        row.sent_at = now
+        row.last_error = None
+        counts["sent"] += 1
+        handler = _sent_handlers.get(row.template)
+        if handler:
+            handler(row)
+        return
+    row.last_error = str(error)[:2000]
+    if error.permanent or row.attempts >= row.max_attempts:
+        row.status = "FAILED"
+        counts["failed"] += 1
+        current_app.logger.error(f"Email {row.id} ({row.template}) to {row.recipient} failed permanently: {row.last_error}")
+    else:
+        row.status = "PENDING"
+        row.next_attempt_at = now + _backoff(row.attempts)
+        counts["retried"] += 1
+
+
+def deliver_outbox_batch(worker_id, transport=None):
+    # Claims one batch of due emails, sends it and records each outcome as soon as it is known.
+    # Every outcome is committed on its own, so a worker killed mid-batch leaves at most the email
+    # in flight to be sent again once its lock times out. Returns the number of emails attempted.
+    transport = transport or MailTransport()
+    rows = claim_outbox_batch(worker_id, transport.batch_size())
+    if not rows:
+        return 0
+
+    counts = {"sent": 0, "retried": 0, "failed": 0}
+    recorded = set()
+
+    def record(index, error):
+        _record_outcome(pending[index], error, counts)
+        recorded.add(index)
+        db.session.commit()
+
+    # Rows whose email cannot be built (e.g. a missing attachment) are retried later on their own
+    pending, outgoing = [], []
+    for row in rows:
+        try:
+            outgoing.append(_outgoing(row))
+            pending.append(row)
+        except Exception as e:
+            current_app.logger.exception(f"Email {row.id} could not be prepared")
+            _record_outcome(row, DeliveryError(f"{type(e).__name__}: {e}"), counts)
+            db.session.commit()
+
+    started = time.perf_counter()
+    try:
+        transport.send(outgoing, on_result=record)
+    except Exception as e:
+        # Unexpected error: every email without an outcome yet is retried later
+        db.session.rollback()
+        current_app.logger.exception("Email outbox batch failed")
+        for index in range(len(pending)):
+            if index not in recorded:
+                record(index, DeliveryError(f"{type(e).__name__}: {e}"))
+    outbox_metrics.record(counts["sent"], counts["retried"], counts["failed"], time.perf_counter() - started)
+    return len(rows)
+
+
+def requeue_stale_outbox():
+    # Puts emails back in the outbox if their worker died mid-batch (locked for too long)
+    timeout = current_app.config.get("EMAIL_OUTBOX_LOCK_TIMEOUT_SECONDS", 600)
+    cutoff = datetime.utcnow() - timedelta(seconds=timeout)
+    count = db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.status == "SENDING", EmailOutbox.locked_at < cutoff)
+        .values(status="PENDING", locked_at=None, locked_by=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def compact_outbox(now=None):
+    # Drops the bodies of emails sent more than EMAIL_OUTBOX_KEEP_DAYS ago. The rows themselves stay
+    # so their dedupe keys keep stopping repeat sends. Returns the number of rows compacted.
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=current_app.config.get("EMAIL_OUTBOX_KEEP_DAYS", 30))
+    count = db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.status == "SENT", EmailOutbox.sent_at < cutoff, EmailOutbox.payload.is_not(None))
+        .values(payload=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def group_counts(group_key):
+    # Emails per status for one group (e.g. one event's impact summaries)
+    rows = db.session.execute(
+        select(EmailOutbox.status, func.count(EmailOutbox.id))
+        .where(EmailOutbox.group_key == group_key)
+        .group_by(EmailOutbox.status)
+    ).all()
+    return {status: count for status, count in rows}
+
+
+def outbox_stats():
+    # Backlog and recent deliveries from the table (all workers) plus this process's counters
+    now = datetime.utcnow()
+    by_status = {status: count for status, count in db.session.execute(
+        select(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(EmailOutbox.status)
+    ).all()}
+    oldest_due = db.session.execute(
+        select(func.min(EmailOutbox.next_attempt_at)).where(EmailOutbox.status == "PENDING", EmailOutbox.next_attempt_at <= now)
+    ).scalar()
+    sent_last_hour = db.session.execute(
+        select(func.count(EmailOutbox.id)).where(EmailOutbox.sent_at >= now - timedelta(hours=1))
+    ).scalar()
+    return {
+        "pending": by_status.get("PENDING", 0),
+        "sending": by_status.get("SENDING", 0),
+        "sent": by_status.get("SENT", 0),
+        "failed": by_status.get("FAILED", 0),
+        "sent_last_hour": sent_last_hour or 0,
+        "oldest_due_seconds": int((now - oldest_due).total_seconds()) if oldest_due else 0,
+        "worker": outbox_metrics.snapshot(),
+    }
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("outbox-stats")
+@with_appcontext
+@click.option("--retry-failed", is_flag=True, help="Queue FAILED emails for another round of attempts.")
+def outbox_stats_command(retry_failed):
+    # Show the email outbox backlog (and optionally give failed emails another chance)
+    if retry_failed:
+        count = db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.status == "FAILED")
+            .values(status="PENDING", attempts=0, next_attempt_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        click.echo(f"Re-queued {count} failed email(s).")
+    stats = outbox_stats()
+    click.echo(
+        f"pending {stats['pending']}, sending {stats['sending']}, sent {stats['sent']} "
+        f"({stats['sent_last_hour']} in the last hour), failed {stats['failed']}; "
+        f"oldest due email waiting {stats['oldest_due_seconds']}s"
+    )
+# VERSION 7 END
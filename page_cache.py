@@ -0,0 +1,114 @@
+# VERSION 7 START
+# This file caches whole rendered pages for anonymous visitors.
+# Public pages (home, event listing, event detail, terms, privacy) look the same for every
+# anonymous visitor, so the first render is stored in the application cache keyed by path and
+# query string and served as-is until its TTL runs out or one of its tags is invalidated.
+# Logged-in visitors, visitors with flashed messages and debug role switches always get a fresh render.
+# Invalidations only reach every worker through a shared cache, so pages are only cached with the
+# Redis backend; with the per-process memory backend other workers would keep serving old pages.
+
+from functools import wraps
+
+from flask import request, session, current_app, make_response, Response, g
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app_cache import cache, invalidate_after_commit
+from models import Event, EventBeneficiary
+
+# Tag carried by every page that lists events (home, /events)
+EVENT_LISTING_TAG = "events"
+# Tag carried by the homepage, which shows the platform stats
+PLATFORM_STATS_TAG = "platform_stats"
+
+
+def event_tag(event_id):
+    # Tag carried by an event's detail page
+    return f"event:{event_id}"
+
+
+def page_cache_active():
+    # Enabled, and backed by a cache every worker shares
+    cfg = current_app.config
+    return cfg.get("PAGE_CACHE_ENABLED", True) and cfg.get("CACHE_BACKEND", "memory") == "redis"
+
+
+def limit_page_ttl(seconds):
+    # Called by a view whose page changes at a known time (e.g. an event starting), so the cached
+    # copy expires then instead of at the route's TTL
+    g.page_ttl_limit = min(g.get("page_ttl_limit", seconds), seconds)
+
+
+def _request_is_cacheable():
+    # Only plain anonymous GETs share a page; anything tied to a session is rendered per visitor
+    if not page_cache_active() or request.method not in ("GET", "HEAD"):
+        return False
+    # Flask-Login keeps the user id in the session; the remember-me cookie can log a visitor in too
+    if "_user_id" in session or request.cookies.get(current_app.config.get("REMEMBER_COOKIE_NAME", "remember_token")):
+        return False
+    # Pending flash messages (e.g. after a redirect) and the debug role switch change the page
+    return "_flashes" not in session and "role" not in session
+
+
+def _response_is_storable(resp):
+    # Pages that set a cookie or touched the session carry per-visitor state and must not be shared
+    return (
+        resp.status_code == 200
+        and not resp.direct_passthrough
+        and "Set-Cookie" not in resp.headers
+        and not session.modified
+    )
+
+
+def cached_page(ttl, tags=None):
+    # Decorator for public views: serves anonymous GETs from the cache for `ttl` seconds.
+    # `tags` is a list of tags, or a function of the view arguments returning one.
+    # Reference: Fastly surrogate keys for purging groups of cached pages (Fastly, 2025)
+    # https://www.fastly.com/documentation/guides/full-site-delivery/purging/working-with-surrogate-keys/
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _request_is_cacheable():
+                return view(*args, **kwargs)
+
+            key = "page:" + request.full_path
+            entry = cache.get(key)
+            if entry and cache.tags_current(entry["tags"]):
+                resp = Response(entry["body"], status=200, mimetype=entry["mimetype"])
+                resp.headers["X-Page-Cache"] = "HIT"
+                return resp
+
+            # Read tag versions before rendering, so an invalidation during the render makes the
+            # stored copy stale straight away instead of keeping pre-change content for a full TTL
+            page_tags = tags(**kwargs) if callable(tags) else (tags or [])
+            versions = cache.tag_versions(page_tags)
+            resp = make_response(view(*args, **kwargs))
+            page_ttl = int(min(ttl, g.get("page_ttl_limit", ttl)))
+            if _response_is_storable(resp) and page_ttl > 0:
+                cache.set(key, {"tags": versions, "body": resp.get_data(), "mimetype": resp.mimetype}, page_ttl)
+                resp.headers["X-Page-Cache"] = "MISS"
+            return resp
+        return wrapper
+    return decorator
+
+
+# Reference: SQLAlchemy session after_flush event (SQLAlchemy, 2025)
+# https://docs.sqlalchemy.org/en/20/orm/events.html#sqlalchemy.orm.SessionEvents.after_flush
+# Any ORM change to an event or its beneficiaries (create, edit, publish, complete, delete, new cover)
+# drops the cached listing pages and that event's detail page once the transaction commits.
+@event.listens_for(Session, "after_flush")
+def _invalidate_changed_events(session, flush_context):
+    tags = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Event) and obj.id is not None:
+            tags.update((EVENT_LISTING_TAG, event_tag(obj.id)))
+        elif isinstance(obj, EventBeneficiary) and obj.event_id is not None:
+            tags.update((EVENT_LISTING_TAG, event_tag(obj.event_id)))
+    if tags:
+        invalidate_after_commit(tags=tags, session=session)
+
+
+def invalidate_event_pages_after_commit(event_ids):
+    # For bulk UPDATEs that bypass the ORM unit of work (e.g. the stale-event sweeper)
+    invalidate_after_commit(tags=[EVENT_LISTING_TAG] + [event_tag(event_id) for event_id in event_ids])
+# VERSION 7 END
@@ -0,0 +1,252 @@
+# VERSION 7 START
+# This file checks the SQL emitted by the list pages.
+# Each page is requested through the Flask test client while every statement is captured,
+# and the check fails if a deferred or binary column shows up in a SELECT it does not need
+# or if the page runs more queries than its budget (which catches N+1 loops).
+# tests/test_list_queries.py applies the same column rules to seeded test data.
+# bench-event-listing times the public event listing query against a large synthetic table.
+
+import random
+import re
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, url_for, g
+from flask.cli import with_appcontext
+from sqlalchemy import event, LargeBinary, select, func, create_engine, insert, text, and_, or_
+
+from models import db, User, Organiser, Event, Order, ROLE_USER, ROLE_ADMIN
+
+
+def _anonymous():
+    return None, {}
+
+
+def _first_user(role):
+    # Any account with the given role; list pages are checked with whatever data it has
+    def setup():
+        return User.query.filter_by(role=role).first(), {}
+    return setup
+
+
+def _busiest_event():
+    # The event with the most paid orders and the organiser account that owns it,
+    # so per-order work on the analytics page is measured on the largest event available
+    row = db.session.execute(
+        select(Event.id, Organiser.user_id)
+        .join(Organiser, Organiser.id == Event.organiser_id)
+        .join(Order, Order.event_id == Event.id)
+        .where(Order.status == "PAID", Organiser.user_id != None)
+        .group_by(Event.id, Organiser.user_id)
+        .order_by(func.count(Order.id).desc())
+        .limit(1)
+    ).first()
+    if not row:
+        return None, None
+    return db.session.get(User, row.user_id), {"event_id": row.id}
+
+
+def _busiest_organiser():
+    # The organiser account with the most completed events
+    row = db.session.execute(
+        select(Organiser.user_id)
+        .join(Event, Event.organiser_id == Organiser.id)
+        .where(Event.is_completed == True, Organiser.user_id != None)
+        .group_by(Organiser.user_id)
+        .order_by(func.count(Event.id).desc())
+        .limit(1)
+    ).first()
+    if not row:
+        return None, None
+    return db.session.get(User, row.user_id), {}
+
+
+# Pages to check: (endpoint, setup returning (user to log in as or None, URL arguments),
+# deferred columns the page may load, maximum number of queries or None for no budget)
+LIST_ROUTES = [
+    ("main.index", _anonymous, set(), None),
+    # The public listing shows the description on each card
+    ("main.events_list", _anonymous, {"event.description"}, None),
+    ("main.my_orders", _first_user(ROLE_USER), set(), None),
+    ("main.admin_failed_payments", _first_user(ROLE_ADMIN), set(), None),
+    # Fixed number of queries however many orders the event has
+    ("main.organiser_event_analytics", _busiest_event, set(), 8),
+    # Fixed number of queries however many past events and refund requests the organiser has
+    ("main.organiser_events", _busiest_organiser, set(), 10),
+]
+
+
+def heavy_columns():
+    # Every mapped column that is deferred or binary, as "table.column"
+    cols = set()
+    for mapper in db.Model.registry.mappers:
+        for prop in mapper.column_attrs:
+            for col in prop.columns:
+                if prop.deferred or isinstance(col.type, LargeBinary):
+                    cols.add(f"{col.table.name}.{col.name}")
+    return cols
+
+
+def capture_sql(fn):
+    # Runs fn() and returns (result, list of SQL statements executed meanwhile)
+    # Reference: SQLAlchemy before_cursor_execute event (SQLAlchemy, 2025)
+    # https://docs.sqlalchemy.org/en/20/core/events.html#sqlalchemy.events.ConnectionEvents.before_cursor_execute
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", _record)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", _record)
+    return result, statements
+
+
+def selected_heavy_columns(statements, forbidden):
+    # Returns the forbidden columns that appear in any SELECT statement
+    found = set()
+    for sql in statements:
+        if not sql.lstrip().upper().startswith("SELECT"):
+            continue
+        # Identifiers may be quoted (e.g. "order".email), so compare without quotes
+        plain = sql.replace('"', "").replace("`", "")
+        for col in forbidden:
+            if re.search(rf"\b{re.escape(col)}\b", plain):
+                found.add(col)
+    return found
+
+
+def check_list_queries(echo=print):
+    # Requests each list page and reports heavy columns it selected. Returns True if all pages pass.
+    app = current_app._get_current_object()
+    heavy = heavy_columns()
+    ok = True
+    for endpoint, setup, allowed, max_queries in LIST_ROUTES:
+        client = app.test_client()
+        # Test requests share this command's app context, so drop the user Flask-Login cached on g
+        g.pop("_login_user", None)
+        user, url_args = setup()
+        if url_args is None or (setup is not _anonymous and not user):
+            echo(f"{endpoint}: skipped (no suitable account or data in this database)")
+            continue
+        if user:
+            # Log the test client in as this user (Flask-Login session keys)
+            with client.session_transaction() as sess:
+                sess["_user_id"] = str(user.id)
+                sess["_fresh"] = True
+        with app.test_request_context():
+            path = url_for(endpoint, **url_args)
+        resp, statements = capture_sql(lambda: client.get(path))
+        found = selected_heavy_columns(statements, heavy - allowed)
+        if resp.status_code != 200:
+            ok = False
+            echo(f"{endpoint}: FAILED, returned HTTP {resp.status_code}")
+        elif found:
+            ok = False
+            echo(f"{endpoint}: FAILED, selected {', '.join(sorted(found))} ({len(statements)} queries)")
+        elif max_queries is not None and len(statements) > max_queries:
+            ok = False
+            echo(f"{endpoint}: FAILED, ran {len(statements)} queries (budget {max_queries})")
+        else:
+            echo(f"{endpoint}: ok ({len(statements)} queries)")
+    return ok
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("check-list-queries")
+@with_appcontext
+def check_list_queries_command():
+    # Fail (exit code 1) if a list page selects a deferred or binary column or goes over its
+    # query budget, e.g. in CI after model or route changes
+    if not check_list_queries(echo=click.echo):
+        raise SystemExit(1)
+
+
+def _listing_select(cols, after=None, limit=None):
+    # The public listing query: published, not completed, in (starts_at, id) order
+    t = Event.__table__
+    q = select(*cols).where(t.c.published == True, t.c.is_completed == False)
+    if after:
+        q = q.where(t.c.starts_at >= after[0], or_(t.c.starts_at > after[0], and_(t.c.starts_at == after[0], t.c.id > after[1])))
+    q = q.order_by(t.c.starts_at, t.c.id)
+    return q.limit(limit) if limit else q
+
+
+def _time_query(conn, q, repeat):
+    # Best of `repeat` runs, in milliseconds, plus the number of rows returned
+    best, rows = None, 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = len(conn.execute(q).all())
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+# Reference: Python time.perf_counter (Python Software Foundation, 2025)
+# https://docs.python.org/3/library/time.html#time.perf_counter
+@click.command("bench-event-listing")
+@with_appcontext
+@click.option("--events", default=100_000, type=int, help="Number of synthetic events to generate.")
+@click.option("--per-page", default=24, type=int, help="Events per listing page.")
+@click.option("--repeat", default=5, type=int, help="Runs per query (the best time is reported).")
+def bench_event_listing_command(events, per_page, repeat):
+    # Compares the old unbounded listing query with keyset pages, before and after ix_event_listing.
+    # Runs against a throwaway in-memory SQLite database, so the configured database is untouched.
+    engine = create_engine("sqlite://")
+    t = Event.__table__
+    # Create the table without its indexes so the "before" numbers are a plain table scan
+    listing_index = next(ix for ix in t.indexes if ix.name == "ix_event_listing")
+    with engine.begin() as conn:
+        conn.execute(text("PRAGMA foreign_keys=OFF"))
+        t.create(conn)
+        for ix in list(t.indexes):
+            ix.drop(conn, checkfirst=True)
+        rng = random.Random(7)
+        base = datetime(2030, 1, 1)
+        rows = [
+            {
+                "organiser_id": 1 + i % 50,
+                "title": f"Benchmark Event {i + 1}",
+                "description": "Synthetic event " * 20,
+                "venue": "Dublin",
+                "starts_at": base + timedelta(minutes=rng.randrange(0, 2 * 365 * 24 * 60)),
+                # Roughly the mix a mature platform has: most events published, many finished
+                "published": rng.random() < 0.8,
+                "is_completed": rng.random() < 0.5,
+                "ticket_price_cents": 1500,
+                "created_at": base,
+            }
+            for i in range(events)
+        ]
+        for start in range(0, events, 10_000):
+            conn.execute(insert(t), rows[start:start + 10_000])
+
+    card_cols = [t.c.id, t.c.title, t.c.description, t.c.venue, t.c.starts_at, t.c.ticket_price_cents,
+                 t.c.published, t.c.is_completed, t.c.cover_image_key, t.c.cover_image_mimetype]
+
+    def run(conn, label):
+        full_ms, listed = _time_query(conn, _listing_select(card_cols), repeat)
+        first_ms, _ = _time_query(conn, _listing_select(card_cols, limit=per_page + 1), repeat)
+        # A cursor roughly 90% of the way through the listing, i.e. a very deep page
+        deep = conn.execute(_listing_select([t.c.starts_at, t.c.id]).offset(int(listed * 0.9)).limit(1)).first()
+        deep_ms, _ = _time_query(conn, _listing_select(card_cols, after=tuple(deep), limit=per_page + 1), repeat)
+        click.echo(f"{label}")
+        click.echo(f"  {f'all {listed} listed events (old .all())':<40} {full_ms:9.2f} ms")
+        click.echo(f"  {f'first keyset page ({per_page} events)':<40} {first_ms:9.2f} ms")
+        click.echo(f"  {'deep keyset page (90% through)':<40} {deep_ms:9.2f} ms")
+        compiled = _listing_select(card_cols, after=tuple(deep), limit=per_page + 1).compile(engine)
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), tuple(compiled.params[k] for k in compiled.positiontup)).all()
+        click.echo("  plan: " + "; ".join(row[-1] for row in plan))
+
+    click.echo(f"{events} synthetic events, {per_page} per page, best of {repeat}")
+    with engine.connect() as conn:
+        run(conn, "Without ix_event_listing")
+        listing_index.create(conn)
+        conn.execute(text("ANALYZE"))
+        run(conn, "With ix_event_listing")
+# VERSION 7 END
@@ -0,0 +1,486 @@
+# VERSION 7 START
+# This file builds PDF receipts for paid orders and defines the background jobs
+# that render and email them, so the Stripe webhook never waits on ReportLab or the mail provider.
+
+import io
+import time
+from datetime import datetime
+from functools import lru_cache
+from types import SimpleNamespace
+
+import click
+from flask import url_for
+from flask.cli import with_appcontext
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.lib.units import mm
+from reportlab.lib.enums import TA_LEFT
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.platypus import Paragraph
+
+from models import db, Order
+from audit import log_action
+from jobs import job_handler, enqueue
+from outbox import queue_email, dedupe_key, on_email_sent, RECEIPT
+from qr_codes import qr_matrix, qr_matrices_for_orders, draw_qr
+from blob_store import blobs
+
+
+def receipt_verify_url(order_id):
+    # URL encoded in the receipt QR code (organiser scan page for ticket redemption)
+    return url_for("main.organiser_scan_ticket", order_id=order_id, _external=True)
+
+
+# Bump when the static receipt layout changes so cached templates are rebuilt
+RECEIPT_TEMPLATE_VERSION = 2
+
+
+# VERSION 2 START
+# REFERENCE: layout adapted from ChatGPT code: https://chatgpt.com/share/691d0c58-b260-8004-8756-d6215df38da4
+# Reference: ReportLab Canvas API for building PDFs (ReportLab, 2025)
+# https://docs.reportlab.com/reportlab/userguide/ch2_graphics/
+class ReceiptTemplate:
+    # The parts of a receipt that are identical for every order of one event:
+    # header bar, event lines, footer and the paragraph style. The layout is drawn once, on a
+    # scratch canvas, and the PDF operators it produced are copied into every receipt of the event.
+
+    def __init__(self, ev, prerender=True):
+        self.width, self.height = A4
+        self.header_height = 30 * mm
+
+        # Basic text style for paragraphs
+        self.body_style = ParagraphStyle(
+            "body",
+            alignment=TA_LEFT,
+            fontSize=10,
+            leading=14,
+        )
+
+        # First info line (Order ID) sits under the header; event lines follow it
+        self.top_y = self.height - self.header_height - 15 * mm
+        self.event_lines = [f"Event: {ev.title}"]
+        if hasattr(ev, "starts_at") and ev.starts_at:
+            self.event_lines.append(f"Event date: {ev.starts_at.strftime('%Y-%m-%d %H:%M')}")
+        self.order_info_y = self.top_y - 5 * mm * (len(self.event_lines) + 1)
+
+        # Pre-rendered content stream and the font resources it refers to (None = draw every time)
+        self.static_ops = None
+        self.static_fonts = None
+        if prerender:
+            self._prerender()
+
+    def draw_layout(self, c):
+        # Draws the static layout with ReportLab calls
+        width, height = self.width, self.height
+
+        # Header bar
+        c.setFillColor(colors.HexColor("#1E293B"))  # dark slate/navy
+        c.rect(0, height - self.header_height, width, self.header_height, fill=1, stroke=0)
+        c.setFillColor(colors.white)
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(20 * mm, height - 18 * mm, "CharityConnect Receipt")
+
+        # Event info (the Order ID line above it is drawn per order)
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica", 10)
+        y = self.top_y
+        for line in self.event_lines:
+            y -= 5 * mm
+            c.drawString(20 * mm, y, line)
+
+        # Footer
+        c.setFont("Helvetica-Oblique", 8)
+        c.drawCentredString(
+            width / 2,
+            10 * mm,
+            "Thank you for supporting charity via CharityConnect.",
+        )
+
+    def _prerender(self):
+        # Draws the layout on a scratch canvas and keeps the content stream operators it emitted.
+        # ReportLab has no public accessor for these, so they are read from the canvas' _code list.
+        # Reference: PDF content streams (Adobe PDF Reference 1.7, 2006)
+        # https://opensource.adobe.com/dc-acrobat-sdk-docs/pdfstandards/PDF32000_2008.pdf
+        scratch = canvas.Canvas(io.BytesIO(), pagesize=A4)
+        start = len(scratch._code)
+        self.draw_layout(scratch)
+        # Wrapped in q/Q so the colours and font it sets do not leak into the per-order drawing
+        self.static_ops = "q\n" + "\n".join(scratch._code[start:]) + "\nQ"
+        # Font resource names (/F1, /F2 ...) are numbered per document in order of first use
+        self.static_fonts = dict(scratch._doc.fontMapping)
+
+    def draw_static(self, c):
+        # Copies the pre-rendered layout onto the canvas. Its fonts are registered in the same order
+        # as on the scratch canvas, so the /F names in the copied operators resolve to the same fonts;
+        # if the canvas already numbered them differently, the layout is drawn the slow way instead.
+        if self.static_ops is not None:
+            fonts = {name: c._doc.getInternalFontName(name) for name in self.static_fonts}
+            if fonts == self.static_fonts:
+                c.addLiteral(self.static_ops)
+                return
+        self.draw_layout(c)
+
+
+# Reference: functools.lru_cache (Python Software Foundation, 2025)
+# https://docs.python.org/3/library/functools.html#functools.lru_cache
+# Keyed on everything the static layout shows, so editing an event produces a fresh template
+@lru_cache(maxsize=256)
+def _cached_template(event_id, title, starts_at, version):
+    return ReceiptTemplate(SimpleNamespace(id=event_id, title=title, starts_at=starts_at))
+
+
+def get_receipt_template(ev):
+    return _cached_template(ev.id, ev.title, getattr(ev, "starts_at", None), RECEIPT_TEMPLATE_VERSION)
+
+
+def build_receipt_pdf(order, verify_url=None, template=None):
+    ev = order.event
+    # Static layout for this event (cached); pass a template to bypass the cache
+    tpl = template or get_receipt_template(ev)
+
+    # Build verification URL for this order
+    # VERSION 5 START
+    # QR now links to organiser scan page for ticket redemption
+    # Background jobs have no request context, so the URL can be passed in when enqueued
+    if verify_url is None:
+        verify_url = receipt_verify_url(order.id)
+    # VERSION 5 END
+
+    # QR module matrix (cached per URL); drawn as vector squares further down
+    qr = qr_matrix(verify_url)
+
+    # Set up PDF buffer and canvas
+    pdf_buf = io.BytesIO()
+    c = canvas.Canvas(pdf_buf, pagesize=A4)
+    width = tpl.width
+
+    # Header, event lines and footer from the event's template
+    tpl.draw_static(c)
+
+    # Per-order info
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica", 10)
+    c.drawString(20 * mm, tpl.top_y, f"Order ID: {order.id}")
+    y = tpl.order_info_y
+    if hasattr(order, "created_at") and order.created_at:
+        c.drawString(20 * mm, y, f"Order date: {order.created_at.strftime('%Y-%m-%d %H:%M')}")
+        y -= 5 * mm
+    if hasattr(order, "name"):
+        c.drawString(20 * mm, y, f"Buyer: {getattr(order, 'name', '')}")
+        y -= 5 * mm
+    if hasattr(order, "email"):
+        c.drawString(20 * mm, y, f"Email: {getattr(order, 'email', '')}")
+        y -= 10 * mm
+
+    # Line items (tickets / donations)
+    line_y = y
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(20 * mm, line_y, "Description")
+    c.drawRightString(width - 20 * mm, line_y, "Amount")
+    line_y -= 6 * mm
+    c.setFont("Helvetica", 10)
+
+    total = 0
+    # VERSION 4 START
+    # Line items (tickets + donation)
+    c.drawString(20 * mm, line_y, f"Ticket x {order.qty}")
+    ticket_amount = (order.total_cents - order.donation_cents) / 100
+    c.drawRightString(width - 20 * mm, line_y, f"€{ticket_amount:0.2f}")
+    line_y -= 5 * mm
+
+    if order.donation_cents:
+        c.drawRightString(width - 20 * mm, line_y, f"€{order.donation_cents/100:0.2f}")
+        line_y -= 5 * mm
+    # VERSION 4 END
+
+    donation_eur = (
+        order.donation_cents / 100
+        if getattr(order, "donation_cents", None) is not None
+        else 0
+    )
+
+    total_eur = (
+        order.total_cents / 100
+        if getattr(order, "total_cents", None) is not None
+        else total  # fallback to summed line items
+    )
+
+    # Totals
+    line_y -= 4 * mm
+    c.line(20 * mm, line_y, width - 20 * mm, line_y)
+    line_y -= 6 * mm
+
+    c.setFont("Helvetica", 10)
+    c.drawString(20 * mm, line_y, "Donation")
+    c.drawRightString(width - 20 * mm, line_y, f"€{donation_eur:0.2f}")
+    line_y -= 6 * mm
+
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(20 * mm, line_y, "Total")
+    c.drawRightString(width - 20 * mm, line_y, f"€{total_eur:0.2f}")
+    y = line_y - 12 * mm
+
+    # Beneficiary breakdown (if present)
+    allocations = getattr(order, "allocations", None)
+    if allocations:
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(20 * mm, y, "Beneficiary allocation")
+        y -= 6 * mm
+        c.setFont("Helvetica", 10)
+        for alloc in allocations:
+            charity_name = getattr(alloc, "charity_name", getattr(alloc, "charity", None))
+            if hasattr(charity_name, "name"):
+                charity_name = charity_name.name
+            pct = getattr(alloc, "percentage", None)
+            label_parts = []
+            if charity_name:
+                label_parts.append(str(charity_name))
+            if pct is not None:
+                label_parts.append(f"{pct}%")
+            label = " ".join(label_parts) if label_parts else "Beneficiary"
+            c.drawString(20 * mm, y, label)
+            y -= 5 * mm
+        y -= 8 * mm
+
+    # QR code block
+    qr_size = 35 * mm
+    qr_x = width - 20 * mm - qr_size
+    qr_y = 25 * mm
+    draw_qr(c, qr, qr_x, qr_y, qr_size)
+
+    # Text beside QR
+    info_text = (
+        "Scan this code or visit the link below to verify this receipt "
+        "and view your order details:\n"
+        f"{verify_url}"
+    )
+    p = Paragraph(info_text, tpl.body_style)
+    text_width = qr_x - 25 * mm  # leave some padding before QR
+    tw, th = p.wrap(text_width, 60 * mm)
+    p.drawOn(c, 20 * mm, qr_y + (qr_size - th) / 2)
+
+    # Finalise PDF
+    c.showPage()
+    c.save()
+    pdf_buf.seek(0)
+    return pdf_buf.getvalue()
+# VERSION 2 END
+
+
+# Reference: Flask-Mail – sending transactional emails with attachments (Pallets Projects, 2025)
+# https://flask-mail.readthedocs.io/en/latest/
+RECEIPT_EMAIL_BODY = (
+    "Thanks for your order #{order_id}. Your receipt is attached.\n\n"
+    "Refund policy: You may request a refund within 24 hours of placing your order. "
+    "After this window has passed, refund requests will no longer be available.\n\n"
+    "To request a refund, visit My Orders on CharityConnect.\n\n"
+    "CharityConnect"
+)
+
+
+def queue_receipt_email(order_id):
+    # Queues the email_receipt job. Only called once the PDF exists, so the email job never has to wait for it
+    enqueue("email_receipt", {"order_id": order_id}, idempotency_key=f"receipt-email:{order_id}")
+
+
+@job_handler("render_receipt")
+def render_receipt_job(payload):
+    # Generates and stores the receipt PDF for a paid order (skipped if already rendered),
+    # then queues the receipt email in the same commit
+    order = db.session.get(Order, payload["order_id"])
+    if not order or order.status != "PAID":
+        return
+    if not order.receipt_pdf_key:
+        # The PDF goes to the blob store; the order row only keeps its key and size
+        pdf = build_receipt_pdf(order, verify_url=payload.get("verify_url"))
+        order.receipt_pdf_key, order.receipt_pdf_size = blobs.put(pdf, "application/pdf")
+    if not order.receipt_emailed_at:
+        queue_receipt_email(order.id)
+    db.session.commit()
+
+
+@job_handler("email_receipt")
+def email_receipt_job(payload):
+    # Queues the receipt email; this job is queued by render_receipt_job once the PDF has been stored
+    order = db.session.get(Order, payload["order_id"])
+    if not order or order.receipt_emailed_at:
+        return
+    if not order.receipt_pdf_key:
+        raise RuntimeError(f"Receipt for order {order.id} has no rendered PDF")
+
+    # Handed to the email outbox, which retries failed deliveries; the PDF is attached from the blob store
+    queue_email(
+        RECEIPT,
+        order.email,
+        f"Your CharityConnect receipt (order #{order.id})",
+        RECEIPT_EMAIL_BODY.format(order_id=order.id),
+        dedupe_key(RECEIPT, order.id),
+        attachment_key=order.receipt_pdf_key,
+        attachment_name=f"receipt_{order.id}.pdf",
+        meta={"order_id": order.id},
+    )
+    db.session.commit()
+
+
+@on_email_sent(RECEIPT)
+def receipt_email_sent(row):
+    # Runs in the outbox's transaction once the receipt email has actually been sent
+    order = db.session.get(Order, (row.payload or {}).get("order_id"))
+    if not order:
+        return
+    # Record when the receipt email was successfully sent
+    order.receipt_emailed_at = row.sent_at
+    # Log the email action for audit and traceability
+    log_action(
+        action="RECEIPT_EMAILED",
+        entity_type="Order",
+        entity_id=order.id,
+        meta={"email": getattr(order, "email", None)},
+    )
+
+
+def _original_receipt_pdf(order, verify_url):
+    # The receipt renderer as it was before templates and vector QR codes (routes.build_receipt_pdf),
+    # kept only as the benchmark baseline: everything drawn per order, QR code embedded as a PNG
+    import qrcode
+    from reportlab.lib.utils import ImageReader
+
+    ev = order.event
+    qr_buf = io.BytesIO()
+    qrcode.make(verify_url).save(qr_buf, format="PNG")
+    qr_buf.seek(0)
+    qr_reader = ImageReader(qr_buf)
+
+    pdf_buf = io.BytesIO()
+    c = canvas.Canvas(pdf_buf, pagesize=A4)
+    width, height = A4
+    body_style = ParagraphStyle("body", alignment=TA_LEFT, fontSize=10, leading=14)
+
+    header_height = 30 * mm
+    c.setFillColor(colors.HexColor("#1E293B"))
+    c.rect(0, height - header_height, width, header_height, fill=1, stroke=0)
+    c.setFillColor(colors.white)
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(20 * mm, height - 18 * mm, "CharityConnect Receipt")
+
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica", 10)
+    y = height - header_height - 15 * mm
+    c.drawString(20 * mm, y, f"Order ID: {order.id}")
+    y -= 5 * mm
+    c.drawString(20 * mm, y, f"Event: {ev.title}")
+    y -= 5 * mm
+    if ev.starts_at:
+        c.drawString(20 * mm, y, f"Event date: {ev.starts_at.strftime('%Y-%m-%d %H:%M')}")
+        y -= 5 * mm
+    c.drawString(20 * mm, y, f"Order date: {order.created_at.strftime('%Y-%m-%d %H:%M')}")
+    y -= 5 * mm
+    c.drawString(20 * mm, y, f"Email: {order.email}")
+    y -= 10 * mm
+
+    line_y = y
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(20 * mm, line_y, "Description")
+    c.drawRightString(width - 20 * mm, line_y, "Amount")
+    line_y -= 6 * mm
+    c.setFont("Helvetica", 10)
+    c.drawString(20 * mm, line_y, f"Ticket x {order.qty}")
+    c.drawRightString(width - 20 * mm, line_y, f"€{(order.total_cents - order.donation_cents) / 100:0.2f}")
+    line_y -= 5 * mm
+    if order.donation_cents:
+        c.drawRightString(width - 20 * mm, line_y, f"€{order.donation_cents / 100:0.2f}")
+        line_y -= 5 * mm
+
+    line_y -= 4 * mm
+    c.line(20 * mm, line_y, width - 20 * mm, line_y)
+    line_y -= 6 * mm
+    c.setFont("Helvetica", 10)
+    c.drawString(20 * mm, line_y, "Donation")
+    c.drawRightString(width - 20 * mm, line_y, f"€{order.donation_cents / 100:0.2f}")
+    line_y -= 6 * mm
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(20 * mm, line_y, "Total")
+    c.drawRightString(width - 20 * mm, line_y, f"€{order.total_cents / 100:0.2f}")
+
+    qr_size = 35 * mm
+    qr_x = width - 20 * mm - qr_size
+    qr_y = 25 * mm
+    c.drawImage(qr_reader, qr_x, qr_y, qr_size, qr_size, preserveAspectRatio=True, mask="auto")
+
+    p = Paragraph(
+        "Scan this code or visit the link below to verify this receipt "
+        f"and view your order details:\n{verify_url}",
+        body_style,
+    )
+    tw, th = p.wrap(qr_x - 25 * mm, 60 * mm)
+    p.drawOn(c, 20 * mm, qr_y + (qr_size - th) / 2)
+
+    c.setFont("Helvetica-Oblique", 8)
+    c.drawCentredString(width / 2, 10 * mm, "Thank you for supporting charity via CharityConnect.")
+    c.showPage()
+    c.save()
+    return pdf_buf.getvalue()
+
+
+# Reference: time.perf_counter for benchmarking (Python Software Foundation, 2025)
+# https://docs.python.org/3/library/time.html#time.perf_counter
+@click.command("bench-receipts")
+@with_appcontext
+@click.option("--orders", default=2000, type=int, help="Number of synthetic orders to render.")
+@click.option("--events", default=5, type=int, help="Number of synthetic events the orders are spread across.")
+def bench_receipts_command(orders, events):
+    # Compares receipts/second of the original renderer, build_receipt_pdf drawing the static layout for
+    # every order, and build_receipt_pdf with the cached per-event template. The last two draw the same
+    # vector QR codes from a warm cache, so their difference is the template alone. Uses in-memory
+    # synthetic orders, so nothing is written to the database.
+    evs = [SimpleNamespace(id=-(i + 1), title=f"Benchmark Event {i + 1}", starts_at=datetime(2030, 1, 1, 19, 0)) for i in range(events)]
+    batch = [
+        SimpleNamespace(
+            id=i + 1,
+            event=evs[i % events],
+            created_at=datetime.utcnow(),
+            email=f"donor{i + 1}@example.com",
+            qty=1 + i % 4,
+            donation_cents=(i % 3) * 500,
+            total_cents=(1 + i % 4) * 1500 + (i % 3) * 500,
+        )
+        for i in range(orders)
+    ]
+
+    def verify_url(order_id):
+        return f"https://charityconnect.ie/organiser/scan/{order_id}"
+
+    if orders > qr_matrix.cache_info().maxsize:
+        click.echo("Warning: more orders than QR_CACHE_SIZE, so QR codes are re-encoded during the runs")
+    # Encode and draw every QR code once before timing, so both template runs get them from the cache
+    scratch = canvas.Canvas(io.BytesIO(), pagesize=A4)
+    for matrix in qr_matrices_for_orders([o.id for o in batch], verify_url).values():
+        draw_qr(scratch, matrix, 0, 0, 35 * mm)
+
+    def run(label, render):
+        _cached_template.cache_clear()
+        start = time.perf_counter()
+        render()
+        elapsed = time.perf_counter() - start
+        click.echo(f"{label:<36} {orders} receipts in {elapsed:7.2f}s  ({orders / elapsed:8.1f} receipts/s)")
+        return elapsed
+
+    def original():
+        for o in batch:
+            _original_receipt_pdf(o, verify_url(o.id))
+
+    def layout_per_order():
+        for o in batch:
+            build_receipt_pdf(o, verify_url=verify_url(o.id), template=ReceiptTemplate(o.event, prerender=False))
+
+    def cached_template():
+        for o in batch:
+            build_receipt_pdf(o, verify_url=verify_url(o.id))
+
+    before = run("Original renderer (PNG QR)", original)
+    per_order = run("Layout drawn per order (vector QR)", layout_per_order)
+    after = run("Cached template (vector QR)", cached_template)
+    click.echo(f"Cached template vs layout per order: {per_order / after:.2f}x")
+    click.echo(f"Cached template vs original renderer: {before / after:.2f}x")
+# VERSION 7 END
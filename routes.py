@@ -8,15 +8,7 @@
 
 # VERSION 2 START
 from flask import (Blueprint, render_template, redirect, url_for, request, flash, abort, session, Response, send_file, current_app)
-import stripe, qrcode, io, os
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import mm
-from reportlab.lib.utils import ImageReader
-from reportlab.lib.enums import TA_LEFT
-from reportlab.lib.styles import ParagraphStyle
-from reportlab.platypus import Paragraph
+import stripe, os
 from sqlalchemy.exc import OperationalError
 # VERSION 6 START
 from sqlalchemy import text
@@ -29,22 +21,46 @@ from flask_login import login_user, logout_user, login_required, current_user
 # VERSION 6 START
 from datetime import datetime, timedelta
 # VERSION 6 END
-from openrouter_client import chat, OpenRouterError
+from openrouter_client import OpenRouterError
 # VERSION 3 END
 # VERSION 4 START
-# VERSION 5 START
-from email_utils import send_receipt_email, send_refund_decision_email, send_impact_summary_email
-# VERSION 5 END
-from extensions import csrf, mail
+from extensions import csrf
 from sqlalchemy import cast, Float
 from audit import log_action
+# VERSION 7 START
+from audit import audit_export_query, iter_audit_csv, gzip_chunks
+from audit_storage import entity_history, archived_periods, audit_source
+from flask import stream_with_context
+# VERSION 7 END
 import csv
 from io import StringIO
 # VERSION 4 END
+# VERSION 7 START
+from receipts import receipt_verify_url, queue_receipt_email
+from jobs import enqueue
+from blob_store import blobs, BlobNotFound
+from cover_images import store_cover_image, clear_cover_image, cover_response, process_cover_upload, CoverImageError
+# VERSION 7 END
 # VERSION 2 END
 
 # VERSION 5 START
-from models import (db, User, Organiser, Charity, Event, EventBeneficiary, Order, Ticket, AuditLog, RefundRequest, ROLE_USER, ROLE_ORG, ROLE_ADMIN)
+from models import (db, User, Organiser, Charity, Event, EventBeneficiary, Order, Ticket, RefundRequest, ROLE_USER, ROLE_ORG, ROLE_ADMIN)
+# VERSION 7 START
+from models import EVENT_CARD_LOAD, EVENT_SUMMARY_LOAD, ORDER_LIST_LOAD
+from sqlalchemy.orm import undefer_group, joinedload, selectinload, contains_eager
+from sqlalchemy import or_, and_, update
+from app_cache import cache, invalidate_after_commit, PLATFORM_STATS_KEY
+from page_cache import cached_page, limit_page_ttl, event_tag, EVENT_LISTING_TAG, PLATFORM_STATS_TAG
+from event_stats import record_order_paid, record_tickets_redeemed, record_tickets_refunded, stats_for_event, stats_for_events, platform_totals
+from ai_cache import cached_chat, cached_chat_stream, ai_cache_stats
+from sqlalchemy.exc import SQLAlchemyError
+from ai_gateway import gateway, AIRateLimited
+from model_router import model_chain, model_stats
+from impact_summaries import queue_impact_summaries, impact_summaries_status
+from email_utils import refund_decision_content
+from outbox import queue_email, dedupe_key, outbox_stats, REFUND_DECISION
+import json
+# VERSION 7 END
 # VERSION 5 END
 
 # Reference: Flask Blueprints Documentation (Pallets Projects, 2024)
@@ -52,180 +68,7 @@ from models import (db, User, Organiser, Charity, Event, EventBeneficiary, Order
 # Create a Flask Blueprint for routing
 bp = Blueprint("main", __name__)
 
-# REFERENCE: layout adapted from ChatGPT code: https://chatgpt.com/share/691d0c58-b260-8004-8756-d6215df38da4
-# Reference: ReportLab Canvas API for building PDFs (ReportLab, 2025)
-# https://docs.reportlab.com/reportlab/userguide/ch2_graphics/
-# Reference: Python qrcode library – generating QR codes in memory (Lincoln Loop, 2025)
-# https://pypi.org/project/qrcode/
 # VERSION 2 START
-def build_receipt_pdf(order):
-    ev = order.event
-
-    # Build verification URL for this order
-    # VERSION 5 START
-    # QR now links to organiser scan page for ticket redemption
-    verify_url = url_for("main.organiser_scan_ticket", order_id=order.id, _external=True)
-    # VERSION 5 END
-
-    # Create QR code image in memory
-    qr_img = qrcode.make(verify_url)
-    qr_buf = io.BytesIO()
-    qr_img.save(qr_buf, format="PNG")
-    qr_buf.seek(0)
-    qr_reader = ImageReader(qr_buf)  # ReportLab reads images in this format
-    
-    # Set up PDF buffer and canvas
-    pdf_buf = io.BytesIO()
-    c = canvas.Canvas(pdf_buf, pagesize=A4)
-    width, height = A4
-
-    # Basic text style for paragraphs
-    body_style = ParagraphStyle(
-        "body",
-        alignment=TA_LEFT,
-        fontSize=10,
-        leading=14,
-    )
-
-    # Header bar
-    header_height = 30 * mm
-    c.setFillColor(colors.HexColor("#1E293B"))  # dark slate/navy
-    c.rect(0, height - header_height, width, header_height, fill=1, stroke=0)
-    c.setFillColor(colors.white)
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(20 * mm, height - 18 * mm, "CharityConnect Receipt")
-
-    # Order / event info
-    c.setFillColor(colors.black)
-    c.setFont("Helvetica", 10)
-    y = height - header_height - 15 * mm
-
-    c.drawString(20 * mm, y, f"Order ID: {order.id}")
-    y -= 5 * mm
-    c.drawString(20 * mm, y, f"Event: {ev.title}")
-    y -= 5 * mm
-    if hasattr(ev, "starts_at") and ev.starts_at:
-        c.drawString(20 * mm, y, f"Event date: {ev.starts_at.strftime('%Y-%m-%d %H:%M')}")
-        y -= 5 * mm
-    if hasattr(order, "created_at") and order.created_at:
-        c.drawString(20 * mm, y, f"Order date: {order.created_at.strftime('%Y-%m-%d %H:%M')}")
-        y -= 5 * mm
-    if hasattr(order, "name"):
-        c.drawString(20 * mm, y, f"Buyer: {getattr(order, 'name', '')}")
-        y -= 5 * mm
-    if hasattr(order, "email"):
-        c.drawString(20 * mm, y, f"Email: {getattr(order, 'email', '')}")
-        y -= 10 * mm
-
-    # Line items (tickets / donations)
-    line_y = y
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(20 * mm, line_y, "Description")
-    c.drawRightString(width - 20 * mm, line_y, "Amount")
-    line_y -= 6 * mm
-    c.setFont("Helvetica", 10)
-
-    total = 0
-    # VERSION 4 START
-    # Line items (tickets + donation)
-    c.drawString(20 * mm, line_y, f"Ticket x {order.qty}")
-    ticket_amount = (order.total_cents - order.donation_cents) / 100
-    c.drawRightString(width - 20 * mm, line_y, f"€{ticket_amount:0.2f}")
-    line_y -= 5 * mm
-
-    if order.donation_cents:
-        c.drawRightString(width - 20 * mm, line_y, f"€{order.donation_cents/100:0.2f}")
-        line_y -= 5 * mm
-    # VERSION 4 END
-
-    donation_eur = (
-        order.donation_cents / 100
-        if getattr(order, "donation_cents", None) is not None
-        else 0
-    )
-
-    total_eur = (
-        order.total_cents / 100
-        if getattr(order, "total_cents", None) is not None
-        else total  # fallback to summed line items
-    )
-
-    # Totals
-    line_y -= 4 * mm
-    c.line(20 * mm, line_y, width - 20 * mm, line_y)
-    line_y -= 6 * mm
-
-    c.setFont("Helvetica", 10)
-    c.drawString(20 * mm, line_y, "Donation")
-    c.drawRightString(width - 20 * mm, line_y, f"€{donation_eur:0.2f}")
-    line_y -= 6 * mm
-
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(20 * mm, line_y, "Total")
-    c.drawRightString(width - 20 * mm, line_y, f"€{total_eur:0.2f}")
-    y = line_y - 12 * mm
-
-    # Beneficiary breakdown (if present)
-    allocations = getattr(order, "allocations", None)
-    if allocations:
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(20 * mm, y, "Beneficiary allocation")
-        y -= 6 * mm
-        c.setFont("Helvetica", 10)
-        for alloc in allocations:
-            charity_name = getattr(alloc, "charity_name", getattr(alloc, "charity", None))
-            if hasattr(charity_name, "name"):
-                charity_name = charity_name.name
-            pct = getattr(alloc, "percentage", None)
-            label_parts = []
-            if charity_name:
-                label_parts.append(str(charity_name))
-            if pct is not None:
-                label_parts.append(f"{pct}%")
-            label = " ".join(label_parts) if label_parts else "Beneficiary"
-            c.drawString(20 * mm, y, label)
-            y -= 5 * mm
-        y -= 8 * mm
-
-    # QR code block
-    qr_size = 35 * mm
-    qr_x = width - 20 * mm - qr_size
-    qr_y = 25 * mm
-    c.drawImage(
-        qr_reader,
-        qr_x,
-        qr_y,
-        qr_size,
-        qr_size,
-        preserveAspectRatio=True,
-        mask="auto",
-    )
-
-    # Text beside QR
-    info_text = (
-        "Scan this code or visit the link below to verify this receipt "
-        "and view your order details:\n"
-        f"{verify_url}"
-    )
-    p = Paragraph(info_text, body_style)
-    text_width = qr_x - 25 * mm  # leave some padding before QR
-    tw, th = p.wrap(text_width, 60 * mm)
-    p.drawOn(c, 20 * mm, qr_y + (qr_size - th) / 2)
-
-    # Footer
-    c.setFont("Helvetica-Oblique", 8)
-    c.drawCentredString(
-        width / 2,
-        10 * mm,
-        "Thank you for supporting charity via CharityConnect.",
-    )
-
-    # Finalise PDF
-    c.showPage()
-    c.save()
-    pdf_buf.seek(0)
-    return pdf_buf.getvalue()
-
 def finalise_order(order):
     # Saftey check
     if not order:
@@ -233,9 +76,22 @@ def finalise_order(order):
     # VERSION 4 START
     # Reference: SQLAlchemy ORM – updating mapped object attributes and persisting via session commit (SQLAlchemy, 2025)
     # https://docs.sqlalchemy.org/en/20/orm/session_basics.html
-    just_marked_paid = (order.status != "PAID")
-    if just_marked_paid:
+    # VERSION 7 START
+    # Guarded UPDATE so that when the webhook and the success page finalise the same order
+    # at once, only one of them marks it paid and adds it to the event totals
+    just_marked_paid = False
+    if order.status != "PAID":
+        just_marked_paid = bool(db.session.execute(
+            update(Order)
+            .where(Order.id == order.id, Order.status != "PAID")
+            .values(status="PAID")
+            .execution_options(synchronize_session=False)
+        ).rowcount)
         order.status = "PAID"
+    if just_marked_paid:
+        record_order_paid(order)
+        invalidate_after_commit(PLATFORM_STATS_KEY, tags=(PLATFORM_STATS_TAG,))
+    # VERSION 7 END
     # VERSION 4 END
     # Creates ticket records if they do not exist yet
     if not getattr(order, "tickets", None) or order.tickets.count() == 0:
@@ -243,14 +99,19 @@ def finalise_order(order):
             db.session.add(
                 Ticket(order_id=order.id, code=f"T{order.id:06d}-{i+1:02d}")
             )
-    # Generates and stores the receipt PDF if missing
-    if hasattr(order, "receipt_pdf") and not order.receipt_pdf:
-        try:
-            pdf_bytes = build_receipt_pdf(order)
-            order.receipt_pdf = pdf_bytes
-        except Exception as e:
-            current_app.logger.error(f"Receipt generation failed in finalise_order for order {order.id}: {e}"
-            )
+    # VERSION 7 START
+    # Receipt rendering and emailing run in the background job queue so the Stripe webhook
+    # is acknowledged straight away. Idempotency keys stop repeat webhooks/page loads re-queuing them.
+    if not order.receipt_pdf_key:
+        # The render job queues the email itself once the PDF is stored
+        enqueue(
+            "render_receipt",
+            {"order_id": order.id, "verify_url": receipt_verify_url(order.id)},
+            idempotency_key=f"receipt-render:{order.id}",
+        )
+    elif not order.receipt_emailed_at:
+        queue_receipt_email(order.id)
+    # VERSION 7 END
     # VERSION 4 START
     # Audit: order paid (only when it changes)
     if just_marked_paid:
@@ -264,45 +125,6 @@ def finalise_order(order):
     # Saves everything to the database
     db.session.commit()
 
-    # VERSION 4 START
-    # Reference: Flask-Mail – sending transactional emails with attachments (Pallets Projects, 2025)
-    # https://flask-mail.readthedocs.io/en/latest/
-    # Only email the receipt if it exists and has not already been sent
-    if order.receipt_pdf and not order.receipt_emailed_at:
-        try:
-            # Send the receipt email with the PDF attached
-            send_receipt_email(
-                mail=mail,
-                to_email=order.email,
-                subject=f"Your CharityConnect receipt (order #{order.id})",
-                # VERSION 6 START
-                body=(
-                    f"Thanks for your order #{order.id}. Your receipt is attached.\n\n"
-                    f"Refund policy: You may request a refund within 24 hours of placing your order. "
-                    f"After this window has passed, refund requests will no longer be available.\n\n"
-                    f"To request a refund, visit My Orders on CharityConnect.\n\n"
-                    f"CharityConnect"
-                ),
-                # VERSION 6 END
-                pdf_bytes=order.receipt_pdf,
-                filename=f"receipt_{order.id}.pdf",
-            )
-            # Record when the receipt email was successfully sent
-            order.receipt_emailed_at = datetime.utcnow()
-            # Log the email action for audit and traceability
-            log_action(
-                action="RECEIPT_EMAILED",
-                entity_type="Order",
-                entity_id=order.id,
-                meta={"email": getattr(order, "email", None)},
-            )
-            db.session.commit()
-        except Exception:
-            # Log any failure without breaking the order flow
-            current_app.logger.exception(f"Failed to email receipt for order {order.id}"
-            )
-    # VERSION 4 END
-
     return order
 # VERSION 2 END
 
@@ -430,35 +252,6 @@ def inject_current_role():
     return {"current_role": get_role(), "STRIPE_PUBLISHABLE_KEY": Config.STRIPE_PUBLISHABLE_KEY}
 # VERSION 2 END
 
-# VERSION 6 START
-# Auto-complete events that started more than 7 days ago and haven't been marked complete
-@bp.before_app_request
-def auto_complete_stale_events():
-    try:
-        cutoff = datetime.utcnow() - timedelta(days=7)
-        stale_events = Event.query.filter(
-            Event.is_completed == False,
-            Event.starts_at != None,
-            Event.starts_at < cutoff
-        ).all()
-        for ev in stale_events:
-            ev.is_completed = True
-            ev.completed_at = datetime.utcnow()
-            try:
-                log_action(
-                    action="EVENT_AUTO_COMPLETED",
-                    entity_type="Event",
-                    entity_id=ev.id,
-                    meta={"title": ev.title, "reason": "7 days past start time"},
-                )
-            except Exception:
-                pass
-        if stale_events:
-            db.session.commit()
-    except Exception:
-        pass
-# VERSION 6 END
-
 # Utility Function
 def cents(eur_decimal):
     return int(round(float(eur_decimal or 0) * 100))
@@ -516,28 +309,71 @@ def apply_verification():
 
 # Public Routes
 @bp.route("/")
+# VERSION 7 START
+@cached_page(ttl=60, tags=[EVENT_LISTING_TAG, PLATFORM_STATS_TAG])
+# VERSION 7 END
 def index():
     # Display all published charity events on the homepage
     # Reference: SQLAlchemy Query Guide – filtering and ordering (SQLAlchemy, 2024)
     # https://docs.sqlalchemy.org/en/20/orm/queryguide/index.html
-    events = Event.query.filter_by(published=True).order_by(Event.starts_at.asc()).all()
+    # VERSION 7 START
+    # Only a handful of upcoming events are featured; the full list is paginated on /events
+    events = (
+        _public_events_query()
+        .options(EVENT_SUMMARY_LOAD)
+        .filter(Event.starts_at >= datetime.utcnow())
+        .limit(current_app.config.get("HOMEPAGE_FEATURED_EVENTS", 6))
+        .all()
+    )
+    # VERSION 7 END
     # VERSION 5 START
     # Real platform stats for homepage
-    charities_count = Charity.query.filter_by(verified=True).count()
-    tickets_count = db.session.query(func.coalesce(func.sum(Order.qty), 0)).filter_by(status='PAID').scalar() or 0
-    funds_raised = db.session.query(func.coalesce(func.sum(Order.total_cents), 0)).filter_by(status='PAID').scalar() or 0
+    # VERSION 7 START
+    # Served from the application cache; dropped when an order is paid or a charity's status changes
+    stats = cache.get_or_set(PLATFORM_STATS_KEY, _homepage_platform_stats, current_app.config.get("HOMEPAGE_STATS_TTL_SECONDS", 300))
+    charities_count = stats["charities_count"]
+    tickets_count = stats["tickets_count"]
+    funds_raised = stats["funds_raised_cents"]
+    # VERSION 7 END
     funds_raised_eur = funds_raised / 100
     return render_template("index.html", events=events, charities_count=charities_count, tickets_count=tickets_count, funds_raised_eur=funds_raised_eur)
     # VERSION 5 END
 
+# VERSION 7 START
+def _public_events_query():
+    # Published, not yet completed events in (starts_at, id) order, matching ix_event_listing
+    return (
+        Event.query
+        .filter(Event.published == True, Event.is_completed == False)
+        .order_by(Event.starts_at.asc(), Event.id.asc())
+    )
+
+
+def _homepage_platform_stats():
+    # Computes the homepage counters; plain values only, so the result can be cached in Redis
+    totals = platform_totals()
+    return {
+        "charities_count": Charity.query.filter_by(verified=True).count(),
+        # Platform totals come from the per-event rollup rather than summing every order
+        "tickets_count": totals.tickets_sold,
+        "funds_raised_cents": totals.total_raised_cents,
+    }
+# VERSION 7 END
+
 # VERSION 6 START
 # Terms of Service page
 @bp.route("/terms")
+# VERSION 7 START
+@cached_page(ttl=3600)
+# VERSION 7 END
 def terms():
     return render_template("terms.html")
 
 # Privacy Policy page
 @bp.route("/privacy")
+# VERSION 7 START
+@cached_page(ttl=3600)
+# VERSION 7 END
 def privacy_policy():
     return render_template("privacy.html")
 # VERSION 6 END
@@ -545,24 +381,62 @@ def privacy_policy():
 # VERSION 2 START
 # Show a list of all published events
 @bp.route("/events")
+# VERSION 7 START
+@cached_page(ttl=120, tags=[EVENT_LISTING_TAG])
+# VERSION 7 END
 def events_list():
     # VERSION 5 START
     # Get all events that are marked as published, sorted by start date
     # Exclude completed events so only active events appear on the public listing
-    events = Event.query.filter_by(published=True, is_completed=False).order_by(Event.starts_at.asc()).all()
+    # VERSION 7 START
+    # Only the columns the event cards render are selected.
+    # Reference: keyset pagination (Use The Index, Luke, 2025)
+    # https://use-the-index-luke.com/no-offset
+    # ?after=<starts_at>~<id> continues after the last card of the previous page, so every page
+    # is an index range scan on ix_event_listing however deep the visitor pages
+    per_page = current_app.config.get("EVENTS_PER_PAGE", 24)
+    page_q = _public_events_query().options(EVENT_CARD_LOAD)
+    cursor = _parse_keyset_cursor(request.args.get("after"))
+    if cursor:
+        after_ts, after_id = cursor
+        # The redundant starts_at >= bound lets the database seek into the index; the OR alone
+        # is only applied as a filter while scanning from the start of the listing
+        page_q = page_q.filter(Event.starts_at >= after_ts, or_(
+            Event.starts_at > after_ts,
+            and_(Event.starts_at == after_ts, Event.id > after_id),
+        ))
+    events = page_q.limit(per_page + 1).all()
+    has_more = len(events) > per_page
+    events = events[:per_page]
+    next_cursor = f"{events[-1].starts_at.isoformat()}~{events[-1].id}" if has_more else None
+    # VERSION 7 END
     # VERSION 5 END
     # Display them on the events page
-    return render_template("events.html", events=events)
+    # VERSION 7 START
+    return render_template("events.html", events=events, next_cursor=next_cursor, is_first_page=cursor is None)
+    # VERSION 7 END
 # VERSION 2 END
 
 @bp.route("/events/<int:event_id>")
+# VERSION 7 START
+@cached_page(ttl=300, tags=lambda event_id: [event_tag(event_id)])
+# VERSION 7 END
 def event_detail(event_id):
     # Show event details to users (only if event is published)
-    ev = Event.query.get_or_404(event_id)
+    # VERSION 7 START
+    # The detail page shows the full description, so load it with the event instead of lazily
+    ev = Event.query.options(undefer_group("event_text")).get_or_404(event_id)
+    # VERSION 7 END
     if not ev.published and get_role() not in (ROLE_ORG, ROLE_ADMIN):
         abort(404)
+    # VERSION 7 START
+    # The page switches to "already started" at starts_at, so a cached copy must not outlive it
+    now = datetime.utcnow()
+    if ev.starts_at and ev.starts_at > now:
+        limit_page_ttl((ev.starts_at - now).total_seconds())
+    # VERSION 7 END
     # VERSION 6 START
-    return render_template("event_detail.html", ev=ev, now=datetime.utcnow())
+    return render_template("event_detail.html", ev=ev, now=now)
     # VERSION 6 END
 
 @bp.route("/events/<int:event_id>/buy", methods=["GET","POST"])
@@ -818,6 +692,22 @@ def order_verify(order_id):
     return render_template("order_verify.html", order=order, ok=ok)
 # VERSION 4 END
 
+# VERSION 7 START
+def _use_tickets(ticket_ids, **values):
+    # Guarded UPDATE: only tickets that are still neither redeemed nor refunded are changed, so a
+    # double click or two organisers scanning the same order cannot redeem or refund a ticket twice.
+    # Returns the ids this call changed; their count is what the event totals are bumped by.
+    if not ticket_ids:
+        return []
+    return db.session.execute(
+        update(Ticket)
+        .where(Ticket.id.in_(ticket_ids), Ticket.redeemed == False, Ticket.refunded == False)
+        .values(**values)
+        .returning(Ticket.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+# VERSION 7 END
+
 # VERSION 5 START
 # Organiser scans QR code - redeems all unredeemed tickets and confirms legitimacy
 @bp.route("/organiser/scan/<int:order_id>", methods=["GET", "POST"])
@@ -847,20 +737,24 @@ def organiser_scan_ticket(order_id):
     newly_redeemed = []
 
     if request.method == "POST":
-        # Loop through tickets and redeem any that are still valid
-        for ticket in tickets:
-            if not ticket.redeemed and not ticket.refunded:
-                ticket.redeemed = True
-                ticket.redeemed_at = datetime.utcnow()
-                newly_redeemed.append(ticket)
-                # Log each redemption to the audit trail
-                log_action(
-                    action="TICKET_REDEEMED",
-                    entity_type="Ticket",
-                    entity_id=ticket.id,
-                    meta={"ticket_code": ticket.code, "order_id": order.id,
-                          "event_id": order.event_id, "via": "qr_scan"}
-                )
+        # VERSION 7 START
+        # Redeem every ticket that is still valid in one guarded UPDATE
+        redeemed_ids = set(_use_tickets(
+            [t.id for t in tickets if not t.redeemed and not t.refunded],
+            redeemed=True, redeemed_at=datetime.utcnow(),
+        ))
+        newly_redeemed = [t for t in tickets if t.id in redeemed_ids]
+        for ticket in newly_redeemed:
+            # Log each redemption to the audit trail
+            log_action(
+                action="TICKET_REDEEMED",
+                entity_type="Ticket",
+                entity_id=ticket.id,
+                meta={"ticket_code": ticket.code, "order_id": order.id,
+                      "event_id": order.event_id, "via": "qr_scan"}
+            )
+        record_tickets_redeemed(order.event_id, len(newly_redeemed))
+        # VERSION 7 END
         db.session.commit()
         # Expire again so the template reflects the updated redeemed states
         db.session.expire_all()
@@ -875,14 +769,21 @@ def order_receipt(order_id):
     # Get the order safely, retrying if needed
     order = _safe_get_order_or_404(order_id)
     # If the order has no receipt stored, return 404
-    if not order.receipt_pdf:
+    # VERSION 7 START
+    if not order.receipt_pdf_key:
+        abort(404)
+    # Open the stored PDF from the blob store rather than loading it from the order row
+    try:
+        pdf_file = blobs.open(order.receipt_pdf_key)
+    except BlobNotFound:
         abort(404)
+    # VERSION 7 END
 
     # Reference: Flask send_file helper for sending binary responses (Pallets Projects, 2025)
     # https://flask.palletsprojects.com/en/stable/api/#flask.send_file
     # Send the PDF file to the user
     return send_file(
-        io.BytesIO(order.receipt_pdf),
+        pdf_file,
         mimetype="application/pdf",
         as_attachment=True,
         download_name=f"receipt_{order.id}.pdf",
@@ -1108,6 +1009,10 @@ def admin_verify_charity_action(charity_id):
         # Invalid or missing action
         flash("Unknown action.", "danger")
         return redirect(url_for("main.admin_verify"))
+    # VERSION 7 START
+    # The homepage shows the verified charity count (cached stats and the cached page)
+    invalidate_after_commit(PLATFORM_STATS_KEY, tags=(PLATFORM_STATS_TAG,))
+    # VERSION 7 END
     # VERSION 4 START
     log_action(
         action={
@@ -1141,28 +1046,75 @@ def admin_home():
 @bp.route("/admin/reports/allocations")
 @login_required
 def report_allocations():
-    # Fetch all orders that have been paid
-    paid = (
-        db.session.query(Order)
-        .filter(Order.status == "PAID")
-        .order_by(Order.created_at.desc())
+    # VERSION 7 START
+    # Optional date range on the order date (inclusive), as YYYY-MM-DD query parameters
+    date_from = _parse_report_date(request.args.get("from"))
+    date_to = _parse_report_date(request.args.get("to"))
+
+    # Paid orders in the selected range; every figure below is computed by the database
+    paid_q = db.session.query(Order).filter(Order.status == "PAID")
+    if date_from:
+        paid_q = paid_q.filter(Order.created_at >= date_from)
+    if date_to:
+        paid_q = paid_q.filter(Order.created_at < date_to + timedelta(days=1))
+
+    # Summary statistics in one aggregate query
+    totals = paid_q.with_entities(
+        func.count(Order.id),
+        func.coalesce(func.sum(Order.qty), 0),
+        func.coalesce(func.sum(Order.donation_cents), 0),
+        func.coalesce(func.sum(Order.total_cents), 0),
+    ).one()
+    paid_orders_count, tickets_sold, donations_cents, total_cents = (int(v or 0) for v in totals)
+
+    # Allocation per charity: each order total is split by its event's beneficiary percentages
+    alloc_rows = (
+        paid_q
+        .join(EventBeneficiary, EventBeneficiary.event_id == Order.event_id)
+        .join(Charity, Charity.id == EventBeneficiary.charity_id)
+        .with_entities(
+            Charity.id,
+            Charity.name,
+            Charity.charity_number,
+            (func.sum(Order.total_cents * EventBeneficiary.allocation_percent) / 100).label("allocated_cents"),
+        )
+        .group_by(Charity.id, Charity.name, Charity.charity_number)
+        .order_by(text("allocated_cents DESC"))
         .all()
     )
+    # Calculate total allocated amount
+    allocated_total_cents = sum(int(r.allocated_cents or 0) for r in alloc_rows)
 
-    # Initialise totals and table data
-    paid_orders = []
-    paid_orders_count = 0
-    tickets_sold = 0
-    donations_cents = 0
-    total_cents = 0
-
-    # Aggregate order-level statistics
-    for o in paid:
-        paid_orders_count += 1
-        tickets_sold += (o.qty or 0)
-        donations_cents += (o.donation_cents or 0)
-        total_cents += (o.total_cents or 0)
+    # Build allocation rows for the template (already sorted largest first)
+    allocations = []
+    for r in alloc_rows:
+        allocated_cents = int(r.allocated_cents or 0)
+        allocations.append({
+            "charity_name": r.name,
+            "charity_reg": r.charity_number,
+            "allocated_eur": allocated_cents / 100,
+            "share_pct": (allocated_cents / allocated_total_cents * 100) if allocated_total_cents else 0,
+        })
+
+    # Paid orders table: keyset pagination on (created_at, id), newest first.
+    # ?before=<created_at>~<id> continues after the last row of the previous page,
+    # so each page is an index range scan however deep the admin pages.
+    per_page = current_app.config.get("REPORT_ORDERS_PER_PAGE", 100)
+    page_q = paid_q.options(*ORDER_LIST_LOAD)
+    cursor = _parse_keyset_cursor(request.args.get("before"))
+    if cursor:
+        before_ts, before_id = cursor
+        page_q = page_q.filter(Order.created_at <= before_ts, or_(
+            Order.created_at < before_ts,
+            and_(Order.created_at == before_ts, Order.id < before_id),
+        ))
+    page_orders = page_q.order_by(Order.created_at.desc(), Order.id.desc()).limit(per_page + 1).all()
+    has_more = len(page_orders) > per_page
+    page_orders = page_orders[:per_page]
+    next_cursor = f"{page_orders[-1].created_at.isoformat()}~{page_orders[-1].id}" if has_more else None
 
+    paid_orders = []
+    for o in page_orders:
         ev = o.event
         # Build a row for the paid orders table
         paid_orders.append({
@@ -1177,61 +1129,6 @@ def report_allocations():
             "event_date": ev.starts_at.strftime("%Y-%m-%d %H:%M") if ev and ev.starts_at else "",
         })
 
-    # Map to accumulate allocation totals per charity
-    alloc_map = {}  # charity_id -> allocation data
-
-    # Get all event IDs involved in paid orders
-    event_ids = list({o.event_id for o in paid if o.event_id})
-    # Load beneficiary splits for those events (beneficiary split and charity details)
-    ben_rows = (
-        db.session.query(EventBeneficiary, Charity)
-        .join(Charity, Charity.id == EventBeneficiary.charity_id)
-        .filter(EventBeneficiary.event_id.in_(event_ids))
-        .all()
-    )
-
-    # Group beneficiaries by event_id, store charity and %
-    ben_by_event = {}
-    for eb, ch in ben_rows:
-        ben_by_event.setdefault(eb.event_id, []).append((ch, eb.allocation_percent or 0))
-
-    # Distribute each paid order total across its beneficiaries
-    for o in paid:
-        if not o.event_id:
-            continue
-        # Get beneficiary list for this event
-        splits = ben_by_event.get(o.event_id, [])
-        if not splits:
-            continue
-        # Loop through beneficiaries
-        for ch, pct in splits:
-            # Store charity ID in variable
-            key = ch.id
-            # If charity is not in map, create entry
-            alloc_map.setdefault(key, {
-                "charity_name": ch.name,
-                "charity_reg": getattr(ch, "reg_number", None) or getattr(ch, "registration_number", None),
-                "allocated_cents": 0
-            })
-            alloc_map[key]["allocated_cents"] += int((o.total_cents or 0) * (pct / 100.0))
-    # Calculate total allocated amount
-    allocated_total_cents = sum(v["allocated_cents"] for v in alloc_map.values()) or 0
-
-    # Build allocation rows for the template
-    allocations = []
-    for v in alloc_map.values():
-        allocated_eur = v["allocated_cents"] / 100
-        share_pct = (v["allocated_cents"] / allocated_total_cents * 100) if allocated_total_cents else 0
-        allocations.append({
-            "charity_name": v["charity_name"],
-            "charity_reg": v["charity_reg"],
-            "allocated_eur": allocated_eur,
-            "share_pct": share_pct
-        })
-
-    # Sort charities by allocated amount (largest first)
-    allocations.sort(key=lambda x: x["allocated_eur"], reverse=True)
-
     # Summary statistics for the report header
     stats = {
         "paid_orders": paid_orders_count,
@@ -1242,7 +1139,28 @@ def report_allocations():
     }
 
     # Render the allocation report
-    return render_template("report_allocations.html", stats=stats, allocations=allocations, paid_orders=paid_orders,)
+    return render_template("report_allocations.html", stats=stats, allocations=allocations, paid_orders=paid_orders,
+        date_from=request.args.get("from", "") if date_from else "", date_to=request.args.get("to", "") if date_to else "",
+        next_cursor=next_cursor, is_first_page=cursor is None,
+    )
+
+
+def _parse_report_date(value):
+    # Parses a YYYY-MM-DD filter value; anything else means no filter
+    try:
+        return datetime.strptime(value, "%Y-%m-%d") if value else None
+    except ValueError:
+        return None
+
+
+def _parse_keyset_cursor(value):
+    # Parses a "<ISO timestamp>~<id>" keyset cursor; invalid cursors restart from the first page
+    try:
+        ts, order_id = value.rsplit("~", 1)
+        return datetime.fromisoformat(ts), int(order_id)
+    except (AttributeError, ValueError):
+        return None
+# VERSION 7 END
 
 
 # Export audit logs as a CSV file
@@ -1253,57 +1171,62 @@ def audit_export():
     if getattr(current_user, "role", None) != ROLE_ADMIN:
         abort(403)
 
-    # Fetch all audit log entries (newest first)
-    logs = (
-        AuditLog.query
-        .order_by(AuditLog.created_at.desc())
-        .all()
+    # VERSION 7 START
+    # Optional filters: ?from=YYYY-MM-DD&to=YYYY-MM-DD&action=A,B&entity_type=Order&entity_id=12
+    # and ?gzip=1 for a compressed download
+    actions = [a.strip() for a in request.args.get("action", "").split(",") if a.strip()]
+    entity_id = request.args.get("entity_id", type=int)
+    query = audit_export_query(
+        date_from=_parse_report_date(request.args.get("from")),
+        date_to=_parse_report_date(request.args.get("to")),
+        actions=actions or None,
+        entity_type=request.args.get("entity_type", "").strip() or None,
+        entity_id=entity_id,
+        source=audit_source(),
     )
 
-    # Reference: io.StringIO for in-memory text streams (Python Software Foundation, 2025)
-    # https://docs.python.org/3/library/io.html#io.StringIO
-    # Create an in-memory CSV file
-    si = StringIO()
-    # Reference: Python csv module – writing CSV files (Python Software Foundation, 2025)
-    # https://docs.python.org/3/library/csv.html
-    writer = csv.writer(si)
-
-    # Write CSV header row
-    writer.writerow([
-        "timestamp",
-        "actor_id",
-        "actor_role",
-        "action",
-        "entity_type",
-        "entity_id",
-        "meta"
-    ])
-
-    # Write each audit log entry
-    for l in logs:
-        writer.writerow([
-            l.created_at.isoformat(),
-            l.actor_id,
-            l.actor_role,
-            l.action,
-            l.entity_type,
-            l.entity_id,
-            l.meta
-        ])
-
-    # Return CSV as downloadable response
-    output = si.getvalue()
-    si.close()
+    # Reference: Flask streaming responses with stream_with_context (Pallets Projects, 2025)
+    # https://flask.palletsprojects.com/en/stable/patterns/streaming/
+    # The CSV is generated while it is sent, keeping the request context (and session) open
+    chunks = iter_audit_csv(query)
+    if request.args.get("gzip") == "1":
+        body, mimetype, filename = gzip_chunks(chunks), "application/gzip", "audit_logs.csv.gz"
+    else:
+        body, mimetype, filename = chunks, "text/csv", "audit_logs.csv"
 
     # Reference: Flask Response object and custom headers (Pallets Projects – Flask API Documentation, 2025)
     # https://flask.palletsprojects.com/en/stable/api/#flask.Response
     return Response(
-        output,
-        mimetype="text/csv",
+        stream_with_context(body),
+        mimetype=mimetype,
         headers={
-            "Content-Disposition": "attachment; filename=audit_logs.csv"
+            "Content-Disposition": f"attachment; filename={filename}",
+            # Stop proxies buffering the whole download before passing it on
+            "X-Accel-Buffering": "no",
         }
     )
+    # VERSION 7 END
+
+# VERSION 7 START
+# History of one entity (e.g. /admin/audit/entity/Order/42) as JSON, newest first
+@bp.route("/admin/audit/entity/<entity_type>/<int:entity_id>")
+@login_required
+def audit_entity_history(entity_type, entity_id):
+    if getattr(current_user, "role", None) != ROLE_ADMIN:
+        abort(403)
+    limit = min(request.args.get("limit", 100, type=int), 1000)
+    history = [
+        {**row, "created_at": row["created_at"].isoformat() if row["created_at"] else None}
+        for row in entity_history(entity_type, entity_id, limit=limit)
+    ]
+    return {
+        "entity_type": entity_type,
+        "entity_id": entity_id,
+        "history": history,
+        # Months exported by `flask audit-archive` are no longer searched
+        "archived_periods": [[start.isoformat(), end.isoformat()] for start, end in archived_periods()],
+    }
+# VERSION 7 END
 # VERSION 4 END
 
 # Organiser Routes
@@ -1318,6 +1241,45 @@ def _ai_guard():
         return guard
     return None
 
+# VERSION 7 START
+def _wants_event_stream():
+    # Clients that send "Accept: text/event-stream" get the completion as Server-Sent Events;
+    # anything else keeps the original JSON response
+    return request.accept_mimetypes.best_match(["application/json", "text/event-stream"]) == "text/event-stream"
+
+def _sse(event, data):
+    # One Server-Sent Event; the data is JSON so newlines in the text stay inside a single data line
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Reference: Server-sent events format (MDN Web Docs, 2025)
+# https://developer.mozilla.org/en-US/docs/Web/API/Server-sent_events/Using_server-sent_events
+# Reference: Flask streaming contents (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/patterns/streaming/
+# Streams an AI completion as "token" events followed by "done" (or "error"), so the first
+# words reach the organiser as soon as the model produces them
+def _ai_event_stream(messages, **kwargs):
+    # The cache lookup and the user's AI budget are checked before the stream starts, so a refusal
+    # is still a normal JSON error with its own status code
+    try:
+        chunks, cached = cached_chat_stream(messages, user_key=current_user.id, **kwargs)
+    except AIRateLimited as e:
+        return {"ok": False, "error": str(e)}, 429
+
+    def events():
+        try:
+            for chunk in chunks:
+                yield _sse("token", {"text": chunk})
+            yield _sse("done", {"cached": cached})
+        except OpenRouterError as e:
+            yield _sse("error", {"error": str(e)})
+
+    resp = Response(stream_with_context(events()), mimetype="text/event-stream")
+    # Stop proxies (e.g. nginx) and browsers from buffering or caching the stream
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+# VERSION 7 END
+
 # AI route to suggest an event description
 @bp.route("/ai/event-description", methods=["POST"])
 @login_required
@@ -1379,13 +1341,23 @@ def ai_event_description():
         },
     ]
 
+    # VERSION 7 START
+    if _wants_event_stream():
+        return _ai_event_stream(messages, temperature=0.7, max_tokens=220, force_refresh=bool(data.get("force_refresh")))
+    # VERSION 7 END
+
     # Call OpenRouter and return generated description
     try:
         # Send chat-completions style request via OpenRouter using an OpenAI-compatible client
         # Reference: OpenRouter API documentation – OpenAI-compatible chat completions (OpenRouter, 2024)
         # https://openrouter.ai/docs
-        text = chat(messages, temperature=0.7, max_tokens=220)
-        return {"ok": True, "text": text.strip()}
+        # VERSION 7 START
+        # Identical details return the stored description unless the organiser asks for a new one
+        text, cached = cached_chat(messages, temperature=0.7, max_tokens=220, force_refresh=bool(data.get("force_refresh")), user_key=current_user.id)
+        return {"ok": True, "text": text.strip(), "cached": cached}
+    except AIRateLimited as e:
+        return {"ok": False, "error": str(e)}, 429
+        # VERSION 7 END
     except OpenRouterError as e:
         return {"ok": False, "error": str(e)}, 502
 
@@ -1438,10 +1410,21 @@ def ai_ad_suggestions_for_event(event_id):
         },
     ]
 
+    # VERSION 7 START
+    data = request.get_json(silent=True) or {}
+    if _wants_event_stream():
+        return _ai_event_stream(messages, temperature=0.6, max_tokens=650, force_refresh=bool(data.get("force_refresh")))
+    # VERSION 7 END
+
     # Call OpenRouter and return advertising suggestions
     try:
-        text = chat(messages, temperature=0.6, max_tokens=650)
-        return {"ok": True, "text": text.strip()}
+        # VERSION 7 START
+        # Unchanged event details return the stored plan unless the organiser asks for a new one
+        text, cached = cached_chat(messages, temperature=0.6, max_tokens=650, force_refresh=bool(data.get("force_refresh")), user_key=current_user.id)
+        return {"ok": True, "text": text.strip(), "cached": cached}
+    except AIRateLimited as e:
+        return {"ok": False, "error": str(e)}, 429
+        # VERSION 7 END
     except OpenRouterError as e:
         return {"ok": False, "error": str(e)}, 502
 
@@ -1534,8 +1517,15 @@ def event_new():
         # Read uploaded cover image file if provided and store binary data and mimetype on the event
         img = request.files.get('cover_image')
         if img and img.filename:
-            ev.cover_image = img.read()
-            ev.cover_image_mimetype = img.mimetype
+            # VERSION 7 START
+            # The upload is size-checked, stripped and re-encoded, then stored with its resized variants
+            try:
+                cover_bytes, cover_mimetype, original_size = process_cover_upload(img)
+            except CoverImageError as e:
+                flash(str(e), "danger")
+                return render_template("event_new.html", form=form)
+            store_cover_image(ev, cover_bytes, cover_mimetype, original_size)
+            # VERSION 7 END
         # VERSION 5 END
         db.session.add(ev)
         db.session.flush()
@@ -1589,30 +1579,32 @@ def organiser_events():
     )
     
     # Fetch past (completed) events with their analytics data
+    # VERSION 7 START
+    # Reference: SQLAlchemy selectin eager loading (SQLAlchemy, 2025)
+    # https://docs.sqlalchemy.org/en/20/orm/queryguide/relationships.html#select-in-loading
+    # Beneficiaries and their charities are loaded for all past events in two extra queries
     past_events = (
         Event.query
+        .options(selectinload(Event.beneficiaries).selectinload(EventBeneficiary.charity))
         .filter_by(organiser_id=org.id, is_completed=True)
         .order_by(Event.completed_at.desc())
         .all()
     )
-    
+
+    # Paid order totals for every past event from the event_stats rollup, in one query
+    stats_by_event = stats_for_events(ev.id for ev in past_events)
+    # VERSION 7 END
+
     # Calculate analytics for each past event
     past_events_with_reports = []
     for ev in past_events:
-        # Query only paid orders for this event
-        paid_orders_q = Order.query.filter_by(event_id=ev.id, status="PAID")
-        paid_orders_count = paid_orders_q.count()
-        
-        # Calculate totals using SQL aggregation
-        totals = paid_orders_q.with_entities(
-            func.coalesce(func.sum(Order.qty), 0),
-            func.coalesce(func.sum(Order.total_cents), 0),
-            func.coalesce(func.sum(Order.donation_cents), 0),
-        ).first()
-        
-        tickets_sold = int(totals[0] or 0)
-        total_raised_cents = int(totals[1] or 0)
-        donation_total_cents = int(totals[2] or 0)
+        # VERSION 7 START
+        stats = stats_by_event[ev.id]
+        paid_orders_count = stats.paid_orders
+        tickets_sold = stats.tickets_sold
+        total_raised_cents = stats.total_raised_cents
+        donation_total_cents = stats.donation_cents
+        # VERSION 7 END
         avg_order_cents = int(total_raised_cents / paid_orders_count) if paid_orders_count else 0
 
         # Calculate beneficiary allocations
@@ -1636,18 +1628,37 @@ def organiser_events():
         })
 
     # Fetch refund requests for this organiser's events
-    refund_requests = (
+    # VERSION 7 START
+    refunds_q = (
         db.session.query(RefundRequest)
         .join(Order, RefundRequest.order_id == Order.id)
         .join(Event, Order.event_id == Event.id)
         .filter(Event.organiser_id == org.id)
-        .order_by(RefundRequest.requested_at.desc())
+    )
+    # Count pending requests in SQL rather than loading every request
+    pending_refund_count = refunds_q.filter(RefundRequest.status == "PENDING").count()
+    refunds_total = refunds_q.count()
+
+    # One page of requests, newest first, with the order and event each card shows
+    per_page = current_app.config.get("ANALYTICS_ORDERS_PER_PAGE", 50)
+    refund_pages = max((refunds_total + per_page - 1) // per_page, 1)
+    refund_page = min(max(request.args.get("refund_page", 1, type=int), 1), refund_pages)
+    refund_requests = (
+        refunds_q
+        .options(contains_eager(RefundRequest.order).contains_eager(Order.event))
+        .order_by(RefundRequest.requested_at.desc(), RefundRequest.id.desc())
+        .limit(per_page)
+        .offset((refund_page - 1) * per_page)
         .all()
     )
-    pending_refund_count = sum(1 for r in refund_requests if r.status == "PENDING")
+    # VERSION 7 END
     
     # Render organiser events page with both active and past events
-    return render_template("organiser_events.html", active_events=active_events, past_events=past_events_with_reports, org=org, refund_requests=refund_requests, pending_refund_count=pending_refund_count)
+    return render_template("organiser_events.html", active_events=active_events, past_events=past_events_with_reports, org=org, refund_requests=refund_requests, pending_refund_count=pending_refund_count,
+        # VERSION 7 START
+        refund_page=refund_page, refund_pages=refund_pages,
+        # VERSION 7 END
+    )
     # VERSION 5 END
 
 # Edit an existing event owned by the organiser
@@ -1727,12 +1738,17 @@ def organiser_event_edit(event_id):
         # If a new image is uploaded, store the binary data and mimetype on the event
         # If the remove checkbox is ticked and no new image is provided, clear the image
         img = request.files.get('cover_image')
+        # VERSION 7 START
         if img and img.filename:
-            ev.cover_image = img.read()
-            ev.cover_image_mimetype = img.mimetype
+            try:
+                cover_bytes, cover_mimetype, original_size = process_cover_upload(img)
+            except CoverImageError as e:
+                flash(str(e), "danger")
+                return render_template("organiser_event_edit.html", form=form, ev=ev)
+            store_cover_image(ev, cover_bytes, cover_mimetype, original_size)
         elif request.form.get('remove_cover_image') == '1':
-            ev.cover_image = None
-            ev.cover_image_mimetype = None
+            clear_cover_image(ev)
+        # VERSION 7 END
         # VERSION 5 END
 
         # Remove existing beneficiaries
@@ -1802,15 +1818,20 @@ def organiser_ticket_redeem(ticket_id):
         flash("You don't have permission to redeem this ticket.", "danger")
         return redirect(url_for("main.organiser_events"))
     
+    # VERSION 7 START
+    # Mark as redeemed only if it is still unused, then read back its current state
+    redeemed = _use_tickets([ticket.id], redeemed=True, redeemed_at=datetime.utcnow())
+    db.session.refresh(ticket)
+    # VERSION 7 END
     # Check if already redeemed or refunded
-    if ticket.redeemed:
+    if not redeemed and ticket.redeemed:
         flash(f"Ticket {ticket.code} is already redeemed.", "warning")
-    elif ticket.refunded:
+    elif not redeemed:
         flash(f"Ticket {ticket.code} has been refunded and cannot be redeemed.", "warning")
     else:
-        # Mark as redeemed
-        ticket.redeemed = True
-        ticket.redeemed_at = datetime.utcnow()
+        # VERSION 7 START
+        record_tickets_redeemed(order.event_id, len(redeemed))
+        # VERSION 7 END
         db.session.commit()
         
         # Log the action
@@ -1847,15 +1868,20 @@ def organiser_ticket_refund(ticket_id):
         flash("You don't have permission to refund this ticket.", "danger")
         return redirect(url_for("main.organiser_events"))
     
+    # VERSION 7 START
+    # Mark as refunded only if it is still unused, then read back its current state
+    refunded = _use_tickets([ticket.id], refunded=True, refunded_at=datetime.utcnow())
+    db.session.refresh(ticket)
+    # VERSION 7 END
     # Check if already refunded or redeemed
-    if ticket.refunded:
+    if not refunded and ticket.refunded:
         flash(f"Ticket {ticket.code} is already refunded.", "warning")
-    elif ticket.redeemed:
+    elif not refunded:
         flash(f"Ticket {ticket.code} has been redeemed and cannot be refunded.", "warning")
     else:
-        # Mark as refunded
-        ticket.refunded = True
-        ticket.refunded_at = datetime.utcnow()
+        # VERSION 7 START
+        record_tickets_refunded(order.event_id, len(refunded))
+        # VERSION 7 END
         db.session.commit()
         
         # Log the action
@@ -1887,26 +1913,24 @@ def organiser_event_analytics(event_id):
     # Fetch event and verify organiser ownership
     ev, org = _get_event_for_current_organiser_or_404(event_id)
 
-    # Query only paid orders for this event
-    paid_orders_q = Order.query.filter_by(event_id=ev.id, status="PAID")
-    # Count number of paid orders
-    paid_orders_count = paid_orders_q.count()
-    # Calculate totals using SQL aggregation
-    totals = paid_orders_q.with_entities(
-        func.coalesce(func.sum(Order.qty), 0),
-        func.coalesce(func.sum(Order.total_cents), 0),
-        func.coalesce(func.sum(Order.donation_cents), 0),
-    ).first()
-    # Extract totals from tuple
-    tickets_sold = int(totals[0] or 0)
-    total_raised_cents = int(totals[1] or 0)
-    donation_total_cents = int(totals[2] or 0)
+    # VERSION 7 START
+    # Paid order count and totals from the event_stats rollup row
+    stats = stats_for_event(ev.id)
+    paid_orders_count = stats.paid_orders
+    tickets_sold = stats.tickets_sold
+    total_raised_cents = stats.total_raised_cents
+    donation_total_cents = stats.donation_cents
+    # VERSION 7 END
     # Calculate average order value
     avg_order_cents = int(total_raised_cents / paid_orders_count) if paid_orders_count else 0
 
     # Estimate beneficiary allocations based on percentages
     allocations = []
-    for b in ev.beneficiaries:
+    # VERSION 7 START
+    # Load beneficiaries with their charities in one query instead of one per beneficiary
+    beneficiaries = EventBeneficiary.query.options(joinedload(EventBeneficiary.charity)).filter_by(event_id=ev.id).all()
+    for b in beneficiaries:
+    # VERSION 7 END
         allocations.append({
             "charity_name": b.charity.name if b.charity else "Unknown charity",
             "percent": b.allocation_percent,
@@ -1914,28 +1938,51 @@ def organiser_event_analytics(event_id):
         })
     
     # VERSION 5 START
-    # Get all PAID orders for this event with ticket counts
-    orders = (
-        Order.query
-        .filter_by(event_id=ev.id, status="PAID")
-        .order_by(Order.created_at.desc())
+    # VERSION 7 START
+    # Reference: SQLAlchemy aggregate functions with CASE and GROUP BY (SQLAlchemy, 2025)
+    # https://docs.sqlalchemy.org/en/20/core/sqlelement.html#sqlalchemy.sql.expression.case
+    # Ticket status counts for every order, computed by the database in one grouped query
+    ticket_counts = (
+        db.session.query(
+            Ticket.order_id.label("order_id"),
+            func.count(Ticket.id).label("total_tickets"),
+            func.sum(case((Ticket.redeemed == True, 1), else_=0)).label("redeemed_count"),
+            func.sum(case((Ticket.refunded == True, 1), else_=0)).label("refunded_count"),
+        )
+        .join(Order, Order.id == Ticket.order_id)
+        .filter(Order.event_id == ev.id, Order.status == "PAID")
+        .group_by(Ticket.order_id)
+        .subquery()
+    )
+
+    # One page of PAID orders joined to their ticket counts
+    per_page = current_app.config.get("ANALYTICS_ORDERS_PER_PAGE", 50)
+    total_pages = max((paid_orders_count + per_page - 1) // per_page, 1)
+    page = min(max(request.args.get("page", 1, type=int), 1), total_pages)
+    rows = (
+        db.session.query(
+            Order,
+            func.coalesce(ticket_counts.c.total_tickets, 0),
+            func.coalesce(ticket_counts.c.redeemed_count, 0),
+            func.coalesce(ticket_counts.c.refunded_count, 0),
+        )
+        .outerjoin(ticket_counts, ticket_counts.c.order_id == Order.id)
+        .filter(Order.event_id == ev.id, Order.status == "PAID")
+        .order_by(Order.created_at.desc(), Order.id.desc())
+        .limit(per_page)
+        .offset((page - 1) * per_page)
         .all()
     )
-    
-    # Enhance orders with ticket status counts
-    orders_with_tickets = []
-    for order in orders:
-        tickets = Ticket.query.filter_by(order_id=order.id).all()
-        total_tickets = len(tickets)
-        redeemed_count = sum(1 for t in tickets if t.redeemed)
-        refunded_count = sum(1 for t in tickets if t.refunded)
-        
-        orders_with_tickets.append({
+    orders_with_tickets = [
+        {
             "order": order,
-            "total_tickets": total_tickets,
-            "redeemed_count": redeemed_count,
-            "refunded_count": refunded_count,
-        })
+            "total_tickets": int(total_tickets),
+            "redeemed_count": int(redeemed_count),
+            "refunded_count": int(refunded_count),
+        }
+        for order, total_tickets, redeemed_count, refunded_count in rows
+    ]
+    # VERSION 7 END
     # VERSION 5 END
 
     # Render analytics page
@@ -1943,6 +1990,9 @@ def organiser_event_analytics(event_id):
         # VERSION 5 START
         orders=orders_with_tickets, 
         # VERSION 5 END
+        # VERSION 7 START
+        page=page, total_pages=total_pages,
+        # VERSION 7 END
     )
 # VERSION 3 END
 
@@ -1958,12 +2008,12 @@ def organiser_export_payouts(event_id):
     # Verify organiser owns this event
     ev, org = _get_event_for_current_organiser_or_404(event_id)
 
-    # Get all PAID orders for this event
-    paid_orders = Order.query.filter_by(event_id=ev.id, status="PAID").all()
-
-    # Calculate totals
-    total_raised_cents = sum(o.total_cents or 0 for o in paid_orders)
-    tickets_sold = sum(o.qty or 0 for o in paid_orders)
+    # VERSION 7 START
+    # Totals from the event_stats rollup instead of loading every paid order
+    stats = stats_for_event(ev.id)
+    total_raised_cents = stats.total_raised_cents
+    tickets_sold = stats.tickets_sold
+    # VERSION 7 END
 
     # Calculate allocations per beneficiary
     payout_data = []
@@ -2030,56 +2080,17 @@ def organiser_export_payouts(event_id):
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
-# Helper: sends impact summary emails to all unique paid attendees for an event.
-# Returns a dict with emails_sent and emails_failed counts.
-# AI Reference: https://chatgpt.com/share/699701ad-b814-8004-a7e4-87f0f5dcd97e
-def _send_impact_summaries_for_event(ev):
-    paid_orders = Order.query.filter_by(event_id=ev.id, status="PAID").all()
-    if not paid_orders:
-        return {"emails_sent": 0, "emails_failed": 0}
-    total_raised_cents = sum(o.total_cents or 0 for o in paid_orders)
-    total_raised_eur = total_raised_cents / 100
-    tickets_sold = sum(o.qty or 0 for o in paid_orders)
-    allocations = []
-    for beneficiary in ev.beneficiaries:
-        charity_name = beneficiary.charity.name if beneficiary.charity else "Unknown"
-        percent = beneficiary.allocation_percent or 0
-        amount_cents = int(round((total_raised_cents * percent) / 100))
-        allocations.append({
-            "charity_name": charity_name,
-            "percent": percent,
-            "amount_eur": amount_cents / 100,
-        })
-    emails_sent = 0
-    emails_failed = 0
-    sent_to = set()
-    for order in paid_orders:
-        email = order.email.lower()
-        if email in sent_to:
-            continue
-        sent_to.add(email)
-        try:
-            send_impact_summary_email(
-                mail=mail,
-                to_email=email,
-                event_title=ev.title,
-                event_date=ev.starts_at.strftime('%d %B %Y'),
-                user_contribution_eur=order.total_cents / 100,
-                total_raised_eur=total_raised_eur,
-                tickets_sold=tickets_sold,
-                allocations=allocations,
-            )
-            emails_sent += 1
-        except Exception as e:
-            current_app.logger.error(f"Failed to send impact summary to {email}: {e}")
-            emails_failed += 1
-    log_action(
-        action="IMPACT_SUMMARIES_SENT",
-        entity_type="Event",
-        entity_id=ev.id,
-        meta={"event_title": ev.title, "emails_sent": emails_sent, "emails_failed": emails_failed}
-    )
-    return {"emails_sent": emails_sent, "emails_failed": emails_failed}
+# VERSION 7 START
+# Impact summaries are sent by a background job (impact_summaries.py); the analytics page polls this
+@bp.route("/organiser/events/<int:event_id>/impact-summaries/status")
+@login_required
+def impact_summaries_job_status(event_id):
+    guard = require_role(ROLE_ORG, ROLE_ADMIN)
+    if guard:
+        return guard
+    ev, org = _get_event_for_current_organiser_or_404(event_id)
+    return impact_summaries_status(ev.id)
+# VERSION 7 END
 # VERSION 5 END
 
 # VERSION 4 START
@@ -2112,13 +2123,12 @@ def organiser_event_complete(event_id):
 
         # VERSION 5 START
         # Send impact summary emails to all unique paid attendees
-        result = _send_impact_summaries_for_event(ev)
-        
-        emails_sent = result["emails_sent"]
-        if emails_sent > 0:
-            flash(f"Event completed and impact summaries sent to {emails_sent} attendees.", "success")
-        else:
-            flash("Event marked as completed.", "success")
+        # VERSION 7 START
+        # Queued as a background job; the organiser no longer waits for every email to go out
+        if stats_for_event(ev.id).paid_orders > 0:
+            queue_impact_summaries(ev, requested_by=current_user.id)
+            flash("Event completed. Impact summaries are being sent to attendees in the background.", "success")
+        # VERSION 7 END
         # VERSION 5 END
 
     else:
@@ -2207,10 +2217,21 @@ def organiser_event_delete(event_id):
 # VERSION 5 START
 @bp.route("/event/<int:event_id>/cover")
 def event_cover(event_id):
-    ev = Event.query.get_or_404(event_id)
-    if not ev.cover_image:
-        abort(404)
-    return Response(ev.cover_image, mimetype=ev.cover_image_mimetype or 'image/jpeg')
+    # VERSION 7 START
+    # ?size=thumb|card|hero picks a resized variant; ?v=<key prefix> marks the URL as immutable
+    return cover_response(event_id, request.args.get("size"))
+    # VERSION 7 END
+
+# VERSION 7 START
+# Reference: Flask error handlers and RequestEntityTooLarge (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/errorhandling/
+# Bodies over MAX_CONTENT_LENGTH are refused before parsing; send the organiser back to the form
+@bp.app_errorhandler(413)
+def request_too_large(e):
+    limit_mb = current_app.config.get("COVER_MAX_UPLOAD_BYTES", 10 * 1024 * 1024) / (1024 * 1024)
+    flash(f"That upload is too large. Images must be {round(limit_mb, 2):g} MB or smaller.", "danger")
+    return redirect(request.url)
+# VERSION 7 END
 
 @bp.route("/organiser/events/<int:event_id>/send-impact-summaries", methods=["POST"])
 @login_required
@@ -2228,25 +2249,21 @@ def send_event_impact_summaries(event_id):
         flash("Event must be marked as completed before sending impact summaries.", "warning")
         return redirect(url_for("main.organiser_event_analytics", event_id=ev.id))
     
-    # Get all PAID orders for this event
-    paid_orders = Order.query.filter_by(event_id=ev.id, status="PAID").all()
-    
-    if not paid_orders:
+    # VERSION 7 START
+    # Check for PAID orders via the event_stats rollup instead of loading them
+    if not stats_for_event(ev.id).paid_orders:
         flash("No paid orders found for this event.", "info")
         return redirect(url_for("main.organiser_event_analytics", event_id=ev.id))
-    
-    # Send impact summary emails via shared helper
-    result = _send_impact_summaries_for_event(ev)
 
-    # Send email to each unique customer
-    emails_sent = result["emails_sent"]
-    emails_failed = result["emails_failed"]
-    
-    if emails_failed > 0:
-        flash(f"Impact summaries sent to {emails_sent} attendees. {emails_failed} failed.", "warning")
+    # Sent by a background job in batches; progress is shown on the analytics page
+    job = queue_impact_summaries(ev, requested_by=current_user.id)
+    db.session.commit()
+    if job.status == "RUNNING":
+        flash("Impact summaries are already being sent. Progress is shown below.", "info")
     else:
-        flash(f"Impact summaries successfully sent to {emails_sent} attendees!", "success")
-    
+        flash("Impact summaries are being sent in the background to attendees who have not received one yet. Progress is shown below.", "success")
+    # VERSION 7 END
+
     return redirect(url_for("main.organiser_event_analytics", event_id=ev.id))
 
 # USER: View past orders
@@ -2254,12 +2271,15 @@ def send_event_impact_summaries(event_id):
 @login_required
 def my_orders():
     # Show all paid orders belonging to the current user
+    # VERSION 7 START
     orders = (
         Order.query
+        .options(*ORDER_LIST_LOAD)
         .filter_by(user_id=current_user.id, status="PAID")
         .order_by(Order.created_at.desc())
         .all()
     )
+    # VERSION 7 END
     # Attach any existing refund request to each order for display
     orders_data = []
     for order in orders:
@@ -2375,16 +2395,18 @@ def organiser_resolve_refund(req_id):
     )
 
     # Email the user
-    try:
-        send_refund_decision_email(
-            mail=mail,
-            to_email=refund_req.order.email,
-            event_title=refund_req.order.event.title,
-            approved=approved,
-            organiser_note=organiser_note,
-        )
-    except Exception as e:
-        current_app.logger.error(f"Refund decision email failed: {e}")
+    # VERSION 7 START
+    # Queued in the email outbox, which retries failed deliveries; one email per decision
+    subject, body = refund_decision_content(refund_req.order.event.title, approved, organiser_note)
+    queue_email(
+        REFUND_DECISION,
+        refund_req.order.email,
+        subject,
+        body,
+        dedupe_key(REFUND_DECISION, refund_req.id, refund_req.status),
+    )
+    db.session.commit()
+    # VERSION 7 END
 
     flash(f"Refund request {'approved' if approved else 'denied'} and user notified.", "success")
     return redirect(url_for("main.organiser_events") + "#refunds")
@@ -2453,6 +2475,61 @@ def admin_system_health():
         "ok": ai_ok,
         "detail": f"Model: {current_app.config.get('OPENROUTER_MODEL', 'N/A')}" if ai_ok else "OPENROUTER_API_KEY not set"
     })
+    # VERSION 7 START
+    # 4b. Model fallback chain in its current order, with recent error rates and median latency
+    if ai_ok:
+        chain = model_stats.report(model_chain(current_app.config), current_app.config)
+        checks[-1]["detail"] = "Models: " + "; ".join(
+            f"{m['model']} ({m['attempts']} recent calls, {m['error_rate']:.0%} failed"
+            + (f", p50 {m['p50_ms']} ms)" if m["p50_ms"] is not None else ")")
+            for m in chain
+        )
+    # VERSION 7 END
+    # VERSION 7 START
+    # 5. Application cache hit/miss counters (for this worker process)
+    cache_stats = cache.stats()
+    checks.append({
+        "name": "Application Cache",
+        "ok": True,
+        "detail": f"{cache_stats['backend']} backend: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)",
+    })
+    # 6. Stored AI responses (shared by all workers); the table is missing until upgrade-schema has run
+    try:
+        ai_stats = ai_cache_stats()
+        checks.append({
+            "name": "AI Response Cache",
+            "ok": True,
+            "detail": f"{ai_stats['entries']} responses ({ai_stats['bytes'] / 1024:.0f} KB), {ai_stats['hits']} repeat requests served",
+        })
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        checks.append({"name": "AI Response Cache", "ok": False, "detail": str(e)[:120]})
+    # 7. AI gateway queue depth and upstream latency (for this worker process)
+    gw = gateway.stats()
+    upstream = gw["upstream_ms"]
+    checks.append({
+        "name": "AI Gateway",
+        "ok": gw["waiting"] == 0,
+        "detail": (
+            f"{gw['active']} running, {gw['waiting']} queued; {gw['upstream_calls']} upstream calls, "
+            f"{gw['coalesced']} coalesced, {gw['rate_limited']} rate-limited, {gw['errors']} failed; "
+            + (f"upstream p50/p95/p99 {upstream['p50']}/{upstream['p95']}/{upstream['p99']} ms" if gw["samples"] else "no calls yet")
+        ),
+    })
+    # 8. Email outbox backlog (all workers) and delivery throughput (this worker process)
+    ob = outbox_stats()
+    worker = ob["worker"]
+    checks.append({
+        "name": "Email Outbox",
+        "ok": ob["oldest_due_seconds"] < 600,
+        "detail": (
+            f"{ob['pending']} waiting (oldest due {ob['oldest_due_seconds']}s ago), {ob['sending']} sending, "
+            f"{ob['sent_last_hour']} sent in the last hour, {ob['failed']} failed; this worker: "
+            f"{worker['sent']} sent, {worker['retried']} retried, {worker['failed']} failed"
+            + (f", {worker['per_second']} emails/s" if worker["per_second"] else "")
+        ),
+    })
+    # VERSION 7 END
     return render_template("admin_system_health.html", checks=checks)
 
 # Admin platform-wide analytics dashboard
@@ -2471,16 +2548,14 @@ def admin_analytics():
     verified_organisers = Organiser.query.filter_by(verified=True).count()
     verified_charities = Charity.query.filter_by(verified=True).count()
     # Financial totals from paid orders
-    paid_orders_count = Order.query.filter_by(status="PAID").count()
-    total_revenue_cents = db.session.query(
-        func.coalesce(func.sum(Order.total_cents), 0)
-    ).filter(Order.status == "PAID").scalar()
-    total_donations_cents = db.session.query(
-        func.coalesce(func.sum(Order.donation_cents), 0)
-    ).filter(Order.status == "PAID").scalar()
-    total_tickets_sold = db.session.query(
-        func.coalesce(func.sum(Order.qty), 0)
-    ).filter(Order.status == "PAID").scalar()
+    # VERSION 7 START
+    # Summed from the event_stats rollup (one row per event) rather than from every order
+    totals = platform_totals()
+    paid_orders_count = totals.paid_orders
+    total_revenue_cents = totals.total_raised_cents
+    total_donations_cents = totals.donation_cents
+    total_tickets_sold = totals.tickets_sold
+    # VERSION 7 END
     metrics = {
         "total_users": total_users,
         "total_events": total_events,
@@ -2504,12 +2579,15 @@ def admin_failed_payments():
     if getattr(current_user, "role", None) != ROLE_ADMIN:
         abort(403)
     # Fetch all orders that are NOT paid - these represent failed or abandoned payments
+    # VERSION 7 START
     failed_orders = (
         Order.query
+        .options(*ORDER_LIST_LOAD)
         .filter(Order.status != "PAID")
         .order_by(Order.created_at.desc())
         .all()
     )
+    # VERSION 7 END
     return render_template("admin_failed_payments.html", orders=failed_orders)
 # VERSION 6 END
 
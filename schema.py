@@ -0,0 +1,48 @@
+# VERSION 7 START
+# This file brings an existing database up to date with the models.
+# db.create_all only creates missing tables, so new columns and indexes on existing tables
+# are added here. It never drops or changes existing columns, so it is safe to run on every deploy.
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+
+from models import db
+
+
+def upgrade_schema(echo=print):
+    # Creates missing tables, then adds missing columns and indexes to existing ones
+    db.create_all()
+    insp = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+
+    for table in db.metadata.sorted_tables:
+        existing_cols = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing_cols:
+                continue
+            col_type = col.type.compile(dialect=db.engine.dialect)
+            # Added columns are always nullable: existing rows have no value for them
+            db.session.execute(text(f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(col.name)} {col_type}"))
+            echo(f"Added column {table.name}.{col.name}")
+        db.session.commit()
+
+        existing_indexes = {ix["name"] for ix in insp.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            # Reference: SQLAlchemy Index.create (SQLAlchemy, 2025)
+            # https://docs.sqlalchemy.org/en/20/core/constraints.html#sqlalchemy.schema.Index.create
+            index.create(bind=db.engine, checkfirst=True)
+            echo(f"Created index {index.name}")
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("upgrade-schema")
+@with_appcontext
+def upgrade_schema_command():
+    # Add new tables, columns and indexes to the configured database (run from build.sh)
+    upgrade_schema(echo=click.echo)
+    click.echo("Database schema is up to date.")
+# VERSION 7 END
@@ -0,0 +1,173 @@
+# VERSION 7 START
+# This file runs the background sweeper that auto-completes stale events.
+# Events that started more than 7 days ago and were never marked complete are closed off here,
+# instead of scanning the event table before every single request.
+
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, text
+
+from models import db, Event
+from audit import record_audit_entries, load_audit_spool
+from page_cache import invalidate_event_pages_after_commit
+from audit_storage import maintain_audit_storage
+from ai_cache import evict_ai_cache
+from outbox import compact_outbox
+
+# Events are auto-completed this long after their start time
+STALE_AFTER = timedelta(days=7)
+
+# Reference: PostgreSQL advisory lock functions (PostgreSQL, 2025)
+# https://www.postgresql.org/docs/current/functions-admin.html#FUNCTIONS-ADVISORY-LOCKS
+# Fixed key so every gunicorn worker competes for the same lock
+SWEEPER_LOCK_KEY = 7301
+
+
+def _try_sweeper_lock():
+    # Take a transaction-level advisory lock so only one worker sweeps at a time.
+    # The lock is released automatically when the transaction commits or rolls back.
+    if db.engine.dialect.name != "postgresql":
+        # SQLite (local dev) has no advisory locks; the UPDATE below is safe to run twice anyway
+        return True
+    return bool(db.session.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": SWEEPER_LOCK_KEY}).scalar())
+
+
+def complete_stale_events(batch_size=None):
+    # Marks stale events as completed in batches and writes their audit rows in bulk.
+    # Returns the number of events completed, or None if another worker holds the lock.
+    batch_size = batch_size or current_app.config.get("SWEEPER_BATCH_SIZE", 500)
+    cutoff = datetime.utcnow() - STALE_AFTER
+    completed = 0
+
+    while True:
+        if not _try_sweeper_lock():
+            db.session.rollback()
+            return completed or None
+
+        # Pick the next batch of stale event IDs
+        batch_ids = (
+            select(Event.id)
+            .where(Event.is_completed == False, Event.starts_at != None, Event.starts_at < cutoff)
+            .order_by(Event.id)
+            .limit(batch_size)
+        )
+
+        # Reference: SQLAlchemy UPDATE..RETURNING (SQLAlchemy, 2025)
+        # https://docs.sqlalchemy.org/en/20/core/dml.html#sqlalchemy.sql.expression.Update.returning
+        # Only rows that were still incomplete are returned, so a concurrent sweep never double-logs
+        rows = db.session.execute(
+            update(Event)
+            .where(Event.id.in_(batch_ids), Event.is_completed == False)
+            .values(is_completed=True, completed_at=datetime.utcnow())
+            .returning(Event.id, Event.title)
+            .execution_options(synchronize_session=False)
+        ).all()
+
+        # Audit rows for the batch go through the buffered audit writer (one bulk insert at commit)
+        if rows:
+            record_audit_entries([
+                {
+                    "actor_id": None,
+                    "actor_role": "system",
+                    "action": "EVENT_AUTO_COMPLETED",
+                    "entity_type": "Event",
+                    "entity_id": event_id,
+                    "meta": {"title": title, "reason": "7 days past start time"},
+                    "created_at": datetime.utcnow(),
+                }
+                for event_id, title in rows
+            ])
+            # The bulk UPDATE bypasses the ORM, so drop the cached public pages explicitly
+            invalidate_event_pages_after_commit([event_id for event_id, _ in rows])
+        db.session.commit()
+
+        completed += len(rows)
+        # A short batch means there is nothing left to sweep
+        if len(rows) < batch_size:
+            return completed
+
+
+class StaleEventSweeper:
+    # Runs complete_stale_events on a fixed interval in a daemon thread inside each app process.
+
+    def __init__(self):
+        self._thread = None
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        # Register the CLI command only. The scheduler thread is started by start_background_threads()
+        # when the app is actually served, never from `flask` commands or the build script.
+        app.cli.add_command(sweep_stale_events_command)
+
+    def start(self, app):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        # Reference: Python threading – daemon threads (Python Software Foundation, 2025)
+        # https://docs.python.org/3/library/threading.html#thread-objects
+        self._thread = threading.Thread(target=self._run, args=(app,), name="stale-event-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, app):
+        interval = app.config.get("SWEEPER_INTERVAL_SECONDS", 300)
+        # Sweep once at startup, then every interval until stopped
+        while True:
+            with app.app_context():
+                try:
+                    count = complete_stale_events()
+                    if count:
+                        app.logger.info(f"Sweeper auto-completed {count} stale events")
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Stale event sweep failed")
+                # Keep upcoming audit partitions in place (conversion is a one-time manual command)
+                try:
+                    maintain_audit_storage(convert=False, echo=app.logger.info)
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Audit partition maintenance failed")
+                # Bulk-load audit entries spooled to disk (AUDIT_WRITE_MODE=file)
+                try:
+                    load_audit_spool(echo=app.logger.warning)
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Loading the audit spool failed")
+                # Drop expired AI responses
+                try:
+                    evict_ai_cache()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("AI response cache eviction failed")
+                # Drop the bodies of old sent emails (their dedupe keys are kept)
+                try:
+                    compact_outbox()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Email outbox compaction failed")
+            if self._stop.wait(interval):
+                return
+
+
+sweeper = StaleEventSweeper()
+
+
+# Reference: Flask custom CLI commands (Pallets Projects, 2025)
+# https://flask.palletsprojects.com/en/stable/cli/#custom-commands
+@click.command("sweep-stale-events")
+@with_appcontext
+@click.option("--batch-size", default=None, type=int, help="Events completed per UPDATE statement.")
+def sweep_stale_events_command(batch_size):
+    # Run one sweep from the command line (e.g. from a cron job)
+    count = complete_stale_events(batch_size)
+    if count is None:
+        click.echo("Another worker is already sweeping; skipped.")
+    else:
+        click.echo(f"Auto-completed {count} stale events.")
+# VERSION 7 END
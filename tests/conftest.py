@@ -0,0 +1,132 @@
+# VERSION 7 START
+# Shared pytest fixtures: an app on an in-memory SQLite database, seeded users and orders,
+# and a recorder for the SQL each request runs.
+# Run from the project root:
+#     python -m pytest -q
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+# Make the project modules importable when pytest is run from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from models import db, User, Organiser, Event, Order, Ticket, ROLE_USER, ROLE_ORG, ROLE_ADMIN
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    # Reference: Flask testing fixtures (Pallets Projects, 2025)
+    # https://flask.palletsprojects.com/en/stable/testing/
+    # Config reads the environment at import time, so point the class at a private in-memory database.
+    # Flask-SQLAlchemy gives in-memory SQLite a single shared connection, which takes no pool size options.
+    monkeypatch.setattr(Config, "SQLALCHEMY_DATABASE_URI", "sqlite://")
+    monkeypatch.setattr(Config, "SQLALCHEMY_ENGINE_OPTIONS", {})
+    monkeypatch.setattr(Config, "BLOB_STORAGE_BACKEND", "local")
+    monkeypatch.setattr(Config, "BLOB_STORAGE_PATH", str(tmp_path / "blobs"))
+    monkeypatch.setattr(Config, "AUDIT_SPOOL_PATH", str(tmp_path / "audit_spool"))
+    monkeypatch.setattr(Config, "SWEEPER_ENABLED", False)
+    monkeypatch.setattr(Config, "JOBS_IN_PROCESS_WORKER", False)
+
+    from app import create_app
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, user_id):
+    # Log the test client in as this user (Flask-Login session keys)
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(user_id)
+        sess["_fresh"] = True
+
+
+def add_user(email, role):
+    user = User(email=email, role=role, name=email.split("@")[0])
+    user.set_password("password")
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def add_event(organiser, title, paid_orders=0, tickets_per_order=2, buyer=None, **values):
+    # An event with `paid_orders` PAID orders, each with its tickets
+    ev = Event(
+        organiser_id=organiser.id,
+        title=title,
+        description=f"{title} description " * 20,
+        venue="Dublin",
+        starts_at=values.pop("starts_at", datetime.utcnow() + timedelta(days=7)),
+        ticket_price_cents=1000,
+        published=True,
+        **values,
+    )
+    db.session.add(ev)
+    db.session.flush()
+    for i in range(paid_orders):
+        order = Order(
+            event_id=ev.id,
+            user_id=buyer.id if buyer else None,
+            email=buyer.email if buyer else f"buyer{i}@example.com",
+            qty=tickets_per_order,
+            total_cents=1000 * tickets_per_order,
+            status="PAID",
+            consent_checkout_at=datetime.utcnow(),
+            consent_checkout_ip="127.0.0.1",
+            consent_checkout_ua="pytest",
+        )
+        db.session.add(order)
+        db.session.flush()
+        db.session.add_all(Ticket(order_id=order.id, code=f"T{order.id}-{n}") for n in range(tickets_per_order))
+    return ev
+
+
+@pytest.fixture
+def seeded(app):
+    # One account per role and enough data for every list page to render rows:
+    # a published event, a buyer with paid orders and a failed payment for the admin page
+    with app.app_context():
+        admin = add_user("admin@example.com", ROLE_ADMIN)
+        buyer = add_user("buyer@example.com", ROLE_USER)
+        org_user = add_user("organiser@example.com", ROLE_ORG)
+        organiser = Organiser(user_id=org_user.id, organisation_name="Test Organiser", verified=True, status="approved")
+        db.session.add(organiser)
+        db.session.flush()
+        ev = add_event(organiser, "Charity Gala", paid_orders=2, buyer=buyer)
+        db.session.add(Order(event_id=ev.id, email="declined@example.com", qty=1, total_cents=1000, status="FAILED",
+                             consent_checkout_at=datetime.utcnow(), consent_checkout_ip="127.0.0.1", consent_checkout_ua="pytest"))
+        db.session.commit()
+        return {"admin": admin.id, "buyer": buyer.id, "organiser_user": org_user.id, "organiser": organiser.id, "event": ev.id}
+
+
+@pytest.fixture
+def sql_statements(app):
+    # Every SQL statement sent to the database while the test runs, in order
+    # Reference: SQLAlchemy before_cursor_execute event (SQLAlchemy, 2025)
+    # https://docs.sqlalchemy.org/en/20/core/events.html#sqlalchemy.events.ConnectionEvents.before_cursor_execute
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", _record)
+    yield statements
+    event.remove(engine, "before_cursor_execute", _record)
+# VERSION 7 END
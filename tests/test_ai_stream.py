@@ -0,0 +1,107 @@
+# VERSION 7 START
+# Server-Sent Events framing of the AI routes, against the local fake-llm server on an ephemeral port.
+
+import json
+
+import pytest
+
+from fake_llm import start_fake_llm
+from openrouter_client import client_manager
+from conftest import login
+
+SSE_HEADERS = {"Accept": "text/event-stream"}
+
+
+@pytest.fixture
+def fake_llm(app):
+    server = start_fake_llm(port=0, token_delay=0, first_token_delay=0)
+    app.config.update(
+        OPENROUTER_BASE_URL=f"http://127.0.0.1:{server.server_port}/v1",
+        OPENROUTER_API_KEY="test",
+        OPENROUTER_MODELS="fake-model",
+        OPENROUTER_MAX_RETRIES=0,
+        # No per-user budget unless a test sets one
+        AI_USER_CALLS_PER_MINUTE=0,
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+    client_manager.close()
+
+
+def parse_sse(body):
+    # Splits a text/event-stream body into (event, data) pairs, checking each event's framing:
+    # exactly one "event:" line and one "data:" line holding JSON, events separated by a blank line
+    assert body.endswith("\n\n")
+    events = []
+    for block in body[:-2].split("\n\n"):
+        lines = block.split("\n")
+        assert len(lines) == 2, block
+        assert lines[0].startswith("event: ") and lines[1].startswith("data: "), block
+        events.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+    return events
+
+
+def _post(client, path, json_body):
+    resp = client.post(path, json=json_body, headers=SSE_HEADERS)
+    return resp, resp.get_data(as_text=True)
+
+
+def test_event_description_streams_tokens_then_done(client, seeded, fake_llm):
+    login(client, seeded["organiser_user"])
+    resp, body = _post(client, "/ai/event-description", {"title": "Winter Gala", "venue": "Cork"})
+
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+    assert resp.headers["Cache-Control"] == "no-cache"
+    events = parse_sse(body)
+    names = [name for name, _ in events]
+    # One event per word from the fake server, then a single "done"
+    assert names[-1] == "done" and names[:-1] == ["token"] * (len(names) - 1) and len(names) > 2
+    assert events[-1][1] == {"cached": False}
+    text = "".join(data["text"] for name, data in events if name == "token")
+    assert text.startswith("This is a locally generated reply to: Write 90")
+
+    # The same request again is answered from the AI cache as one token
+    events = parse_sse(_post(client, "/ai/event-description", {"title": "Winter Gala", "venue": "Cork"})[1])
+    assert [name for name, _ in events] == ["token", "done"]
+    assert events[0][1]["text"] == text.strip() and events[1][1] == {"cached": True}
+
+
+def test_ad_suggestions_streams_tokens_then_done(client, seeded, fake_llm):
+    login(client, seeded["organiser_user"])
+    resp, body = _post(client, f"/ai/ad-suggestions/{seeded['event']}", {})
+
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+    events = parse_sse(body)
+    assert events[-1] == ("done", {"cached": False})
+    text = "".join(data["text"] for name, data in events if name == "token")
+    assert text.startswith("This is a locally generated reply to: Create an advertising plan for: Title: Charity Gala")
+
+
+def test_upstream_failure_ends_the_stream_with_an_error_event(app, client, seeded, fake_llm):
+    # The fake server answers models named "...:fail" with HTTP 503
+    app.config.update(OPENROUTER_MODELS="fake-model:fail")
+    login(client, seeded["organiser_user"])
+    resp, body = _post(client, f"/ai/ad-suggestions/{seeded['event']}", {"force_refresh": True})
+
+    assert resp.status_code == 200
+    events = parse_sse(body)
+    assert [name for name, _ in events] == ["error"]
+    assert "overloaded" in events[0][1]["error"]
+
+
+def test_rate_limited_user_gets_json_429(app, client, seeded, fake_llm):
+    # One call allowed, refilled far too slowly for a second one
+    app.config.update(AI_USER_BURST=1, AI_USER_CALLS_PER_MINUTE=0.001)
+    login(client, seeded["organiser_user"])
+    first, _ = _post(client, "/ai/event-description", {"title": "Spring Fair", "force_refresh": True})
+    assert first.status_code == 200
+
+    resp, _ = _post(client, "/ai/event-description", {"title": "Spring Fair", "force_refresh": True})
+    # Refused before the stream starts, so it is a plain JSON error rather than an event
+    assert resp.status_code == 429
+    assert resp.mimetype == "application/json"
+    assert resp.get_json()["ok"] is False
+# VERSION 7 END
@@ -0,0 +1,40 @@
+# VERSION 7 START
+# The organiser analytics page must run a fixed number of queries however many orders the event has
+# (ticket counts come from one grouped query, not one query per order).
+
+from flask import url_for
+
+from query_checks import LIST_ROUTES
+from models import db, Organiser
+from conftest import add_event, login
+
+# Query budget declared for check-list-queries
+MAX_QUERIES = next(budget for endpoint, _setup, _allowed, budget in LIST_ROUTES if endpoint == "main.organiser_event_analytics")
+
+
+def _analytics_queries(app, client, sql_statements, organiser_user_id, paid_orders):
+    # Adds an event with `paid_orders` paid orders and returns the statements its analytics page runs
+    with app.app_context():
+        organiser = Organiser.query.filter_by(user_id=organiser_user_id).one()
+        ev = add_event(organiser, f"Event with {paid_orders} orders", paid_orders=paid_orders, tickets_per_order=3)
+        db.session.commit()
+        event_id = ev.id
+    with app.test_request_context():
+        path = url_for("main.organiser_event_analytics", event_id=event_id)
+    login(client, organiser_user_id)
+
+    sql_statements.clear()
+    resp = client.get(path)
+    assert resp.status_code == 200
+    # The last seeded order is on the page, so the page really listed them
+    assert f"buyer{paid_orders - 1}@example.com" in resp.get_data(as_text=True)
+    return list(sql_statements)
+
+
+def test_analytics_query_count_does_not_grow_with_orders(app, client, seeded, sql_statements):
+    small = _analytics_queries(app, client, sql_statements, seeded["organiser_user"], 2)
+    large = _analytics_queries(app, client, sql_statements, seeded["organiser_user"], 40)
+
+    assert len(small) == len(large), f"{len(small)} queries for 2 orders, {len(large)} for 40"
+    assert len(large) <= MAX_QUERIES
+# VERSION 7 END
@@ -0,0 +1,30 @@
+# VERSION 7 START
+# Queueing impact summary jobs: one job per run, never two waiting for the same event.
+
+from impact_summaries import queue_impact_summaries
+from jobs import enqueue
+from models import db, Event, Job
+
+
+def test_runs_are_keyed_per_event_and_not_duplicated(app, seeded):
+    with app.app_context():
+        ev = db.session.get(Event, seeded["event"])
+        first = queue_impact_summaries(ev)
+        db.session.commit()
+        # A second click while the job waits gets the same job back
+        assert queue_impact_summaries(ev).id == first.id
+        assert first.idempotency_key == f"impact-summaries:{ev.id}:1"
+
+        first.status = "DONE"
+        db.session.commit()
+        second = queue_impact_summaries(ev)
+        db.session.commit()
+        assert second.id != first.id
+        assert second.idempotency_key == f"impact-summaries:{ev.id}:2"
+
+        # A request that looked before the second run was queued computes the same key, so it
+        # gets the existing job rather than a duplicate
+        again = enqueue("impact_summaries", {"event_id": ev.id}, idempotency_key=second.idempotency_key)
+        assert again.id == second.id
+        assert Job.query.filter_by(kind="impact_summaries").count() == 2
+# VERSION 7 END
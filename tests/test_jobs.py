@@ -0,0 +1,35 @@
+# VERSION 7 START
+# Recovery of jobs whose worker died while running them.
+
+from datetime import datetime, timedelta
+
+from jobs import requeue_stale_jobs
+from models import db, Job
+
+
+def _running_job(key, attempts, max_attempts, locked_minutes_ago):
+    job = Job(kind="render_receipt", payload={}, idempotency_key=key, status="RUNNING", attempts=attempts,
+              max_attempts=max_attempts, locked_by="dead-worker", locked_at=datetime.utcnow() - timedelta(minutes=locked_minutes_ago))
+    db.session.add(job)
+    return job
+
+
+def test_stale_jobs_are_retried_with_backoff_or_failed(app):
+    app.config.update(JOB_LOCK_TIMEOUT_SECONDS=600, JOB_BACKOFF_SECONDS=30)
+    with app.app_context():
+        retry = _running_job("retry", attempts=2, max_attempts=5, locked_minutes_ago=30)
+        exhausted = _running_job("exhausted", attempts=5, max_attempts=5, locked_minutes_ago=30)
+        fresh = _running_job("fresh", attempts=1, max_attempts=5, locked_minutes_ago=1)
+        db.session.commit()
+        before = datetime.utcnow()
+
+        assert requeue_stale_jobs() == 2
+        db.session.expire_all()
+
+        assert retry.status == "QUEUED" and retry.locked_by is None
+        # Second attempt lost: waits twice the base backoff before it can be claimed again
+        assert retry.run_at >= before + timedelta(seconds=60)
+        assert retry.last_error
+        assert exhausted.status == "FAILED" and exhausted.finished_at is not None
+        assert fresh.status == "RUNNING" and fresh.locked_by == "dead-worker"
+# VERSION 7 END
@@ -0,0 +1,50 @@
+# VERSION 7 START
+# The list pages must not select deferred or binary columns (event descriptions, checkout consent
+# details, blobs) they do not show. Each page is requested against seeded data and every SELECT it
+# runs is checked, using the same column rules as `flask check-list-queries`.
+
+import pytest
+from flask import url_for
+
+from query_checks import LIST_ROUTES, heavy_columns, selected_heavy_columns
+from conftest import login
+
+# Deferred columns each page is allowed to load, as declared for check-list-queries
+ALLOWED = {endpoint: allowed for endpoint, _setup, allowed, _budget in LIST_ROUTES}
+
+# (endpoint, account to log in as or None, text the seeded data puts on the page)
+LIST_PAGES = [
+    ("main.index", None, "Charity Gala"),
+    ("main.events_list", None, "Charity Gala"),
+    ("main.my_orders", "buyer", "Charity Gala"),
+    ("main.admin_failed_payments", "admin", "declined@example.com"),
+]
+
+
+@pytest.mark.parametrize("endpoint, account, expected", LIST_PAGES, ids=[p[0] for p in LIST_PAGES])
+def test_list_page_selects_no_heavy_columns(app, client, seeded, sql_statements, endpoint, account, expected):
+    if account:
+        login(client, seeded[account])
+    with app.test_request_context():
+        path = url_for(endpoint)
+        heavy = heavy_columns() - ALLOWED[endpoint]
+
+    sql_statements.clear()
+    resp = client.get(path)
+
+    assert resp.status_code == 200
+    # The seeded rows must be on the page, otherwise the check below proves nothing
+    assert expected in resp.get_data(as_text=True)
+    selects = [s for s in sql_statements if s.lstrip().upper().startswith("SELECT")]
+    assert selects
+    assert selected_heavy_columns(selects, heavy) == set()
+
+
+def test_heavy_column_detection(app):
+    # Guard for the helper itself: a plain SELECT of a deferred column must be reported
+    with app.app_context():
+        heavy = heavy_columns()
+    assert "event.description" in heavy
+    assert selected_heavy_columns(['SELECT event.id, event.description FROM event'], heavy) == {"event.description"}
+    assert selected_heavy_columns(['SELECT event.id, event.title FROM event'], heavy) == set()
+# VERSION 7 END
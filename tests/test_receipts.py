@@ -0,0 +1,51 @@
+# VERSION 7 START
+# The pre-rendered receipt layout must produce the same page as drawing it with ReportLab calls.
+
+import base64
+import io
+import re
+import zlib
+from datetime import datetime
+from types import SimpleNamespace
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from receipts import ReceiptTemplate, build_receipt_pdf
+
+
+def _page_text(pdf):
+    # Text shown on the page: the (...) Tj strings of every ASCII85 + Flate content stream
+    text = []
+    for stream in re.findall(rb"stream\r?\n(.*?)endstream", pdf, re.S):
+        data = zlib.decompress(base64.a85decode(stream.strip(), adobe=True))
+        text += re.findall(rb"\((.*?)\) Tj", data)
+    return text
+
+
+def _order():
+    ev = SimpleNamespace(id=1, title="Winter Gala", starts_at=datetime(2030, 1, 1, 19, 0))
+    return SimpleNamespace(id=7, event=ev, created_at=datetime(2029, 12, 1, 12, 0), email="donor@example.com",
+                           qty=2, donation_cents=500, total_cents=3500)
+
+
+def test_prerendered_layout_matches_drawn_layout():
+    order = _order()
+    url = "https://charityconnect.example/organiser/scan/7"
+    cached = build_receipt_pdf(order, verify_url=url, template=ReceiptTemplate(order.event))
+    drawn = build_receipt_pdf(order, verify_url=url, template=ReceiptTemplate(order.event, prerender=False))
+
+    assert _page_text(cached) == _page_text(drawn)
+    assert b"Event: Winter Gala" in _page_text(cached)
+
+
+def test_layout_is_drawn_when_fonts_are_numbered_differently():
+    # A canvas that registered fonts in another order cannot reuse the copied /F names
+    tpl = ReceiptTemplate(_order().event)
+    c = canvas.Canvas(io.BytesIO(), pagesize=A4)
+    c.setFont("Helvetica-Oblique", 8)
+    start = len(c._code)
+    tpl.draw_static(c)
+    assert tpl.static_ops not in c._code[start:]
+    assert any("CharityConnect Receipt" in op for op in c._code[start:])
+# VERSION 7 END